@@ -8,13 +8,26 @@ import hashlib
 import os
 import json
 import threading
+import queue
 import time
+import heapq
+import random
 import signal
+import socket
 import sys
 from datetime import datetime, timedelta
-from email_processor import EmailProcessor, test_email_connection
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email_processor import (EmailProcessor, ExtractionPool, IMAPConnectionPool, RulePack, active_rules,
+                             install_rules, test_email_connection)
+from message_cache import MessageCache
 import atexit
 
+# ExtractionPool workers are spawned, and spawn re-imports the main script as
+# __mp_main__. When that script is app.py the worker only needs the
+# extraction code, so the database setup and shutdown hooks below are skipped
+SPAWNED_WORKER = __name__ == '__mp_main__'
+
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'smartmail-secret-key-change-in-production')
@@ -23,6 +36,70 @@ app.secret_key = os.environ.get('SECRET_KEY', 'smartmail-secret-key-change-in-pr
 DATA_DIR = os.environ.get('DATA_DIR', 'instance')
 app.config['DATABASE'] = os.path.join(DATA_DIR, 'expenses.db')
 app.config['EMAIL_DB'] = os.path.join(DATA_DIR, 'email_configs.db')
+
+# Messages per IMAP FETCH round trip — tune against each provider's limits
+IMAP_FETCH_CHUNK_SIZE = int(os.environ.get('IMAP_FETCH_CHUNK_SIZE', 40))
+
+# Let the IMAP server drop non-transaction mail in SEARCH (X-GM-RAW on Gmail).
+# Opt-in: mail the server query misses is passed by the UID high-water mark and
+# never looked at again, even after turning this back off
+IMAP_SERVER_FILTER = os.environ.get('IMAP_SERVER_FILTER', '0').lower() in ('1', 'true', 'yes')
+
+# Accounts synced in parallel per cycle, and how long one account may take
+EMAIL_SYNC_WORKERS = int(os.environ.get('EMAIL_SYNC_WORKERS', 4))
+EMAIL_SYNC_ACCOUNT_TIMEOUT = int(os.environ.get('EMAIL_SYNC_ACCOUNT_TIMEOUT', 120))
+
+# Where IMAP sync runs: 'thread' inside the web process, or 'worker' when
+# sync_worker.py runs as its own process and the web app only serves requests
+EMAIL_SYNC_MODE = os.environ.get('EMAIL_SYNC_MODE', 'thread').lower()
+
+# Seconds a sync process's account leases last without a heartbeat before
+# another process takes those accounts over
+EMAIL_LEASE_TTL = int(os.environ.get('EMAIL_LEASE_TTL', 90))
+
+# Ingest pipeline between IMAP fetch and SQLite: extractor threads, bounded
+# queue depth between stages, and most emails the writer commits at once
+EMAIL_EXTRACT_WORKERS = int(os.environ.get('EMAIL_EXTRACT_WORKERS', 2))
+EMAIL_PIPELINE_QUEUE_SIZE = int(os.environ.get('EMAIL_PIPELINE_QUEUE_SIZE', 200))
+EMAIL_WRITE_BATCH_SIZE = int(os.environ.get('EMAIL_WRITE_BATCH_SIZE', 100))
+
+# Compressed cache of fetched email text under DATA_DIR/message_cache, so
+# reprocess.py can rerun extraction without IMAP (0 disables it)
+EMAIL_CACHE_MAX_MB = int(os.environ.get('EMAIL_CACHE_MAX_MB', 256))
+
+# Circuit breaker for failing mailboxes: first retry delay and cap (seconds,
+# doubled per consecutive failure with jitter), and how many rejected logins
+# in a row mark an account as needing a new app password
+EMAIL_BACKOFF_BASE = int(os.environ.get('EMAIL_BACKOFF_BASE', 60))
+EMAIL_BACKOFF_MAX = int(os.environ.get('EMAIL_BACKOFF_MAX', 6 * 3600))
+EMAIL_AUTH_FAILURE_LIMIT = int(os.environ.get('EMAIL_AUTH_FAILURE_LIMIT', 3))
+
+# Bounds for the adaptive per-account interval (seeded from sync_frequency)
+EMAIL_SYNC_MIN_INTERVAL = int(os.environ.get('EMAIL_SYNC_MIN_INTERVAL', 60))
+EMAIL_SYNC_MAX_INTERVAL = int(os.environ.get('EMAIL_SYNC_MAX_INTERVAL', 6 * 3600))
+
+# Cached IMAP logins: most kept open at once, and seconds unused before closing
+IMAP_POOL_MAX_SIZE = int(os.environ.get('IMAP_POOL_MAX_SIZE', 20))
+IMAP_POOL_IDLE_TIMEOUT = int(os.environ.get('IMAP_POOL_IDLE_TIMEOUT', 600))
+
+# Socket timeout for each IMAP command, so a hung server can't pin a worker
+IMAP_TIMEOUT = int(os.environ.get('IMAP_TIMEOUT', 30))
+
+# Historical backfill for newly added mailboxes: how far back, chunk size in
+# days, and seconds to pause between chunks so live sync isn't starved
+EMAIL_BACKFILL_MONTHS = int(os.environ.get('EMAIL_BACKFILL_MONTHS', 24))
+EMAIL_BACKFILL_CHUNK_DAYS = int(os.environ.get('EMAIL_BACKFILL_CHUNK_DAYS', 30))
+EMAIL_BACKFILL_PAUSE = float(os.environ.get('EMAIL_BACKFILL_PAUSE', 2))
+
+# Processes a backfill chunk is extracted on (0 = one per CPU, 1 = in-process);
+# small chunks stay in-process either way
+EMAIL_EXTRACT_PROCESSES = int(os.environ.get('EMAIL_EXTRACT_PROCESSES', 0))
+
+# Emails a backfill step fetches and extracts before saving them
+EMAIL_BACKFILL_SLICE = 1000
+
+# Push mode: hold an IMAP IDLE connection per account instead of polling it
+IMAP_IDLE_ENABLED = os.environ.get('IMAP_IDLE_ENABLED', '0').lower() in ('1', 'true', 'yes')
 CORS(app)
 
 # Create instance folder if it doesn't exist
@@ -91,7 +168,7 @@ def init_databases():
     ''')
     
     # Migrate existing users table
-    for col, default in [('account_type', "'free'"), ('telegram_chat_id', "''"), ('notification_enabled', '1'), ('google_id', "NULL")]:
+    for col, default in [('account_type', "'free'"), ('telegram_chat_id', "''"), ('notification_enabled', '1'), ('google_id', "NULL"), ('last_seen', "NULL")]:
         try:
             cursor.execute(f"ALTER TABLE users ADD COLUMN {col} TEXT DEFAULT {default}")
         except:
@@ -135,6 +212,11 @@ def init_databases():
         cursor.execute("ALTER TABLE expenses ADD COLUMN confidence INTEGER DEFAULT 50")
     except:
         pass
+    try:
+        # Set when the user edits an expense, so reprocess.py leaves it alone
+        cursor.execute("ALTER TABLE expenses ADD COLUMN edited_at TIMESTAMP")
+    except:
+        pass
     
     # Categories table
     cursor.execute('''
@@ -167,6 +249,42 @@ def init_databases():
         default_categories
     )
     
+    # Detection rules layered over the built-in lists in email_processor.py.
+    # kind: blocked_sender, trusted_sender, spam_subject, spam_body,
+    # transaction_subject, transaction_body, merchant (value = display name)
+    # or category (value = category name); is_active = 0 drops a built-in rule
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS detection_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            pattern TEXT NOT NULL,
+            value TEXT,
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(kind, pattern, value)
+        )
+    ''')
+    
+    # Rule pack version — bumped by triggers on any change to detection_rules
+    # or category keywords, so running sync processes know to reload
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rule_pack (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO rule_pack (id, version) VALUES (1, 1)")
+    for table, event, name in [('detection_rules', 'INSERT', 'insert'), ('detection_rules', 'UPDATE', 'update'),
+                               ('detection_rules', 'DELETE', 'delete'), ('categories', 'INSERT', 'insert'),
+                               ('categories', 'UPDATE OF name, keywords', 'update'), ('categories', 'DELETE', 'delete')]:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_{name}_rule_pack AFTER {event} ON {table}
+            BEGIN
+                UPDATE rule_pack SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+            END
+        ''')
+    
     # Feedback table for user reports
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS feedback (
@@ -372,6 +490,24 @@ def init_databases():
         )
     ''')
     
+    # Incremental sync state — IMAP UIDVALIDITY + highest processed UID
+    # Backfill checkpoint — walks backwards from backfill_before to backfill_until
+    # Circuit breaker — consecutive failures (and how many of the latest in a row
+    # were rejected logins), when to retry, 'ok' / 'needs_reauth'
+    # sync_requested_at — manual sync asked for by the web app, served by the sync worker
+    # connection_reset_at — password changed or account paused; sync workers drop pooled logins
+    for col, col_type in [('uid_validity', 'INTEGER'), ('last_uid', 'INTEGER DEFAULT 0'),
+                          ('backfill_state', 'TEXT'), ('backfill_before', 'TEXT'),
+                          ('backfill_until', 'TEXT'), ('backfill_processed', 'INTEGER DEFAULT 0'),
+                          ('failure_count', 'INTEGER DEFAULT 0'), ('next_retry_at', 'TIMESTAMP'),
+                          ('auth_state', "TEXT DEFAULT 'ok'"), ('last_error', 'TEXT'),
+                          ('auth_failure_count', 'INTEGER DEFAULT 0'),
+                          ('sync_requested_at', 'TIMESTAMP'), ('connection_reset_at', 'TIMESTAMP')]:
+        try:
+            cursor.execute(f"ALTER TABLE email_configs ADD COLUMN {col} {col_type}")
+        except:
+            pass
+    
     # Processed emails table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS processed_emails (
@@ -386,12 +522,85 @@ def init_databases():
         )
     ''')
     
+    # Per-user Message-ID lookups after the header phase (cross-account dedupe)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_processed_emails_message_id ON processed_emails (message_id)"
+    )
+    
+    # Sync processes and the accounts each one owns (see SyncLeaseManager)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_workers (
+            worker_id TEXT PRIMARY KEY,
+            hostname TEXT,
+            pid INTEGER,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            heartbeat_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # stats — JSON snapshot of the worker's pool/pipeline/cache, for /api/health
+    try:
+        cursor.execute("ALTER TABLE sync_workers ADD COLUMN stats TEXT")
+    except:
+        pass
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_leases (
+            email_config_id INTEGER PRIMARY KEY,
+            worker_id TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            FOREIGN KEY (email_config_id) REFERENCES email_configs (id)
+        )
+    ''')
+    
     conn.commit()
     conn.close()
     print("✅ Email database initialized")
 
 # Initialize databases BEFORE creating the sync service
-init_databases()
+if not SPAWNED_WORKER:
+    init_databases()
+
+# ============ DETECTION RULES ============
+def load_rule_pack(conn):
+    """Built-in rules plus detection_rules and categories.keywords, compiled into a RulePack"""
+    # Version first: the rows read after it are at least that new, so a
+    # change landing in between is picked up again on the next refresh
+    version = conn.execute("SELECT version FROM rule_pack WHERE id = 1").fetchone()['version']
+    rules = [tuple(row) for row in conn.execute(
+        "SELECT kind, pattern, value, is_active FROM detection_rules ORDER BY id"
+    )]
+    category_keywords = [
+        (row['name'], keyword.strip())
+        for row in conn.execute("SELECT name, keywords FROM categories ORDER BY id")
+        for keyword in (row['keywords'] or '').split(',') if keyword.strip()
+    ]
+    return RulePack.with_overrides(version, rules, category_keywords)
+
+def refresh_rule_pack(force=False):
+    """Swap in the stored rules if their version moved — a single-row read otherwise"""
+    try:
+        conn = get_db('expenses')
+        try:
+            row = conn.execute("SELECT version FROM rule_pack WHERE id = 1").fetchone()
+            if not force and row and row['version'] == active_rules().version:
+                return False
+            pack = load_rule_pack(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"⚠️ Could not load detection rules, keeping version {active_rules().version}: {e}")
+        return False
+    
+    install_rules(pack)
+    summary = pack.summary()
+    print(f"📐 Detection rules v{pack.version}: {summary['merchants']} merchants, "
+          f"{summary['categories']} categories, {summary['blocked_senders']} blocked / "
+          f"{summary['trusted_senders']} trusted senders")
+    return True
+
+if not SPAWNED_WORKER:
+    refresh_rule_pack(force=True)
 
 # ============ HELPER FUNCTIONS ============
 def hash_password(password):
@@ -399,6 +608,22 @@ def hash_password(password):
     salt = "smartmail-tracker-2024"
     return hashlib.sha256(f"{password}{salt}".encode()).hexdigest()
 
+_last_seen_written = {}  # user_id -> monotonic time of last users.last_seen write
+
+def touch_last_seen(user_id):
+    """Record user activity for the sync scheduler, at most once every 5 minutes"""
+    now = time.monotonic()
+    if now - _last_seen_written.get(user_id, -300) < 300:
+        return
+    _last_seen_written[user_id] = now
+    try:
+        conn = get_db('expenses')
+        conn.execute("UPDATE users SET last_seen = CURRENT_TIMESTAMP WHERE id = ?", (user_id,))
+        conn.commit()
+        conn.close()
+    except:
+        pass
+
 def login_required(f):
     """Decorator for routes that require login"""
     from functools import wraps
@@ -409,38 +634,550 @@ def login_required(f):
             if request.path.startswith('/api/'):
                 return jsonify({'success': False, 'error': 'Authentication required'}), 401
             return redirect('/login')
+        touch_last_seen(session['user_id'])
         return f(*args, **kwargs)
     return decorated_function
 
+# ============ EMAIL INGEST PIPELINE ============
+
+def insert_email_expense(cursor, expense_data, user_id):
+    """Insert an extracted expense unless the same amount/merchant/date exists — INR default"""
+    expense_date = expense_data['date']
+    if hasattr(expense_date, 'strftime'):
+        expense_date = expense_date.strftime('%Y-%m-%d')
+    
+    cursor.execute('''
+        SELECT id FROM expenses 
+        WHERE user_id = ? AND amount = ? AND merchant = ? 
+        AND expense_date = DATE(?)
+    ''', (user_id, expense_data['amount'], expense_data['merchant'], expense_date))
+    
+    if cursor.fetchone():
+        return None
+    
+    cursor.execute('''
+        INSERT INTO expenses 
+        (user_id, amount, currency, category, description, merchant, 
+         payment_method, gst_amount, transaction_id, confidence,
+         source, receipt_data, expense_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        user_id,
+        expense_data['amount'],
+        expense_data.get('currency', 'INR'),
+        expense_data['category'],
+        expense_data.get('description', ''),
+        expense_data['merchant'],
+        expense_data.get('payment_method', 'Unknown'),
+        expense_data.get('gst_amount', 0),
+        expense_data.get('transaction_id', ''),
+        expense_data.get('confidence', 50),
+        expense_data.get('source', 'email'),
+        json.dumps(expense_data.get('email_data', {})),
+        expense_date
+    ))
+    return cursor.lastrowid
+
+
+class PipelineStopped(Exception):
+    """Raised to a fetcher when the pipeline shuts down under it"""
+
+
+class IngestJob:
+    """Emails one account sync has fed into the pipeline, and how many are saved"""
+    
+    def __init__(self, config):
+        self.config = config
+        self.submitted = 0
+        self.finished = 0
+        self.created = 0
+        self.condition = threading.Condition()
+    
+    def add(self):
+        with self.condition:
+            self.submitted += 1
+    
+    def finish(self, created):
+        with self.condition:
+            self.finished += 1
+            self.created += 1 if created else 0
+            self.condition.notify_all()
+    
+    def wait(self, stop_event):
+        """Block until the writer has committed every submitted email"""
+        with self.condition:
+            while self.finished < self.submitted and not stop_event.is_set():
+                self.condition.wait(0.5)
+            return self.finished >= self.submitted
+
+
+class EmailIngestPipeline:
+    """Fetch -> extract -> write stages connected by bounded queues
+
+    The fetch stage is whoever calls run() (the sync worker threads); it
+    hands emails to extractor threads, which hand expenses to one writer
+    thread that saves them in batches. A full queue blocks the stage
+    before it, so a slow disk slows fetching instead of piling up memory.
+    """
+    
+    def __init__(self, extract_workers=2, queue_size=200, batch_size=100, cache=None):
+        self.extract_workers = max(1, int(extract_workers))
+        self.cache = cache
+        self.batch_size = max(1, int(batch_size))
+        self.extract_queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.write_queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.extractor = EmailProcessor(None, None, None, None)  # offline, extraction only
+        self.stop_event = threading.Event()
+        self.threads = []
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.metrics = {
+            stage: {'items': 0, 'busy_seconds': 0.0, 'blocked_seconds': 0.0}
+            for stage in ('fetch', 'extract', 'write')
+        }
+        self.metrics['write'].update({'batches': 0, 'failed_batches': 0})
+        self.queue_high_water = {'extract': 0, 'write': 0}
+    
+    def start(self):
+        """Start the extractor and writer threads if they aren't running"""
+        with self._start_lock:
+            if any(thread.is_alive() for thread in self.threads):
+                return
+            self.stop_event.clear()
+            self.threads = [
+                threading.Thread(target=self._extract_loop, name=f'email-extract-{i}', daemon=True)
+                for i in range(self.extract_workers)
+            ]
+            self.threads.append(threading.Thread(target=self._write_loop, name='email-writer', daemon=True))
+            for thread in self.threads:
+                thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout=3)
+    
+    def run(self, config, emails):
+        """Push an email iterable through the pipeline and wait until it's saved
+
+        Returns (emails_seen, expenses_created). Raises if the pipeline is
+        stopped first, so callers don't checkpoint emails that weren't saved.
+        """
+        self.start()
+        job = IngestJob(config)
+        emails = iter(emails)
+        
+        try:
+            while True:
+                started = time.perf_counter()
+                email_data = next(emails, None)
+                self._record('fetch', time.perf_counter() - started, items=int(email_data is not None))
+                if email_data is None:
+                    break
+                job.add()
+                self._put('fetch', self.extract_queue, (job, email_data))
+        finally:
+            # Even when the fetch fails part way, what was queued still gets saved
+            complete = job.wait(self.stop_event)
+        
+        if not complete:
+            raise PipelineStopped('Ingest pipeline stopped before all emails were saved')
+        return job.submitted, job.created
+    
+    def stats(self):
+        """Per-stage counters for the health endpoint and benchmark"""
+        with self._metrics_lock:
+            stages = {stage: dict(values) for stage, values in self.metrics.items()}
+        for stage in stages.values():
+            stage['busy_seconds'] = round(stage['busy_seconds'], 3)
+            stage['blocked_seconds'] = round(stage['blocked_seconds'], 3)
+        batches = stages['write']['batches']
+        stages['write']['avg_batch_size'] = round(stages['write']['items'] / batches, 1) if batches else None
+        return {
+            'running': any(thread.is_alive() for thread in self.threads),
+            'stages': stages,
+            'queues': {
+                name: {'depth': q.qsize(), 'max_size': q.maxsize, 'high_water': self.queue_high_water[name]}
+                for name, q in (('extract', self.extract_queue), ('write', self.write_queue))
+            }
+        }
+    
+    def _record(self, stage, busy=0.0, blocked=0.0, items=1):
+        with self._metrics_lock:
+            metrics = self.metrics[stage]
+            metrics['items'] += items
+            metrics['busy_seconds'] += busy
+            metrics['blocked_seconds'] += blocked
+    
+    def _put(self, stage, target, item):
+        """Blocking put that gives up on shutdown; time spent waiting is backpressure"""
+        started = time.perf_counter()
+        while True:
+            try:
+                target.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                if self.stop_event.is_set():
+                    raise PipelineStopped('Ingest pipeline stopped')
+        
+        name = 'extract' if target is self.extract_queue else 'write'
+        with self._metrics_lock:
+            self.metrics[stage]['blocked_seconds'] += time.perf_counter() - started
+            self.queue_high_water[name] = max(self.queue_high_water[name], target.qsize())
+    
+    def _extract_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                job, email_data = self.extract_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            
+            started = time.perf_counter()
+            if self.cache is not None:
+                try:
+                    self.cache.put(email_data)
+                except Exception as e:
+                    print(f"   ⚠️ Message cache write failed: {e}")
+            if 'expense_data' in email_data:
+                # Already extracted with the rest of its backfill chunk
+                expense_data = email_data.pop('expense_data')
+            else:
+                try:
+                    expense_data = self.extractor.extract_expense_data(email_data)
+                except Exception as e:
+                    print(f"   ⚠️ Error extracting email {email_data.get('id', '?')}: {e}")
+                    expense_data = None
+            self._record('extract', time.perf_counter() - started, items=0)
+            
+            try:
+                self._put('extract', self.write_queue, (job, email_data, expense_data))
+                self._record('extract', items=1)
+            except PipelineStopped:
+                return
+    
+    def _write_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                batch = [self.write_queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            
+            # Whatever else is already waiting goes into the same transaction
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            started = time.perf_counter()
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print(f"❌ Error in email writer: {e}")
+            self._record('write', time.perf_counter() - started, items=len(batch))
+    
+    def _write_batch(self, batch):
+        """Save a batch in one transaction per database, one email at a time if that fails"""
+        try:
+            saved = self._save_items(batch)
+        except Exception as e:
+            print(f"   ⚠️ Batch write of {len(batch)} emails failed, retrying singly: {e}")
+            with self._metrics_lock:
+                self.metrics['write']['failed_batches'] += 1
+            saved = []
+            for item in batch:
+                try:
+                    saved.extend(self._save_items([item]))
+                except Exception as e:
+                    print(f"   ⚠️ Error saving email {item[1].get('id', '?')}: {e}")
+                    saved.append((item[0], None))
+        
+        with self._metrics_lock:
+            self.metrics['write']['batches'] += 1
+        
+        alerts = set()
+        for job, expense in saved:
+            job.finish(expense is not None)
+            if expense is not None:
+                alerts.add((job.config['user_id'], expense['category']))
+        
+        # Budget totals are read from the table, so one check per category covers the batch
+        for user_id, category in alerts:
+            try:
+                check_budget_alerts(user_id, category, 0)
+            except:
+                pass
+    
+    def _save_items(self, batch):
+        """Insert expenses and processed_emails rows; returns [(job, saved expense or None)]"""
+        email_conn = get_db('email')
+        expense_conn = get_db('expenses')
+        try:
+            email_cursor = email_conn.cursor()
+            expense_cursor = expense_conn.cursor()
+            known_users = {}
+            saved = []
+            
+            for job, email_data, expense_data in batch:
+                config = job.config
+                email_cursor.execute(
+                    "SELECT id FROM processed_emails WHERE email_config_id = ? AND email_id = ?",
+                    (config['id'], email_data['id'])
+                )
+                if email_cursor.fetchone():
+                    saved.append((job, None))
+                    continue
+                
+                expense_id = None
+                if expense_data and expense_data.get('amount'):
+                    user_id = config['user_id']
+                    if user_id not in known_users:
+                        expense_cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
+                        known_users[user_id] = expense_cursor.fetchone() is not None
+                    if known_users[user_id]:
+                        expense_id = insert_email_expense(expense_cursor, expense_data, user_id)
+                
+                email_cursor.execute(
+                    "INSERT INTO processed_emails (email_config_id, email_id, message_id, expense_id) VALUES (?, ?, ?, ?)",
+                    (config['id'], email_data['id'], email_data.get('message_id', ''), expense_id)
+                )
+                saved.append((job, expense_data if expense_id else None))
+            
+            # Expenses first: if we die in between, the re-fetched email hits the
+            # duplicate check below instead of creating a second expense
+            expense_conn.commit()
+            email_conn.commit()
+            return saved
+        except:
+            expense_conn.rollback()
+            email_conn.rollback()
+            raise
+        finally:
+            expense_conn.close()
+            email_conn.close()
+
+
+# ============ SYNC LEASES ============
+
+class SyncLeaseManager:
+    """Splits active email accounts between sync processes via sync_leases
+
+    Every process heartbeats into sync_workers, renews the leases it holds,
+    hands back accounts above an even share and claims unleased ones up to
+    it. Leases of a process that stops heartbeating expire after ttl
+    seconds and are picked up by the others.
+    """
+    
+    def __init__(self, ttl=90):
+        self.ttl = max(3, int(ttl))
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{os.urandom(3).hex()}"
+        self.owned = set()
+        self.last_heartbeat = None
+        self.lock = threading.Lock()
+    
+    def current(self):
+        """Config ids this process may sync, heartbeating first if that's overdue"""
+        with self.lock:
+            stale = self.last_heartbeat is None or time.monotonic() - self.last_heartbeat > self.ttl / 3
+        if stale:
+            self.heartbeat()
+        with self.lock:
+            return set(self.owned)
+    
+    def heartbeat(self, stats=None):
+        """Renew this process's leases and rebalance towards an even share
+
+        stats, a JSON string, replaces this worker's row in sync_workers.stats.
+        """
+        conn = get_db('email')
+        cursor = conn.cursor()
+        try:
+            # One writer at a time, so two processes can't claim the same account
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute('''
+                INSERT INTO sync_workers (worker_id, hostname, pid, stats) VALUES (?, ?, ?, ?)
+                ON CONFLICT(worker_id) DO UPDATE SET
+                    heartbeat_at = CURRENT_TIMESTAMP,
+                    stats = COALESCE(excluded.stats, stats)
+            ''', (self.worker_id, socket.gethostname(), os.getpid(), stats))
+            cursor.execute(
+                "DELETE FROM sync_workers WHERE heartbeat_at < datetime('now', ?)",
+                (f'-{self.ttl} seconds',)
+            )
+            cursor.execute('''
+                DELETE FROM sync_leases
+                WHERE expires_at < CURRENT_TIMESTAMP
+                OR worker_id NOT IN (SELECT worker_id FROM sync_workers)
+                OR email_config_id NOT IN (SELECT id FROM email_configs WHERE is_active = 1)
+            ''')
+            cursor.execute(
+                "UPDATE sync_leases SET expires_at = datetime('now', ?) WHERE worker_id = ?",
+                (f'+{self.ttl} seconds', self.worker_id)
+            )
+            
+            cursor.execute("SELECT COUNT(*) FROM sync_workers")
+            workers = cursor.fetchone()[0]
+            cursor.execute("SELECT COUNT(*) FROM email_configs WHERE is_active = 1")
+            accounts = cursor.fetchone()[0]
+            share = -(-accounts // max(1, workers))
+            
+            cursor.execute(
+                "SELECT email_config_id FROM sync_leases WHERE worker_id = ? ORDER BY email_config_id",
+                (self.worker_id,)
+            )
+            owned = [row[0] for row in cursor.fetchall()]
+            
+            if len(owned) > share:
+                # Hand the surplus back so a newly started process can claim it
+                surplus = owned[share:]
+                cursor.executemany(
+                    "DELETE FROM sync_leases WHERE email_config_id = ? AND worker_id = ?",
+                    [(config_id, self.worker_id) for config_id in surplus]
+                )
+                owned = owned[:share]
+            elif len(owned) < share:
+                cursor.execute('''
+                    SELECT id FROM email_configs
+                    WHERE is_active = 1 AND id NOT IN (SELECT email_config_id FROM sync_leases)
+                    ORDER BY id LIMIT ?
+                ''', (share - len(owned),))
+                claimed = [row[0] for row in cursor.fetchall()]
+                cursor.executemany(
+                    "INSERT INTO sync_leases (email_config_id, worker_id, expires_at) VALUES (?, ?, datetime('now', ?))",
+                    [(config_id, self.worker_id, f'+{self.ttl} seconds') for config_id in claimed]
+                )
+                owned += claimed
+            
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"   ⚠️ Sync lease heartbeat failed: {e}")
+            with self.lock:
+                return set(self.owned)
+        finally:
+            conn.close()
+        
+        with self.lock:
+            gained = set(owned) - self.owned
+            lost = self.owned - set(owned)
+            self.owned = set(owned)
+            self.last_heartbeat = time.monotonic()
+        if gained or lost:
+            print(f"🔑 Sync leases: {len(owned)} accounts (+{len(gained)} / -{len(lost)}) across {workers} worker(s)")
+        return set(owned)
+    
+    def release_all(self):
+        """Drop this process's leases so the others take its accounts right away"""
+        with self.lock:
+            self.owned = set()
+            self.last_heartbeat = None
+        try:
+            conn = get_db('email')
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM sync_leases WHERE worker_id = ?", (self.worker_id,))
+            cursor.execute("DELETE FROM sync_workers WHERE worker_id = ?", (self.worker_id,))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"   ⚠️ Could not release sync leases: {e}")
+    
+    @staticmethod
+    def live_workers():
+        """Sync processes that have heartbeated recently, for the health endpoint"""
+        conn = get_db('email')
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT w.worker_id, w.hostname, w.pid, w.heartbeat_at, w.stats,
+                   COUNT(l.email_config_id) AS accounts
+            FROM sync_workers w LEFT JOIN sync_leases l ON l.worker_id = w.worker_id
+            GROUP BY w.worker_id ORDER BY w.started_at
+        ''')
+        workers = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        for worker in workers:
+            worker['stats'] = json.loads(worker['stats']) if worker['stats'] else None
+        return workers
+
 # ============ REAL EMAIL SYNC SERVICE (AUTO-SYNC ONLY) ============
+
+# Active accounts whose circuit breaker is closed (or due for a retry)
+SYNCABLE_CONFIG_SQL = '''
+    is_active = 1 AND COALESCE(auth_state, 'ok') != 'needs_reauth'
+    AND (next_retry_at IS NULL OR next_retry_at <= CURRENT_TIMESTAMP)
+'''
+
+message_cache = MessageCache(os.path.join(DATA_DIR, 'message_cache'), EMAIL_CACHE_MAX_MB * 1024 * 1024)
+
 class RealEmailSyncService:
     def __init__(self):
         self.running = False
         self.thread = None
-        self.sync_interval = 60  # Check every 1 minute
+        self.sync_interval = 60  # Re-read active accounts at least once a minute
         self.force_stop = threading.Event()
         self.sync_in_progress = False
         self.last_sync_time = None
-        self.active_connections = {}
+        self.connection_pool = IMAPConnectionPool(
+            max_size=IMAP_POOL_MAX_SIZE, idle_timeout=IMAP_POOL_IDLE_TIMEOUT
+        )
+        self.idle_watchers = {}       # config_id -> {'thread', 'stop', 'reset'}
+        self.idle_unsupported = set() # config_ids whose server lacks IDLE
+        self.executor = None
+        self.account_locks = {}       # email address -> Lock guarding its cached connection
+        self._account_locks_guard = threading.Lock()
+        self.schedule = []            # heap of (due monotonic time, config_id)
+        self.next_due = {}            # config_id -> due time of its live heap entry
+        self.account_activity = {}    # config_id -> {'interval', 'rate', 'quiet_syncs', 'user_active'}
+        self._schedule_lock = threading.Lock()
+        self.backfill_thread = None
+        self.backfill_connections = {}  # config_id -> EmailProcessor used by backfill
+        self.leases = SyncLeaseManager(ttl=EMAIL_LEASE_TTL)
+        self.lease_thread = None
+        self.sync_requests = {}       # config_id -> sync_requested_at already acted on
+        self.connection_resets = {}   # config_id -> connection_reset_at already acted on
+        self.duplicates_skipped = 0   # bodies not fetched because another mailbox had the message
+        self._metrics_lock = threading.Lock()  # guards duplicates_skipped across sync threads
+        self.pipeline = EmailIngestPipeline(
+            extract_workers=EMAIL_EXTRACT_WORKERS,
+            queue_size=EMAIL_PIPELINE_QUEUE_SIZE,
+            batch_size=EMAIL_WRITE_BATCH_SIZE,
+            cache=message_cache
+        )
+        # Worker processes for backfill extraction, spawned on first large slice
+        self.extraction_pool = ExtractionPool(EMAIL_EXTRACT_PROCESSES or None)
     
     def start(self):
         """Start the automatic email sync service"""
         if not self.running:
             self.running = True
             self.force_stop.clear()
+            self.executor = ThreadPoolExecutor(
+                max_workers=EMAIL_SYNC_WORKERS, thread_name_prefix='email-sync'
+            )
             self.thread = threading.Thread(target=self._sync_loop, daemon=True)
             self.thread.start()
-            print("📧 Auto-sync service started (checking every 1 minute)")
+            self.backfill_thread = threading.Thread(target=self._backfill_loop, daemon=True)
+            self.backfill_thread.start()
+            self.lease_thread = threading.Thread(target=self._lease_loop, daemon=True)
+            self.lease_thread.start()
+            print("📧 Auto-sync service started (per-account adaptive schedule)")
     
     def stop(self):
         """Stop the email sync service"""
         print("🛑 Stopping email sync service...")
         self.running = False
         self.force_stop.set()
-        for email_key in list(self.active_connections.keys()):
-            self._close_connection(email_key)
+        for watcher in list(self.idle_watchers.values()):
+            watcher['stop'].set()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pipeline.stop()
+        self.extraction_pool.shutdown()
+        self.connection_pool.close_all()
+        for config_id in list(self.backfill_connections):
+            self.backfill_connections.pop(config_id).disconnect()
         if self.thread:
             self.thread.join(timeout=3)
+        self.leases.release_all()
         print("✅ Email sync service stopped")
     
     def _sync_loop(self):
@@ -450,218 +1187,684 @@ class RealEmailSyncService:
                 self.sync_in_progress = True
                 processed = self._sync_all_email_accounts()
                 self.sync_in_progress = False
+                self.connection_pool.prune()
                 
                 if processed > 0:
                     print(f"✅ Auto-sync: {processed} new expenses found")
                 
-                for _ in range(self.sync_interval):
-                    if self.force_stop.is_set():
-                        break
-                    time.sleep(1)
+                self.force_stop.wait(self._seconds_until_next_due())
                     
             except Exception as e:
                 self.sync_in_progress = False
                 print(f"❌ Error in email sync loop: {e}")
                 time.sleep(30)
     
+    def _lease_loop(self):
+        """Keep this process's account leases alive, even through long sync cycles
+
+        Also where a running sync process picks up detection rule changes.
+        """
+        while self.running and not self.force_stop.is_set():
+            self.leases.heartbeat(json.dumps(self.stats()))
+            refresh_rule_pack()
+            self.force_stop.wait(self.leases.ttl / 3)
+    
+    def stats(self):
+        """This process's sync activity — served by /api/health, or via sync_workers in worker mode"""
+        return {
+            'syncing': self.sync_in_progress,
+            'last_sync': self.last_sync_time.isoformat() if self.last_sync_time else None,
+            'leased_accounts': len(self.leases.owned),
+            'connection_pool': self.connection_pool.stats(),
+            'ingest_pipeline': self.pipeline.stats(),
+            'message_cache': message_cache.stats(),
+            'duplicates_skipped': self.duplicates_skipped,
+            'idle_watchers': len(self.idle_watchers),
+            'scheduled_accounts': len(self.next_due)
+        }
+    
     def _sync_all_email_accounts(self):
         """Sync emails for all active configurations"""
         try:
             conn = get_db('email')
             cursor = conn.cursor()
             
-            cursor.execute("SELECT * FROM email_configs WHERE is_active = 1")
+            cursor.execute(f"SELECT * FROM email_configs WHERE {SYNCABLE_CONFIG_SQL}")
             configs = cursor.fetchall()
             conn.close()
             
+            # Only the accounts leased to this process; other sync workers own the rest
+            owned = self.leases.current()
+            configs = [c for c in configs if c['id'] in owned]
+            
+            # Deleted, paused or handed-off accounts keep no pooled login here
+            self.connection_pool.retain({c['id'] for c in configs})
+            
+            if IMAP_IDLE_ENABLED:
+                self._reconcile_idle_watchers(configs)
+            
             if not configs:
                 return 0
             
-            total_processed = 0
+            # Accounts with a live IDLE watcher are synced on push, not polled
+            configs = [dict(c) for c in configs if c['id'] not in self.idle_watchers]
             
-            for config in configs:
-                try:
-                    result = self._process_email_account_fast(dict(config))
-                    
-                    if result.get('success'):
-                        processed = result.get('processed', 0)
-                        total_processed += processed
-                        
-                        conn = get_db('email')
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            "UPDATE email_configs SET last_sync = CURRENT_TIMESTAMP WHERE id = ?",
-                            (config['id'],)
-                        )
-                        conn.commit()
-                        conn.close()
-                        
-                except Exception as e:
-                    print(f"   ❌ Error processing {config['email_address']}: {e}")
-                    continue
+            due = self._pop_due_configs(configs)
+            if not due:
+                return 0
             
-            self.last_sync_time = datetime.now()
-            return total_processed
+            return self._sync_accounts_parallel(due)
             
         except Exception as e:
             print(f"❌ Database error in sync: {e}")
             return 0
     
-    def _process_email_account_fast(self, config):
-        """Fast email processing with connection caching"""
-        try:
-            email_key = config['email_address']
+    def _sync_accounts_parallel(self, configs):
+        """Fan accounts out over the bounded worker pool and total the results"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=EMAIL_SYNC_WORKERS, thread_name_prefix='email-sync'
+            )
+        
+        started_at = {}
+        
+        def run(config):
+            started_at[config['id']] = time.monotonic()
+            return self._sync_account(config, blocking=False)
+        
+        futures = {self.executor.submit(run, config): config for config in configs}
+        pending = set(futures)
+        total_processed = 0
+        
+        while pending:
+            done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
             
-            processor = self.active_connections.get(email_key)
+            for future in done:
+                config = futures[future]
+                try:
+                    total_processed += future.result()
+                except Exception as e:
+                    print(f"   ❌ Error processing {config['email_address']}: {e}")
             
-            if not processor or not self._test_connection(processor):
-                processor = EmailProcessor(
-                    imap_server=config['imap_server'],
-                    imap_port=config['imap_port'],
-                    username=config['username'],
-                    password=config['app_password']
-                )
-                
-                if not processor.connect():
-                    return {'success': False, 'error': 'Failed to connect to email server'}
-                
-                self.active_connections[email_key] = processor
+            # Stop waiting on accounts that blew their time budget; the worker
+            # keeps its account lock until the stuck call returns, so the
+            # account is skipped (not doubled up) on the next cycle
+            now = time.monotonic()
+            for future in list(pending):
+                config = futures[future]
+                started = started_at.get(config['id'])
+                if started and now - started > EMAIL_SYNC_ACCOUNT_TIMEOUT:
+                    print(f"   ⏱️ Sync timed out for {config['email_address']}")
+                    pending.discard(future)
+            
+            if self.force_stop.is_set():
+                break
+        
+        self.last_sync_time = datetime.now()
+        return total_processed
+    
+    def _sync_account(self, config, blocking=True, processor=None):
+        """Incremental sync of one account, updating last_sync on success"""
+        result = self._process_email_account_fast(config, blocking=blocking, processor=processor)
+        self._finish_sync(config, result)
+        return result.get('processed', 0) if result.get('success') else 0
+    
+    def sync_now(self, config):
+        """Manual "sync now" from the web app, honouring leases and the circuit breaker
+
+        config is an email_configs row with a 'syncable' flag (SYNCABLE_CONFIG_SQL).
+        Syncs inline only when this process is running sync and holds the
+        account's lease; otherwise the lease holder is asked through
+        sync_requested_at and the result has queued=True.
+        """
+        if not config['syncable']:
+            if not config['is_active']:
+                error = 'Sync is turned off for this account'
+            elif config['auth_state'] == 'needs_reauth':
+                error = 'The mail server rejected the app password — update it to resume sync'
+            else:
+                error = f"Sync is backing off after failures; next retry at {config['next_retry_at']} UTC"
+            return {'success': False, 'error': error}
+        
+        if not self.running or config['id'] not in self.leases.current():
+            conn = get_db('email')
+            conn.execute(
+                "UPDATE email_configs SET sync_requested_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (config['id'],)
+            )
+            conn.commit()
+            conn.close()
+            return {'success': True, 'queued': True, 'processed': 0}
+        
+        result = self._process_email_account_fast(config)
+        self._finish_sync(config, result)
+        return result
+    
+    def _finish_sync(self, config, result):
+        """Feed a sync result to the circuit breaker and the adaptive schedule"""
+        if not result.get('success'):
+            if not result.get('skipped'):
+                self._record_failure(config, result.get('error'), result.get('auth_failed', False))
+            return
+        
+        self._reschedule(config, result.get('emails_found', 0))
+        
+        conn = get_db('email')
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE email_configs
+            SET last_sync = CURRENT_TIMESTAMP, failure_count = 0, auth_failure_count = 0,
+                next_retry_at = NULL, last_error = NULL, auth_state = 'ok'
+            WHERE id = ?
+        ''', (config['id'],))
+        conn.commit()
+        conn.close()
+    
+    def _record_failure(self, config, error, auth_failed=False):
+        """Open the circuit breaker: back off exponentially, flag revoked passwords once"""
+        conn = get_db('email')
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT failure_count, auth_failure_count, auth_state FROM email_configs WHERE id = ?",
+            (config['id'],)
+        )
+        row = cursor.fetchone()
+        if not row:
+            conn.close()
+            return
+        
+        failures = (row['failure_count'] or 0) + 1
+        # Only rejected logins in a row count towards needs_reauth; a timeout resets the run
+        auth_failures = (row['auth_failure_count'] or 0) + 1 if auth_failed else 0
+        # Full jitter keeps accounts that broke together from retrying together
+        delay = min(EMAIL_BACKOFF_MAX, EMAIL_BACKOFF_BASE * 2 ** min(failures - 1, 20))
+        delay = random.uniform(0, delay)
+        
+        needs_reauth = auth_failures >= EMAIL_AUTH_FAILURE_LIMIT
+        newly_flagged = needs_reauth and row['auth_state'] != 'needs_reauth'
+        
+        cursor.execute('''
+            UPDATE email_configs
+            SET failure_count = ?, auth_failure_count = ?, next_retry_at = datetime('now', ?), last_error = ?,
+                auth_state = CASE WHEN ? THEN 'needs_reauth' ELSE auth_state END
+            WHERE id = ?
+        ''', (failures, auth_failures, f'+{int(delay)} seconds', (error or '')[:500],
+              1 if needs_reauth else 0, config['id']))
+        conn.commit()
+        conn.close()
+        
+        self.connection_pool.invalidate(config['id'])
+        
+        if newly_flagged:
+            print(f"   🔒 {config['email_address']}: login rejected {auth_failures} times in a row, pausing until re-authenticated")
+            _create_notification(
+                config['user_id'], 'danger',
+                f"🔒 Email sync paused: {config['email_address']}",
+                "The mail server rejected the saved app password. Generate a new app password and update the account to resume sync.",
+                '/email-settings'
+            )
+        elif failures == 1:
+            print(f"   ⚠️ Sync failed for {config['email_address']}: {error}")
+    
+    # ---------- Adaptive per-account schedule ----------
+    
+    def _base_interval(self, config):
+        """The account's configured sync_frequency, in seconds"""
+        return (config.get('sync_frequency') or 15) * 60
+    
+    def _push_due(self, config_id, due_at):
+        """Queue an account; older heap entries for it become stale — caller holds _schedule_lock"""
+        self.next_due[config_id] = due_at
+        heapq.heappush(self.schedule, (due_at, config_id))
+    
+    def _seconds_until_next_due(self):
+        """How long the sync loop may sleep before the earliest account is due"""
+        with self._schedule_lock:
+            if not self.schedule:
+                return self.sync_interval
+            return max(1, min(self.sync_interval, self.schedule[0][0] - time.monotonic()))
+    
+    def _pop_due_configs(self, configs):
+        """Return the accounts whose next sync is due, scheduling any new ones now"""
+        now = time.monotonic()
+        by_id = {config['id']: config for config in configs}
+        active_users = self._recently_active_users()
+        due = []
+        
+        with self._schedule_lock:
+            for config_id in list(self.next_due):
+                if config_id not in by_id:
+                    self.next_due.pop(config_id, None)
+                    self.account_activity.pop(config_id, None)
+                    self.sync_requests.pop(config_id, None)
             
-            emails = processor.get_unread_emails(days=1)
+            for config in configs:
+                activity = self.account_activity.get(config['id'])
+                requested = config.get('sync_requested_at')
+                if config['id'] not in self.next_due:
+                    self._push_due(config['id'], now)
+                elif requested and self.sync_requests.get(config['id']) != requested:
+                    # "Sync now" from the web app
+                    self._push_due(config['id'], now)
+                elif activity and not activity['user_active'] and config['user_id'] in active_users:
+                    # Owner just came back — don't make them wait out a dormant backoff
+                    self._push_due(config['id'], now)
+                if requested:
+                    self.sync_requests[config['id']] = requested
+            
+            while self.schedule and self.schedule[0][0] <= now:
+                due_at, config_id = heapq.heappop(self.schedule)
+                if self.next_due.get(config_id) != due_at:
+                    continue
+                config = by_id[config_id]
+                # Provisional slot in case this sync fails or hangs; _reschedule replaces it
+                self._push_due(config_id, now + self._base_interval(config))
+                due.append(config)
+        
+        return due
+    
+    def _reschedule(self, config, emails_found):
+        """Pick the next due time from sync_frequency, mail rate and owner activity"""
+        idle_seconds = self._user_idle_seconds(config['user_id'])
+        
+        with self._schedule_lock:
+            activity = self.account_activity.setdefault(config['id'], {
+                'interval': None, 'rate': 0.0, 'quiet_syncs': 0, 'user_active': False
+            })
+            activity['rate'] = 0.7 * activity['rate'] + 0.3 * emails_found
+            activity['quiet_syncs'] = 0 if emails_found else activity['quiet_syncs'] + 1
+            activity['user_active'] = idle_seconds is not None and idle_seconds < 15 * 60
             
-            processed_count = 0
+            interval = self._base_interval(config)
             
-            for email_data in emails:
-                try:
-                    conn = get_db('email')
-                    cursor = conn.cursor()
+            # Busy inboxes are checked more often; quiet ones double every two empty syncs
+            if activity['rate'] >= 1:
+                interval /= 2
+            else:
+                interval *= 2 ** min(activity['quiet_syncs'] // 2, 4)
+            
+            # Near-real-time while the owner is using the app, hours once they go dormant
+            if activity['user_active']:
+                interval /= 4
+            elif idle_seconds is not None and idle_seconds > 7 * 86400:
+                interval *= 8
+            elif idle_seconds is not None and idle_seconds > 86400:
+                interval *= 2
+            
+            interval = max(EMAIL_SYNC_MIN_INTERVAL, min(EMAIL_SYNC_MAX_INTERVAL, interval))
+            activity['interval'] = interval
+            self._push_due(config['id'], time.monotonic() + interval)
+    
+    def _user_idle_seconds(self, user_id):
+        """Seconds since the user last hit the app, or None if never recorded"""
+        try:
+            conn = get_db('expenses')
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT (julianday('now') - julianday(last_seen)) * 86400 AS idle FROM users WHERE id = ?",
+                (user_id,)
+            )
+            row = cursor.fetchone()
+            conn.close()
+            return row['idle'] if row else None
+        except:
+            return None
+    
+    def _recently_active_users(self):
+        """Ids of users seen in the last 15 minutes"""
+        try:
+            conn = get_db('expenses')
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM users WHERE last_seen >= datetime('now', '-15 minutes')")
+            user_ids = {row['id'] for row in cursor.fetchall()}
+            conn.close()
+            return user_ids
+        except:
+            return set()
+    
+    # ---------- Historical backfill ----------
+    
+    def _backfill_loop(self):
+        """Walk pending mailboxes backwards one date chunk at a time"""
+        while self.running and not self.force_stop.is_set():
+            try:
+                configs = self._pending_backfills()
+                
+                pending_ids = {config['id'] for config in configs}
+                for config_id in list(self.backfill_connections):
+                    if config_id not in pending_ids:
+                        self.backfill_connections.pop(config_id).disconnect()
+                
+                if not configs:
+                    self.force_stop.wait(self.sync_interval)
+                    continue
+                
+                # Round-robin so one big mailbox doesn't hold up the others
+                for config in configs:
+                    # Live sync goes first — wait for the current cycle to finish
+                    while self.sync_in_progress and not self.force_stop.is_set():
+                        self.force_stop.wait(1)
+                    if self.force_stop.is_set():
+                        break
                     
-                    cursor.execute(
-                        "SELECT id FROM processed_emails WHERE email_config_id = ? AND email_id = ?",
-                        (config['id'], email_data['id'])
-                    )
+                    self._backfill_chunk(config)
+                    self.force_stop.wait(EMAIL_BACKFILL_PAUSE)
                     
-                    if cursor.fetchone():
-                        conn.close()
+            except Exception as e:
+                print(f"❌ Error in email backfill loop: {e}")
+                self.force_stop.wait(30)
+    
+    def _pending_backfills(self):
+        """Active configs whose backfill hasn't reached backfill_until yet"""
+        owned = self.leases.current()
+        conn = get_db('email')
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT * FROM email_configs WHERE {SYNCABLE_CONFIG_SQL} AND backfill_state IN ('pending', 'running')"
+        )
+        configs = [dict(row) for row in cursor.fetchall() if row['id'] in owned]
+        conn.close()
+        return configs
+    
+    def _backfill_chunk(self, config):
+        """Import one date chunk for a config and checkpoint it"""
+        if self._retry_delay(config['id']):
+            # Live sync or an earlier chunk opened the circuit breaker this round
+            return
+        
+        today = datetime.now().date()
+        until = datetime.strptime(config['backfill_until'], '%Y-%m-%d').date()
+        if config['backfill_before']:
+            before = datetime.strptime(config['backfill_before'], '%Y-%m-%d').date()
+        else:
+            before = today + timedelta(days=1)
+        
+        since = max(until, before - timedelta(days=EMAIL_BACKFILL_CHUNK_DAYS))
+        reached = since
+        processed = 0
+        
+        if since < before:
+            processor = self.backfill_connections.get(config['id'])
+            if processor and processor.password != config['app_password']:
+                # Password changed in the web app since this login
+                self.backfill_connections.pop(config['id']).disconnect()
+                processor = None
+            if not processor:
+                processor = self._new_processor(config)
+                if not processor.connect():
+                    self._record_failure(config, processor.last_error, processor.auth_failed)
+                    return
+                self.backfill_connections[config['id']] = processor
+            
+            # Fetched and extracted a slice at a time: memory stays bounded and
+            # each slice is saved before the next one is fetched
+            emails = processor.iter_emails_between(since, before)
+            while True:
+                batch = list(islice(emails, EMAIL_BACKFILL_SLICE))
+                if not batch:
+                    break
+                results = self.pipeline.extractor.extract_expense_data_batch(batch, pool=self.extraction_pool)
+                for email_data, expense_data in zip(batch, results):
+                    email_data['expense_data'] = expense_data
+                _, created = self._save_emails(config, batch)
+                processed += created
+            
+            if not processor.range_complete:
+                # Leave the checkpoint alone so this chunk is retried once the breaker allows
+                self.backfill_connections.pop(config['id'], None)
+                processor.disconnect()
+                reached = before
+                self._record_failure(config, f"Backfill: {processor.fetch_error or 'range not fully fetched'}")
+        
+        state = 'done' if reached <= until else 'running'
+        conn = get_db('email')
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE email_configs
+            SET backfill_state = ?, backfill_before = ?, backfill_processed = COALESCE(backfill_processed, 0) + ?
+            WHERE id = ?
+        ''', (state, reached.strftime('%Y-%m-%d'), processed, config['id']))
+        conn.commit()
+        conn.close()
+        
+        if processed > 0:
+            print(f"📚 Backfill {config['email_address']}: {processed} expenses from {since} to {before}")
+        if state == 'done':
+            print(f"✅ Backfill complete for {config['email_address']}")
+    
+    # ---------- IMAP IDLE push mode ----------
+    
+    def _reconcile_idle_watchers(self, configs):
+        """Start IDLE watchers for new accounts, stop ones no longer active"""
+        resets = {config['id']: config['connection_reset_at'] for config in configs}
+        
+        for config_id, watcher in list(self.idle_watchers.items()):
+            # A reset (new password) restarts the watcher so it logs in again
+            if (config_id not in resets or not watcher['thread'].is_alive()
+                    or watcher['reset'] != resets[config_id]):
+                watcher['stop'].set()
+                self.idle_watchers.pop(config_id, None)
+        
+        for config in configs:
+            if config['id'] in self.idle_watchers or config['id'] in self.idle_unsupported:
+                continue
+            stop = threading.Event()
+            thread = threading.Thread(
+                target=self._idle_watch, args=(dict(config), stop), daemon=True
+            )
+            self.idle_watchers[config['id']] = {
+                'thread': thread, 'stop': stop, 'reset': config['connection_reset_at']
+            }
+            thread.start()
+    
+    def _idle_watch(self, config, stop):
+        """Hold one IDLE connection for an account and sync whenever mail arrives"""
+        processor = self._new_processor(config)
+        
+        while not stop.is_set() and not self.force_stop.is_set():
+            try:
+                if not processor.connected:
+                    if not processor.connect():
+                        self._record_failure(config, processor.last_error, processor.auth_failed)
+                        self._wait_for_retry(config['id'], stop)
                         continue
                     
-                    expense_data = processor.extract_expense_data(email_data)
-                    
-                    expense_id = None
-                    if expense_data and expense_data.get('amount'):
-                        expense_id = self._save_expense_to_db(expense_data, config['user_id'])
-                        
-                        if expense_id:
-                            processed_count += 1
-                    
-                    cursor.execute(
-                        "INSERT INTO processed_emails (email_config_id, email_id, message_id, expense_id) VALUES (?, ?, ?, ?)",
-                        (config['id'], email_data['id'], email_data.get('message_id', ''), 
-                         expense_id if expense_id else None)
-                    )
-                    conn.commit()
-                    conn.close()
+                    if not processor.supports_idle():
+                        print(f"   ℹ️ {config['email_address']}: server has no IDLE, polling instead")
+                        self.idle_unsupported.add(config['id'])
+                        break
                     
-                except Exception as e:
-                    print(f"   ⚠️ Error processing email {email_data.get('id', '?')}: {e}")
+                    processor.mail.select("inbox")
+                
+                # Catch up first, then after every push or 29-minute IDLE refresh.
+                # idle() has already sent DONE, so this fetch reuses the same login.
+                current = self._load_config(config['id'])
+                if not current or not current['is_active']:
+                    break
+                processed = self._sync_account(current, processor=processor)
+                if processed > 0:
+                    print(f"✅ Push sync: {processed} new expenses for {config['email_address']}")
+                if self._wait_for_retry(config['id'], stop):
+                    processor.disconnect()
                     continue
+                
+                processor.idle(stop_event=stop)
+                
+            except Exception as e:
+                processor.disconnect()
+                self._record_failure(config, f"IDLE: {e}")
+                self._wait_for_retry(config['id'], stop)
+        
+        processor.disconnect()
+        watcher = self.idle_watchers.get(config['id'])
+        if watcher and watcher['thread'] is threading.current_thread():
+            self.idle_watchers.pop(config['id'], None)
+    
+    def _wait_for_retry(self, config_id, stop):
+        """Sleep until the account's circuit breaker allows a retry; False if it is closed"""
+        delay = self._retry_delay(config_id)
+        if not delay:
+            return False
+        stop.wait(delay)
+        return True
+    
+    def _retry_delay(self, config_id):
+        """Seconds until the account's next_retry_at, or None if it may sync now"""
+        conn = get_db('email')
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT (julianday(next_retry_at) - julianday('now')) * 86400 FROM email_configs WHERE id = ?",
+            (config_id,)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        if not row or row[0] is None or row[0] <= 0:
+            return None
+        return row[0]
+    
+    def _load_config(self, config_id):
+        """Re-read an email config so sync state (last_uid) is current"""
+        conn = get_db('email')
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM email_configs WHERE id = ?", (config_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+    
+    def _account_lock(self, email_key):
+        """Per-account lock — one thread at a time may use a cached connection"""
+        with self._account_locks_guard:
+            return self.account_locks.setdefault(email_key, threading.Lock())
+    
+    def _process_email_account_fast(self, config, blocking=True, processor=None):
+        """Fast email processing with connection caching
+
+        blocking=False skips the account if another thread is already syncing it.
+        processor, a connection the caller owns (an IDLE watcher's), is used
+        instead of the pool.
+        """
+        lock = self._account_lock(config['email_address'])
+        
+        if blocking:
+            acquired = lock.acquire(timeout=EMAIL_SYNC_ACCOUNT_TIMEOUT)
+        else:
+            acquired = lock.acquire(blocking=False)
+        
+        if not acquired:
+            return {'success': False, 'skipped': True, 'error': 'Sync already in progress for this account'}
+        
+        try:
+            return self._process_account_locked(config, processor)
+        finally:
+            lock.release()
+    
+    def _process_account_locked(self, config, owned=None):
+        """Fetch, extract and save new emails — caller holds the account lock"""
+        processor = owned
+        try:
+            if not owned:
+                self._apply_connection_reset(config)
+                processor = self.connection_pool.checkout(
+                    config['id'], lambda: self._new_processor(config)
+                )
+            
+            if not processor.connected:
+                return {
+                    'success': False,
+                    'error': processor.last_error or 'Failed to connect to email server',
+                    'auth_failed': processor.auth_failed
+                }
+            
+            emails = processor.iter_new_emails(
+                last_uid=config.get('last_uid') or 0,
+                uid_validity=config.get('uid_validity'),
+                limit=20
+            )
+            
+            emails_found, processed_count = self._save_emails(config, emails)
+            
+            if processor.fetch_error:
+                # Saved emails stay saved; the high-water mark waits for a clean pass
+                return {
+                    'success': False,
+                    'error': processor.fetch_error,
+                    'auth_failed': processor.auth_failed
+                }
+            
+            self._save_sync_state(config['id'], processor.sync_state)
             
             return {
                 'success': True,
                 'processed': processed_count,
-                'emails_found': len(emails),
+                'emails_found': emails_found,
                 'expenses_created': processed_count
             }
             
         except Exception as e:
-            if config['email_address'] in self.active_connections:
-                del self.active_connections[config['email_address']]
+            if owned:
+                owned.disconnect()
+            elif processor:
+                self.connection_pool.invalidate(config['id'], processor)
             return {'success': False, 'error': str(e)}
+        finally:
+            if not owned:
+                self.connection_pool.release(config['id'], processor)
+    
+    def _apply_connection_reset(self, config):
+        """Drop cached logins for an account the web app has reset (new password)"""
+        reset = config.get('connection_reset_at')
+        if reset and self.connection_resets.get(config['id']) != reset:
+            self.connection_pool.invalidate(config['id'])
+            self.connection_resets[config['id']] = reset
+    
+    def _new_processor(self, config):
+        """Unconnected EmailProcessor for an email config row"""
+        return EmailProcessor(
+            imap_server=config['imap_server'],
+            imap_port=config['imap_port'],
+            username=config['username'],
+            password=config['app_password'],
+            fetch_chunk_size=IMAP_FETCH_CHUNK_SIZE,
+            timeout=IMAP_TIMEOUT,
+            server_filter=IMAP_SERVER_FILTER,
+            known_message_ids=lambda message_ids: self._known_message_ids(config['user_id'], message_ids)
+        )
     
-    def _test_connection(self, processor):
-        """Test if connection is still alive"""
-        try:
-            processor.mail.select("inbox")
-            return True
-        except:
-            return False
+    def _known_message_ids(self, user_id, message_ids):
+        """Message-IDs already processed through any of the user's mailboxes"""
+        conn = get_db('email')
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT DISTINCT pe.message_id FROM processed_emails pe
+            JOIN email_configs ec ON ec.id = pe.email_config_id
+            WHERE ec.user_id = ? AND pe.message_id IN ({', '.join('?' * len(message_ids))})
+        ''', [user_id] + list(message_ids))
+        known = {row[0] for row in cursor.fetchall()}
+        conn.close()
+        with self._metrics_lock:
+            self.duplicates_skipped += len(known)
+        return known
     
-    def _close_connection(self, email_key):
-        """Close and remove a cached connection"""
-        try:
-            if email_key in self.active_connections:
-                processor = self.active_connections[email_key]
-                processor.disconnect()
-                del self.active_connections[email_key]
-        except:
-            pass
+    def _save_emails(self, config, emails):
+        """Run an email iterable through the ingest pipeline, skipping ones already processed
+
+        Returns (emails_seen, expenses_created) once everything is committed.
+        """
+        return self.pipeline.run(config, emails)
     
-    def _save_expense_to_db(self, expense_data, user_id):
-        """Save extracted expense to database — INR default with payment_method/GST"""
+    def _save_sync_state(self, config_id, sync_state):
+        """Persist the UID high-water mark so the next poll only sees new mail"""
         try:
-            conn = get_db('expenses')
+            conn = get_db('email')
             cursor = conn.cursor()
-            
-            cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-            if not cursor.fetchone():
-                conn.close()
-                return None
-            
-            cursor.execute('''
-                SELECT id FROM expenses 
-                WHERE user_id = ? AND amount = ? AND merchant = ? 
-                AND expense_date = DATE(?)
-            ''', (
-                user_id,
-                expense_data['amount'],
-                expense_data['merchant'],
-                expense_data['date'].strftime('%Y-%m-%d') if hasattr(expense_data['date'], 'strftime') else expense_data['date']
-            ))
-            
-            if cursor.fetchone():
-                conn.close()
-                return None
-            
-            expense_date = expense_data['date']
-            if hasattr(expense_date, 'strftime'):
-                expense_date = expense_date.strftime('%Y-%m-%d')
-            
-            cursor.execute('''
-                INSERT INTO expenses 
-                (user_id, amount, currency, category, description, merchant, 
-                 payment_method, gst_amount, transaction_id, confidence,
-                 source, receipt_data, expense_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                user_id,
-                expense_data['amount'],
-                expense_data.get('currency', 'INR'),
-                expense_data['category'],
-                expense_data.get('description', ''),
-                expense_data['merchant'],
-                expense_data.get('payment_method', 'Unknown'),
-                expense_data.get('gst_amount', 0),
-                expense_data.get('transaction_id', ''),
-                expense_data.get('confidence', 50),
-                expense_data.get('source', 'email'),
-                json.dumps(expense_data.get('email_data', {})),
-                expense_date
-            ))
-            
-            expense_id = cursor.lastrowid
+            cursor.execute(
+                "UPDATE email_configs SET uid_validity = ?, last_uid = ? WHERE id = ?",
+                (sync_state.get('uid_validity'), sync_state.get('last_uid', 0), config_id)
+            )
             conn.commit()
             conn.close()
-            
-            # Check budget alerts after saving expense
-            try:
-                check_budget_alerts(user_id, expense_data['category'], expense_data['amount'])
-            except:
-                pass
-            
-            return expense_id
-            
         except Exception as e:
-            return None
+            print(f"   ⚠️ Error saving sync state for config {config_id}: {e}")
 
 # Initialize auto email sync service
 real_email_sync_service = RealEmailSyncService()
@@ -742,10 +1945,50 @@ def reports():
 def api_sync_status():
     """Check background sync status"""
     last_sync = real_email_sync_service.last_sync_time
+    
+    conn = get_db('email')
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, email_address, backfill_state, backfill_before, backfill_until, backfill_processed
+        FROM email_configs WHERE user_id = ? AND backfill_state IS NOT NULL
+    ''', (session['user_id'],))
+    rows = cursor.fetchall()
+    
+    syncing = real_email_sync_service.sync_in_progress
+    if EMAIL_SYNC_MODE == 'worker':
+        # The sync worker is another process; its progress is only in the database
+        cursor.execute("SELECT MAX(last_sync) FROM email_configs WHERE user_id = ?", (session['user_id'],))
+        worker_last_sync = cursor.fetchone()[0]
+        last_sync = datetime.strptime(worker_last_sync, '%Y-%m-%d %H:%M:%S') if worker_last_sync else None
+    conn.close()
+    
+    if EMAIL_SYNC_MODE == 'worker':
+        syncing = any(
+            (worker['stats'] or {}).get('syncing') for worker in SyncLeaseManager.live_workers()
+        )
+    
+    backfill = []
+    start = datetime.now().date() + timedelta(days=1)
+    for row in rows:
+        until = datetime.strptime(row['backfill_until'], '%Y-%m-%d').date()
+        before = datetime.strptime(row['backfill_before'], '%Y-%m-%d').date() if row['backfill_before'] else start
+        total_days = max(1, (start - until).days)
+        percent = 100 if row['backfill_state'] == 'done' else min(99, 100 * (start - before).days // total_days)
+        backfill.append({
+            'config_id': row['id'],
+            'email': row['email_address'],
+            'state': row['backfill_state'],
+            'reached': row['backfill_before'],
+            'until': row['backfill_until'],
+            'expenses_found': row['backfill_processed'] or 0,
+            'percent': percent
+        })
+    
     return jsonify({
         'success': True,
-        'syncing': real_email_sync_service.sync_in_progress,
+        'syncing': syncing,
         'last_sync': last_sync.isoformat() if last_sync else None,
+        'backfill': backfill,
         'timestamp': datetime.now().isoformat()
     })
 
@@ -946,14 +2189,18 @@ def api_email_configs():
                 conn.close()
                 return jsonify({'success': False, 'error': 'Email configuration already exists'}), 400
             
+            backfill_until = (datetime.now() - timedelta(days=EMAIL_BACKFILL_MONTHS * 30)).strftime('%Y-%m-%d')
+            
             cursor.execute('''
                 INSERT INTO email_configs 
-                (user_id, email_address, provider, imap_server, imap_port, username, app_password, is_active)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                (user_id, email_address, provider, imap_server, imap_port, username, app_password, is_active,
+                 backfill_state, backfill_until)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 user_id, email_address, provider, 
                 config['imap_server'], config['imap_port'],
-                config['username'], app_password, 1
+                config['username'], app_password, 1,
+                'pending' if EMAIL_BACKFILL_MONTHS > 0 else None, backfill_until
             ))
             
             config_id = cursor.lastrowid
@@ -1003,6 +2250,7 @@ def api_email_config_detail(config_id):
         try:
             data = request.json or {}
             is_active = data.get('is_active')
+            app_password = data.get('app_password')
             
             conn = get_db('email')
             cursor = conn.cursor()
@@ -1021,9 +2269,34 @@ def api_email_config_detail(config_id):
                     (1 if is_active else 0, config_id, user_id)
                 )
             
+            if app_password:
+                cursor.execute(
+                    "UPDATE email_configs SET app_password = ? WHERE id = ? AND user_id = ?",
+                    (app_password, config_id, user_id)
+                )
+            
+            # Sync workers may be other processes — they drop the old login on their next pass
+            if app_password or (is_active is not None and not is_active):
+                cursor.execute(
+                    "UPDATE email_configs SET connection_reset_at = CURRENT_TIMESTAMP WHERE id = ? AND user_id = ?",
+                    (config_id, user_id)
+                )
+            
+            # A new password or an explicit resume closes the circuit breaker
+            if app_password or is_active:
+                cursor.execute('''
+                    UPDATE email_configs
+                    SET failure_count = 0, auth_failure_count = 0, next_retry_at = NULL,
+                        last_error = NULL, auth_state = 'ok'
+                    WHERE id = ? AND user_id = ?
+                ''', (config_id, user_id))
+            
             conn.commit()
             conn.close()
             
+            if app_password or (is_active is not None and not is_active):
+                real_email_sync_service.connection_pool.invalidate(config_id)
+            
             return jsonify({
                 'success': True,
                 'message': 'Configuration updated successfully'
@@ -1058,8 +2331,7 @@ def api_email_config_detail(config_id):
             conn.commit()
             conn.close()
             
-            for key in list(real_email_sync_service.active_connections.keys()):
-                real_email_sync_service._close_connection(key)
+            real_email_sync_service.connection_pool.invalidate(config_id)
             
             return jsonify({
                 'success': True,
@@ -1144,34 +2416,53 @@ def api_email_sync():
         conn = get_db('email')
         cursor = conn.cursor()
         
+        if EMAIL_SYNC_MODE == 'worker':
+            # IMAP runs in sync_worker.py — flag the accounts for its next pass
+            if config_id:
+                cursor.execute(
+                    "UPDATE email_configs SET sync_requested_at = CURRENT_TIMESTAMP WHERE id = ? AND user_id = ?",
+                    (config_id, user_id)
+                )
+            else:
+                cursor.execute(
+                    "UPDATE email_configs SET sync_requested_at = CURRENT_TIMESTAMP WHERE user_id = ? AND is_active = 1",
+                    (user_id,)
+                )
+            requested = cursor.rowcount
+            conn.commit()
+            conn.close()
+            
+            if config_id and not requested:
+                return jsonify({'success': False, 'error': 'Configuration not found'}), 404
+            
+            return jsonify({
+                'success': True,
+                'queued': True,
+                'message': f'Sync requested for {requested} account(s)'
+            })
+        
         if config_id:
             cursor.execute(
-                "SELECT * FROM email_configs WHERE id = ? AND user_id = ?",
+                f"SELECT *, ({SYNCABLE_CONFIG_SQL}) AS syncable FROM email_configs WHERE id = ? AND user_id = ?",
                 (config_id, user_id)
             )
             config = cursor.fetchone()
+            conn.close()
             
             if not config:
-                conn.close()
                 return jsonify({'success': False, 'error': 'Configuration not found'}), 404
             
-            result = real_email_sync_service._process_email_account_fast(dict(config))
+            # Leased to another sync process (or this one isn't syncing): it's queued there
+            result = real_email_sync_service.sync_now(dict(config))
             
             if result.get('success'):
-                cursor.execute(
-                    "UPDATE email_configs SET last_sync = CURRENT_TIMESTAMP WHERE id = ?",
-                    (config_id,)
-                )
-                conn.commit()
-                conn.close()
-                
                 return jsonify({
                     'success': True,
-                    'message': f'Synced {result.get("processed", 0)} emails',
+                    'queued': result.get('queued', False),
+                    'message': 'Sync requested' if result.get('queued') else f'Synced {result.get("processed", 0)} emails',
                     'details': result
                 })
             else:
-                conn.close()
                 return jsonify({
                     'success': False,
                     'error': result.get('error', 'Sync failed')
@@ -1179,7 +2470,7 @@ def api_email_sync():
         
         else:
             cursor.execute(
-                "SELECT * FROM email_configs WHERE user_id = ? AND is_active = 1",
+                f"SELECT *, ({SYNCABLE_CONFIG_SQL}) AS syncable FROM email_configs WHERE user_id = ? AND is_active = 1",
                 (user_id,)
             )
             configs = cursor.fetchall()
@@ -1189,13 +2480,14 @@ def api_email_sync():
             results = []
             
             for config in configs:
-                result = real_email_sync_service._process_email_account_fast(dict(config))
+                result = real_email_sync_service.sync_now(dict(config))
                 if result.get('success'):
                     processed = result.get('processed', 0)
                     total_processed += processed
                     results.append({
                         'email': config['email_address'],
                         'processed': processed,
+                        'queued': result.get('queued', False),
                         'success': True
                     })
                 else:
@@ -1787,6 +3079,7 @@ def api_expense_detail(expense_id):
                 params.append(data['date'])
             
             if updates:
+                updates.append("edited_at = CURRENT_TIMESTAMP")
                 params.extend([expense_id, user_id])
                 cursor.execute(
                     f"UPDATE expenses SET {', '.join(updates)} WHERE id = ? AND user_id = ?",
@@ -1863,7 +3156,12 @@ def api_health():
             'services': {
                 'database': 'connected',
                 'email_sync': 'running' if real_email_sync_service.running else 'stopped',
-                'cached_connections': len(real_email_sync_service.active_connections)
+                'sync_mode': EMAIL_SYNC_MODE,
+                # Each worker's pool/pipeline/cache stats, as of its last heartbeat
+                'sync_workers': SyncLeaseManager.live_workers(),
+                # This process's own, only when it is the one syncing
+                'local_sync': real_email_sync_service.stats() if real_email_sync_service.running else None,
+                'detection_rules': active_rules().summary()
             }
         })
     except Exception as e:
@@ -2695,7 +3993,10 @@ def on_startup():
     print("  ✅ Chart.js powered analytics dashboard")
     print("=" * 60)
     
-    real_email_sync_service.start()
+    if EMAIL_SYNC_MODE == 'worker':
+        print("📧 Email sync runs in sync_worker.py (EMAIL_SYNC_MODE=worker)")
+    else:
+        real_email_sync_service.start()
 
 def on_shutdown():
     """Cleanup on shutdown"""
@@ -2703,15 +4004,15 @@ def on_shutdown():
     real_email_sync_service.stop()
     print("✅ Clean shutdown complete")
 
-atexit.register(on_shutdown)
-
 def signal_handler(sig, frame):
     print('\n\n👋 Received shutdown signal. Goodbye!')
     on_shutdown()
     sys.exit(0)
 
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
+if not SPAWNED_WORKER:
+    atexit.register(on_shutdown)
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
 if __name__ == '__main__':
     on_startup()
@@ -0,0 +1,201 @@
+# benchmark.py
+"""End-to-end sync throughput benchmark against the fake IMAP server
+
+    python benchmark.py                                  # 50 accounts x 200 messages
+    python benchmark.py --accounts 500 --messages 20 --latency 0.01
+    python benchmark.py --accounts 1 --messages 10000    # one big backlog
+    python benchmark.py --drop-rate 0.01 --json results.json
+
+Runs RealEmailSyncService cycles against synthetic mailboxes in a throwaway
+DATA_DIR. The backlog phase repeats cycles until every mailbox is drained,
+then the steady phase delivers a few new messages per account and runs one
+more cycle. Reports messages/sec, cycle duration, per-account latency
+percentiles and DB write rate for each phase, then the ingest pipeline's
+per-stage counters.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import fake_imap
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def count_rows(app):
+    """Rows written so far: (processed_emails, expenses)"""
+    conn = app.get_db('email')
+    processed = conn.execute("SELECT COUNT(*) FROM processed_emails").fetchone()[0]
+    conn.close()
+    conn = app.get_db('expenses')
+    expenses = conn.execute("SELECT COUNT(*) FROM expenses").fetchone()[0]
+    conn.close()
+    return processed, expenses
+
+
+def run_cycle(service):
+    """One sync cycle with every account due; returns (processed, seconds)"""
+    # Make every account due now so the adaptive schedule doesn't skip any
+    with service._schedule_lock:
+        service.next_due.clear()
+        service.schedule.clear()
+    started = time.perf_counter()
+    processed = service._sync_all_email_accounts()
+    return processed, time.perf_counter() - started
+
+
+def summarize(name, cycles, timings, rows_before, rows_after, server_before, server_after):
+    """Build the result dict for one phase"""
+    elapsed = sum(seconds for _, seconds in cycles)
+    examined = rows_after[0] - rows_before[0]
+    writes = examined + (rows_after[1] - rows_before[1])
+    latencies = [seconds for seconds, _ in timings]
+    return {
+        'phase': name,
+        'cycles': len(cycles),
+        'seconds': round(elapsed, 3),
+        'messages_processed': examined,
+        'expenses_created': rows_after[1] - rows_before[1],
+        'messages_per_sec': round(examined / elapsed, 1) if elapsed else 0,
+        'cycle_seconds_max': round(max((s for _, s in cycles), default=0), 3),
+        'account_p50': round(percentile(latencies, 50), 3),
+        'account_p99': round(percentile(latencies, 99), 3),
+        'account_failures': sum(1 for _, ok in timings if not ok),
+        'db_writes_per_sec': round(writes / elapsed, 1) if elapsed else 0,
+        'imap_commands': server_after['commands'] - server_before['commands'],
+        'imap_fetch_bytes': server_after['fetch_bytes'] - server_before['fetch_bytes'],
+        'connection_drops': server_after['drops'] - server_before['drops'],
+    }
+
+
+def print_phase(result):
+    print(f"\n📊 {result['phase']}: {result['cycles']} cycle(s) in {result['seconds']}s")
+    print(f"   messages/sec       {result['messages_per_sec']} ({result['messages_processed']} messages, "
+          f"{result['expenses_created']} expenses)")
+    print(f"   slowest cycle      {result['cycle_seconds_max']}s")
+    print(f"   account latency    p50 {result['account_p50']}s  p99 {result['account_p99']}s  "
+          f"failures {result['account_failures']}")
+    print(f"   DB writes/sec      {result['db_writes_per_sec']}")
+    print(f"   IMAP               {result['imap_commands']} commands, {result['imap_fetch_bytes']} bytes fetched, "
+          f"{result['connection_drops']} drops")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark RealEmailSyncService against a fake IMAP server')
+    parser.add_argument('--accounts', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=200, help='backlog per account')
+    parser.add_argument('--new-messages', type=int, default=5, help='per account, for the steady phase')
+    parser.add_argument('--spam-ratio', type=float, default=0.6)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per IMAP command')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='chance a command drops the connection')
+    parser.add_argument('--workers', type=int, default=None, help='EMAIL_SYNC_WORKERS override')
+    parser.add_argument('--max-cycles', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args(argv)
+
+    # app reads its config at import time, so point it at a scratch DATA_DIR first
+    os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='smartmail-bench-')
+    os.environ['EMAIL_BACKFILL_MONTHS'] = '0'
+    if args.workers:
+        os.environ['EMAIL_SYNC_WORKERS'] = str(args.workers)
+
+    server = fake_imap.FakeIMAPServer(latency=args.latency, drop_rate=args.drop_rate, seed=args.seed).start()
+    server.patch_imaplib()
+
+    print(f"📦 Generating {args.accounts} x {args.messages} messages...")
+    for i in range(args.accounts):
+        messages = fake_imap.generate_messages(
+            args.messages, spam_ratio=args.spam_ratio, seed=args.seed + i, days=1,
+            account=f'bench{i}@example.com'
+        )
+        server.add_account(f'bench{i}@example.com', 'pw', messages)
+
+    import app
+
+    conn = app.get_db('expenses')
+    conn.execute("INSERT INTO users (username, password_hash) VALUES ('bench', 'x')")
+    conn.commit()
+    conn.close()
+
+    conn = app.get_db('email')
+    conn.executemany('''
+        INSERT INTO email_configs
+        (user_id, email_address, provider, imap_server, imap_port, username, app_password, is_active)
+        VALUES (1, ?, 'gmail', 'imap.example.com', 993, ?, 'pw', 1)
+    ''', [(f'bench{i}@example.com', f'bench{i}@example.com') for i in range(args.accounts)])
+    conn.commit()
+    conn.close()
+
+    service = app.real_email_sync_service
+    timings = []
+    process_account = service._process_email_account_fast
+
+    def timed(config, *a, **kw):
+        started = time.perf_counter()
+        result = process_account(config, *a, **kw)
+        timings.append((time.perf_counter() - started, result.get('success', False)))
+        return result
+
+    service._process_email_account_fast = timed
+    results = []
+
+    # Backlog phase: cycle until a whole cycle finds nothing new
+    rows_before, server_before = count_rows(app), dict(server.stats)
+    cycles = []
+    del timings[:]
+    while len(cycles) < args.max_cycles:
+        before = count_rows(app)[0]
+        cycles.append(run_cycle(service))
+        if count_rows(app)[0] == before and all(ok for _, ok in timings[-args.accounts:]):
+            break
+    results.append(summarize('backlog', cycles, list(timings), rows_before, count_rows(app),
+                             server_before, dict(server.stats)))
+
+    # Steady phase: a handful of new messages per account, one cycle
+    for i in range(args.accounts):
+        for raw, date in fake_imap.generate_messages(
+                args.new_messages, spam_ratio=args.spam_ratio, seed=10**6 + i,
+                start_index=args.messages, days=0, account=f'bench{i}@example.com'):
+            server.deliver(f'bench{i}@example.com', raw, date)
+
+    rows_before, server_before = count_rows(app), dict(server.stats)
+    del timings[:]
+    cycles = [run_cycle(service)]
+    results.append(summarize('steady', cycles, list(timings), rows_before, count_rows(app),
+                             server_before, dict(server.stats)))
+
+    print(f"\n⚙️ {args.accounts} accounts, {args.messages} backlog each, latency {args.latency}s, "
+          f"drop rate {args.drop_rate}, workers {app.EMAIL_SYNC_WORKERS}")
+    for result in results:
+        print_phase(result)
+
+    pipeline = service.pipeline.stats()
+    print("\n🔀 Pipeline stages (busy / blocked on the next stage)")
+    for stage, metrics in pipeline['stages'].items():
+        print(f"   {stage:<8} {metrics['items']:>7} items  {metrics['busy_seconds']:>8}s / {metrics['blocked_seconds']}s")
+    for name, q in pipeline['queues'].items():
+        print(f"   {name} queue high water {q['high_water']}/{q['max_size']}")
+    print(f"   avg write batch {pipeline['stages']['write']['avg_batch_size']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results, 'pipeline': pipeline}, f, indent=2)
+
+    service.stop()
+    server.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,3 @@
+# conftest.py
+# test_email.py is a manual script that logs in to a real mailbox on import
+collect_ignore = ['test_email.py']
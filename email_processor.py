@@ -3,8 +3,20 @@ import imaplib
 import email
 from email.header import decode_header
 import re
+import base64
+import quopri
+from html import unescape
 from datetime import datetime, timedelta
+import multiprocessing
+import os
 import time
+import socket
+import ssl
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 
 
 # ============ SPAM / PROMOTIONAL EMAIL FILTERS ============
@@ -137,86 +149,694 @@ TRANSACTION_BODY_KEYWORDS = [
     'available balance', 'closing balance',
 ]
 
+# Merchant keywords -> display name, checked in this order (first hit wins)
+MERCHANT_KEYWORDS = {
+    # E-commerce
+    'flipkart': 'Flipkart',
+    'myntra': 'Myntra',
+    'ajio': 'AJIO',
+    'meesho': 'Meesho',
+    'snapdeal': 'Snapdeal',
+    'nykaa': 'Nykaa',
+    'tatacliq': 'Tata CLiQ',
+    'jiomart': 'JioMart',
+    'amazon': 'Amazon India',
+
+    # Food delivery
+    'zomato': 'Zomato',
+    'swiggy': 'Swiggy',
+    'eatsure': 'EatSure',
+    'dominos': "Domino's",
+    'dunzo': 'Dunzo',
+
+    # Travel
+    'irctc': 'IRCTC',
+    'makemytrip': 'MakeMyTrip',
+    'goibibo': 'Goibibo',
+    'cleartrip': 'Cleartrip',
+    'yatra': 'Yatra',
+    'ola': 'Ola',
+    'uber': 'Uber India',
+    'rapido': 'Rapido',
+    'redbus': 'RedBus',
+    'ixigo': 'ixigo',
+
+    # Groceries
+    'bigbasket': 'BigBasket',
+    'blinkit': 'Blinkit',
+    'grofers': 'Grofers',
+    'zepto': 'Zepto',
+    'dmart': 'DMart',
+    'instamart': 'Swiggy Instamart',
+
+    # Entertainment
+    'netflix': 'Netflix',
+    'hotstar': 'Disney+ Hotstar',
+    'primevideo': 'Amazon Prime Video',
+    'prime video': 'Amazon Prime Video',
+    'bookmyshow': 'BookMyShow',
+    'spotify': 'Spotify',
+    'jiocinema': 'JioCinema',
+    'sonyliv': 'SonyLIV',
+    'zee5': 'ZEE5',
+
+    # Payments / UPI
+    'paytm': 'Paytm',
+    'phonepe': 'PhonePe',
+    'googlepay': 'Google Pay',
+    'google pay': 'Google Pay',
+    'razorpay': 'Razorpay',
+    'payu': 'PayU',
+    'ccavenue': 'CCAvenue',
+    'bharatpe': 'BharatPe',
+
+    # Banking
+    'hdfc': 'HDFC Bank',
+    'icici': 'ICICI Bank',
+    'sbi': 'SBI',
+    'axis': 'Axis Bank',
+    'kotak': 'Kotak Mahindra',
+    'idfc': 'IDFC First',
+
+    # Utilities / Telecom
+    'jio': 'Jio',
+    'airtel': 'Airtel',
+    'vodafone': 'Vodafone Idea',
+    'bsnl': 'BSNL',
+    'tatapower': 'Tata Power',
+    'adani': 'Adani',
+
+    # Healthcare
+    'practo': 'Practo',
+    '1mg': '1mg',
+    'pharmeasy': 'PharmEasy',
+    'netmeds': 'Netmeds',
+    'apollo': 'Apollo',
+
+    # Education
+    'unacademy': 'Unacademy',
+    'byju': "BYJU'S",
+    'udemy': 'Udemy',
+    'coursera': 'Coursera',
+    'upgrad': 'upGrad',
+
+    # International (kept for compatibility)
+    'walmart': 'Walmart',
+    'starbucks': 'Starbucks',
+    'mcdonalds': "McDonald's",
+}
+
+# Category -> keywords; the first category with a matching keyword wins
+CATEGORY_KEYWORDS = {
+    'Food Delivery': [
+        'zomato', 'swiggy', 'eatsure', 'dunzo', 'food order',
+        'food delivery', 'dominos', 'pizza hut', 'kfc', 'burger king',
+        'restaurant', 'cafe', 'dining', 'biryani', 'thali'
+    ],
+    'Groceries': [
+        'bigbasket', 'blinkit', 'grofers', 'zepto', 'dmart',
+        'instamart', 'grocery', 'supermarket', 'vegetables',
+        'fruits', 'milk', 'ration', 'kirana'
+    ],
+    'Online Shopping': [
+        'flipkart', 'amazon', 'myntra', 'ajio', 'meesho',
+        'snapdeal', 'nykaa', 'tatacliq', 'jiomart', 'shopping',
+        'order confirmed', 'shipment', 'delivered', 'purchase'
+    ],
+    'Travel & Transport': [
+        'irctc', 'makemytrip', 'goibibo', 'cleartrip', 'yatra',
+        'ola', 'uber', 'rapido', 'redbus', 'ixigo', 'flight',
+        'train', 'bus', 'cab', 'taxi', 'booking', 'ticket',
+        'airline', 'indigo', 'spicejet', 'air india', 'vistara'
+    ],
+    'Entertainment': [
+        'netflix', 'hotstar', 'prime video', 'bookmyshow',
+        'spotify', 'jiocinema', 'sonyliv', 'zee5', 'movie',
+        'cinema', 'concert', 'game', 'streaming', 'subscription'
+    ],
+    'Utilities & Bills': [
+        'electricity', 'water', 'gas', 'internet', 'phone',
+        'bill', 'recharge', 'jio', 'airtel', 'vodafone', 'bsnl',
+        'broadband', 'dth', 'tata power', 'adani', 'piped gas',
+        'mobile recharge', 'postpaid', 'prepaid'
+    ],
+    'Healthcare': [
+        'hospital', 'pharmacy', 'medicine', 'doctor', 'dental',
+        'medical', 'health', 'clinic', 'practo', '1mg',
+        'pharmeasy', 'netmeds', 'apollo', 'diagnostic', 'lab test'
+    ],
+    'Education': [
+        'unacademy', 'byju', 'udemy', 'coursera', 'upgrad',
+        'course', 'tuition', 'school', 'college', 'books',
+        'scholarship', 'coaching', 'exam', 'fee'
+    ],
+    'EMI & Loans': [
+        'emi', 'loan', 'installment', 'equated monthly',
+        'home loan', 'car loan', 'personal loan', 'credit card bill'
+    ],
+    'Investments': [
+        'mutual fund', 'sip', 'stocks', 'shares', 'demat',
+        'zerodha', 'groww', 'upstox', 'investment', 'nps',
+        'ppf', 'fixed deposit', 'fd', 'rd'
+    ],
+}
+
+# Payment methods in priority order: (method, keywords, more specific labels)
+PAYMENT_METHOD_RULES = [
+    ('UPI', ['upi', 'google pay', 'phonepe', 'paytm', 'bhim',
+             'bharatpe', 'upi id', 'upi ref', '@ybl', '@paytm',
+             '@oksbi', '@okaxis', '@okhdfcbank'],
+     [('google pay', 'UPI - Google Pay'), ('gpay', 'UPI - Google Pay'),
+      ('phonepe', 'UPI - PhonePe'), ('paytm', 'UPI - Paytm'), ('bhim', 'UPI - BHIM')]),
+    ('Credit Card', ['credit card', 'visa', 'mastercard', 'rupay', 'amex'],
+     [('rupay', 'Credit Card - RuPay'), ('visa', 'Credit Card - Visa'),
+      ('mastercard', 'Credit Card - Mastercard')]),
+    ('Debit Card', ['debit card', 'atm card'], []),
+    ('Net Banking', ['net banking', 'netbanking', 'neft', 'rtgs', 'imps'], []),
+    ('Wallet', ['wallet', 'paytm wallet', 'freecharge', 'mobikwik'], []),
+    ('EMI', ['emi', 'equated monthly', 'installment'], []),
+    ('Cash on Delivery', ['cash on delivery', 'cod', 'pay on delivery'], []),
+]
+
+
+# ============ SENDER CLASSIFICATION ============
+
+_REGEX_META = re.compile(r'[\\*+?()\[\]{}|^$]')
+
+
+class SenderIndex:
+    """One sender pattern list compiled into a single scan of the From header
+
+    Most patterns are literals with escaped dots ('alerts@hdfcbank\\.net',
+    '@campaigns\\.'), and re.search of a literal is a substring test: they
+    go into a KeywordAutomaton and are all found in one pass. Only real
+    regexes (e.g. 'noreply.*sale') are left, joined into one precompiled
+    alternation. Matches exactly what re.search(pattern, sender_lower)
+    over the whole list did, at a cost that doesn't grow with the list.
+    """
+
+    def __init__(self, patterns):
+        literals = []
+        regexes = []
+        for pattern in patterns:
+            bare = pattern.replace('\\.', '')
+            # An unescaped '.' is a wildcard and an upper-case literal never matched the
+            # lowercased sender: both stay regexes to keep re's verdict
+            if _REGEX_META.search(bare) or '.' in bare or pattern != pattern.lower():
+                regexes.append(pattern)
+            else:
+                literals.append(pattern.replace('\\.', '.'))
+
+        self.literals = KeywordAutomaton(literals)
+        self.fallback = re.compile('|'.join(f'(?:{p})' for p in regexes)) if regexes else None
+
+    def matches(self, sender_lower):
+        if self.literals.find(sender_lower):
+            return True
+        return bool(self.fallback and self.fallback.search(sender_lower))
+
+
+class SenderClassifier:
+    """Blocked/trusted verdict for a From header, cached per sender string"""
+
+    def __init__(self, blocked_patterns, trusted_patterns, cache_size=4096):
+        self.blocked = SenderIndex(blocked_patterns)
+        self.trusted = SenderIndex(trusted_patterns)
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, sender):
+        """(is_blocked, is_trusted) — the sender is lowercased once per distinct string"""
+        sender_lower = sender.lower()
+        return self.blocked.matches(sender_lower), self.trusted.matches(sender_lower)
+
 
 def is_blocked_sender(sender_email):
     """Check if sender matches blocked patterns"""
-    sender_lower = sender_email.lower()
-    for pattern in BLOCKED_SENDER_PATTERNS:
-        if re.search(pattern, sender_lower):
-            return True
-    return False
+    return active_rules().senders.classify(sender_email)[0]
 
 
 def is_trusted_sender(sender_email):
     """Check if sender matches trusted patterns"""
-    sender_lower = sender_email.lower()
-    for pattern in TRUSTED_SENDER_PATTERNS:
-        if re.search(pattern, sender_lower):
-            return True
-    return False
+    return active_rules().senders.classify(sender_email)[1]
+
+
+# ============ KEYWORD MATCHING ============
+
+class KeywordAutomaton:
+    """Every keyword of a large list found in one scan of the text
+
+    The keywords are folded into a trie and compiled to a single regex
+    ('pay(?:ment(?: of| received)?)?|...') wrapped in a lookahead, so re
+    walks the text once and at each position follows at most one trie path
+    to the longest keyword starting there. Shorter keywords starting at the
+    same position are that match's prefixes, looked up from a precomputed
+    table. Cost grows with the text, not with the number of keywords.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = frozenset(kw.lower() for kw in keywords if kw)
+        trie = {}
+        for keyword in self.keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[None] = True
+
+        # The leading class lets re reject positions no keyword can start at cheaply
+        first_chars = ''.join(sorted(trie))
+        self.pattern = re.compile(
+            f'(?=[{re.escape(first_chars)}])(?=({self._trie_regex(trie)}))'
+        ) if self.keywords else None
+        self.prefixes = {
+            keyword: frozenset(keyword[:i] for i in range(1, len(keyword) + 1)
+                               if keyword[:i] in self.keywords)
+            for keyword in self.keywords
+        }
+
+    @classmethod
+    def _trie_regex(cls, node):
+        branches = [re.escape(char) + cls._trie_regex(child)
+                    for char, child in sorted(node.items(), key=lambda item: item[0] or '')
+                    if char is not None]
+        if not branches:
+            return ''
+        regex = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if None in node:
+            # Greedy optional: the longer keyword is tried first, this one is the fallback
+            regex = f'(?:{regex})?'
+        return regex
+
+    def find(self, text_lower):
+        """Set of keywords occurring in already-lowercased text"""
+        hits = set()
+        if self.pattern is None or not text_lower:
+            return hits
+        for longest in set(self.pattern.findall(text_lower)):
+            hits |= self.prefixes[longest]
+        return hits
+
+
+def _rank(groups):
+    """keyword -> index of the first group listing it"""
+    ranks = {}
+    for index, keywords in enumerate(groups):
+        for keyword in keywords:
+            ranks.setdefault(keyword, index)
+    return ranks
+
+
+# ============ RULE PACK ============
+
+# detection_rules kinds that extend a built-in list -> (RulePack argument, defaults)
+RULE_LIST_KINDS = {
+    'blocked_sender': ('blocked_senders', BLOCKED_SENDER_PATTERNS),
+    'trusted_sender': ('trusted_senders', TRUSTED_SENDER_PATTERNS),
+    'spam_subject': ('spam_subject', SPAM_SUBJECT_KEYWORDS),
+    'spam_body': ('spam_body', SPAM_BODY_KEYWORDS),
+    'transaction_subject': ('transaction_subject', TRANSACTION_SUBJECT_KEYWORDS),
+    'transaction_body': ('transaction_body', TRANSACTION_BODY_KEYWORDS),
+}
+
+
+class RulePack:
+    """One version of the detection rules, compiled into matchers
+
+    Defaults to the built-in lists above; app.load_rule_pack() builds one
+    from the detection_rules and categories tables on top of them. A pack
+    is never changed after it's built: new rules mean a new pack swapped in
+    whole by install_rules(), and each email is judged by the pack that was
+    active when its headers were parsed.
+    """
+
+    def __init__(self, version=0, blocked_senders=None, trusted_senders=None,
+                 spam_subject=None, spam_body=None, transaction_subject=None,
+                 transaction_body=None, merchants=None, categories=None, payment_methods=None):
+        self.version = version
+        self.blocked_senders = list(BLOCKED_SENDER_PATTERNS if blocked_senders is None else blocked_senders)
+        self.trusted_senders = list(TRUSTED_SENDER_PATTERNS if trusted_senders is None else trusted_senders)
+        self.spam_subject = self._lower(SPAM_SUBJECT_KEYWORDS if spam_subject is None else spam_subject)
+        self.spam_body = self._lower(SPAM_BODY_KEYWORDS if spam_body is None else spam_body)
+        self.transaction_subject = self._lower(
+            TRANSACTION_SUBJECT_KEYWORDS if transaction_subject is None else transaction_subject)
+        self.transaction_body = self._lower(TRANSACTION_BODY_KEYWORDS if transaction_body is None else transaction_body)
+        self.merchants = {
+            keyword.lower(): name
+            for keyword, name in (MERCHANT_KEYWORDS if merchants is None else merchants).items()
+        }
+        self.categories = {
+            category: self._lower(keywords)
+            for category, keywords in (CATEGORY_KEYWORDS if categories is None else categories).items()
+        }
+        self.payment_methods = PAYMENT_METHOD_RULES if payment_methods is None else payment_methods
+
+        self.senders = SenderClassifier(self.blocked_senders, self.trusted_senders)
+        self.spam_subject_set = frozenset(self.spam_subject)
+        self.spam_body_set = frozenset(self.spam_body)
+        self.transaction_subject_set = frozenset(self.transaction_subject)
+        self.transaction_body_set = frozenset(self.transaction_body)
+        self.merchant_rank = _rank([keyword] for keyword in self.merchants)
+        self.merchant_names = list(self.merchants.values())
+        self.category_rank = _rank(self.categories.values())
+        self.category_names = list(self.categories)
+        self.payment_rank = _rank(keywords for _, keywords, _ in self.payment_methods)
+        self.keywords = KeywordAutomaton(
+            self.spam_subject + self.spam_body + self.transaction_subject + self.transaction_body
+            + list(self.merchants)
+            + [kw for keywords in self.categories.values() for kw in keywords]
+            + [kw for _, keywords, labels in self.payment_methods for kw in keywords + [k for k, _ in labels]]
+        )
+        self._server_filters = {}
+
+    @classmethod
+    def with_overrides(cls, version, rules=(), category_keywords=()):
+        """Built-in rules with database rows layered on top
+
+        rules are (kind, pattern, value, is_active) rows: kind is one of
+        RULE_LIST_KINDS, 'merchant' (value = display name, checked before the
+        built-in merchants) or 'category' (value = category name). An inactive
+        row removes that pattern, built-in or not. category_keywords are
+        (category, keyword) pairs added to the category lists.
+        """
+        lists = {kind: list(default) for kind, (_, default) in RULE_LIST_KINDS.items()}
+        merchants = {}
+        dropped_merchants = set()
+        categories = {category: list(keywords) for category, keywords in CATEGORY_KEYWORDS.items()}
+
+        for category, keyword in category_keywords:
+            keywords = categories.setdefault(category, [])
+            if keyword.lower() not in keywords:
+                keywords.append(keyword.lower())
+
+        for kind, pattern, value, is_active in rules:
+            pattern = (pattern or '').strip()
+            if not pattern:
+                continue
+            if kind in ('blocked_sender', 'trusted_sender'):
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    print(f"⚠️ Skipping invalid {kind} pattern {pattern!r}: {e}")
+                    continue
+            else:
+                pattern = pattern.lower()
 
+            if kind in lists:
+                if is_active:
+                    if pattern not in lists[kind]:
+                        lists[kind].append(pattern)
+                else:
+                    lists[kind] = [p for p in lists[kind] if p != pattern]
+            elif kind == 'merchant':
+                if is_active and value:
+                    merchants[pattern] = value
+                else:
+                    merchants.pop(pattern, None)
+                    dropped_merchants.add(pattern)
+            elif kind == 'category' and value:
+                if is_active:
+                    keywords = categories.setdefault(value, [])
+                    if pattern not in keywords:
+                        keywords.append(pattern)
+                elif value in categories:
+                    categories[value] = [k for k in categories[value] if k != pattern]
+
+        for keyword, name in MERCHANT_KEYWORDS.items():
+            if keyword not in dropped_merchants:
+                merchants.setdefault(keyword, name)
+
+        return cls(version, merchants=merchants, categories=categories,
+                   **{argument: lists[kind] for kind, (argument, _) in RULE_LIST_KINDS.items()})
+
+    @staticmethod
+    def _lower(keywords):
+        return [keyword.lower() for keyword in keywords if keyword]
+
+    def __reduce__(self):
+        # Rebuilt from its lists in the receiving process (extraction workers);
+        # the compiled matchers themselves don't pickle
+        return (RulePack, (self.version, self.blocked_senders, self.trusted_senders, self.spam_subject,
+                           self.spam_body, self.transaction_subject, self.transaction_body,
+                           self.merchants, self.categories, self.payment_methods))
+
+    def server_filter(self, gmail=False):
+        """build_server_filter() for this pack, built once per flavour"""
+        if gmail not in self._server_filters:
+            self._server_filters[gmail] = build_server_filter(gmail, rules=self)
+        return self._server_filters[gmail]
+
+    def summary(self):
+        """Rule counts for logs and the health endpoint"""
+        return {
+            'version': self.version,
+            'blocked_senders': len(self.blocked_senders),
+            'trusted_senders': len(self.trusted_senders),
+            'spam_keywords': len(self.spam_subject_set | self.spam_body_set),
+            'transaction_keywords': len(self.transaction_subject_set | self.transaction_body_set),
+            'merchants': len(self.merchants),
+            'categories': len(self.categories)
+        }
 
-def has_spam_subject(subject):
+
+_active_rules = RulePack()
+
+
+def active_rules():
+    """The rule pack new emails are classified with"""
+    return _active_rules
+
+
+def install_rules(pack):
+    """Make pack the active rules — a single reference swap, safe while workers run"""
+    global _active_rules
+    _active_rules = pack
+    return pack
+
+
+# ============ AMOUNT / GST / REFERENCE PATTERNS ============
+
+_NUMBER = r'[\d,]+\.?\d*'
+_CURRENCY = r'(?:₹|rs\.?|inr)?'
+_REFERENCE = r'[a-z0-9\-]{6,25}'
+
+# kind -> (prefix, captured value), matched against lowercased text. The
+# extractors try the kinds in this order and stop at the first that yields.
+SCAN_PATTERNS = {
+    # amounts
+    'rupee_symbol': (r'₹\s*', _NUMBER),
+    'rs': (r'rs\.?\s*', _NUMBER),
+    'inr': (r'inr\s*', _NUMBER),
+    'rupees': (r'rupees?\s*', _NUMBER),
+    'amount_keyword': (rf'(?:amount|total|paid|charged|debited|credited)\s*(?::|is|of|for)?\s*{_CURRENCY}\s*', _NUMBER),
+    'dollar': (r'\$', _NUMBER),
+    'decimal': (r'\b', r'\d+\.\d{2}\b'),
+    # GST
+    'gst': (rf'(?:gst|cgst|sgst|igst)\s*(?::|@|amount)?\s*{_CURRENCY}\s*', _NUMBER),
+    'tax': (rf'(?:tax|gst)\s*(?:amount)?\s*(?::|=)?\s*{_CURRENCY}\s*', _NUMBER),
+    # transaction / order IDs
+    'order': (r'order\s*(?:id|#|no\.?|number)?\s*[:\-]?\s*', _REFERENCE),
+    'transaction': (r'transaction\s*(?:id|#|no\.?)?\s*[:\-]?\s*', _REFERENCE),
+    'upi_ref': (r'upi\s*ref\s*(?:no\.?|#)?\s*[:\-]?\s*', r'\d{10,16}'),
+    'ref': (r'ref\s*(?:no\.?|#|id)?\s*[:\-]?\s*', _REFERENCE),
+    'booking': (r'booking\s*id\s*[:\-]?\s*', _REFERENCE),
+}
+
+AMOUNT_KINDS = ('rupee_symbol', 'rs', 'inr', 'rupees', 'amount_keyword')
+FALLBACK_AMOUNT_KINDS = ('dollar', 'decimal')
+GST_KINDS = ('gst', 'tax')
+REFERENCE_KINDS = ('order', 'transaction', 'upi_ref', 'ref', 'booking')
+
+
+class ValueScanner:
+    """Amounts, GST figures and reference IDs of one text, scanned per kind
+
+    Each SCAN_PATTERNS kind is searched at most once, and only when an
+    extractor asks for it — they stop at the first kind that yields
+    something, so most emails never reach the fallbacks. Patterns are
+    precompiled and run on the lowercased text without IGNORECASE, which
+    keeps re's literal-prefix search. (One alternation of every kind in a
+    single pass measured twice as slow on long bodies: it has to stop at
+    nearly every character.)
+    """
+
+    PATTERNS = {kind: re.compile(f'{prefix}({value})') for kind, (prefix, value) in SCAN_PATTERNS.items()}
+    PATTERNS_ANYCASE = {kind: re.compile(pattern.pattern, re.IGNORECASE) for kind, pattern in PATTERNS.items()}
+
+    __slots__ = ('text', '_scanned', '_patterns', '_found')
+
+    def __init__(self, text, text_lower=None):
+        if text_lower is None:
+            text_lower = text.lower()
+        self.text = text
+        if len(text_lower) == len(text):
+            self._scanned, self._patterns = text_lower, self.PATTERNS
+        else:
+            # Lowercasing changed some lengths, so offsets wouldn't line up
+            self._scanned, self._patterns = text, self.PATTERNS_ANYCASE
+        self._found = {}
+
+    def values(self, kind):
+        """Every value of kind, as re.findall would return them"""
+        if kind not in self._found:
+            self._found[kind] = self._patterns[kind].findall(self._scanned)
+        return self._found[kind]
+
+    def first(self, kind):
+        """The leftmost value of kind in its original case, or None"""
+        match = self._patterns[kind].search(self._scanned)
+        return self.text[match.start(1):match.end(1)] if match else None
+
+
+# ============ EMAIL FEATURES ============
+
+CURRENCY_RE = re.compile(r'[₹]|Rs\.?|INR', re.IGNORECASE)
+
+
+class EmailFeatures:
+    """Values derived from one email, each computed on first use
+
+    Shared by the header filter, body filter, extractor and confidence
+    score so the lowercased text, keyword hits and sender verdict are built
+    once per email. Created from the headers; the body is set once it's
+    downloaded, which resets everything derived from it.
+    """
+
+    __slots__ = ('rules', 'subject', 'sender', '_body', '_subject_lower', '_body_lower', '_text',
+                 '_subject_hits', '_body_hits', '_hits', '_merchant_hits', '_has_currency', '_scanner')
+
+    def __init__(self, subject, sender='', body='', rules=None):
+        self.rules = rules or active_rules()
+        self.subject = subject or ''
+        self.sender = sender or ''
+        self._subject_lower = self._subject_hits = None
+        self.body = body
+
+    @property
+    def body(self):
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body or ''
+        self._body_lower = self._text = self._body_hits = None
+        self._hits = self._merchant_hits = self._has_currency = self._scanner = None
+
+    @property
+    def subject_lower(self):
+        if self._subject_lower is None:
+            self._subject_lower = self.subject.lower()
+        return self._subject_lower
+
+    @property
+    def body_lower(self):
+        if self._body_lower is None:
+            self._body_lower = self._body.lower()
+        return self._body_lower
+
+    @property
+    def text(self):
+        """Subject and body as the extractor reads them"""
+        if self._text is None:
+            self._text = f"{self.subject}\n{self._body}"
+        return self._text
+
+    @property
+    def subject_hits(self):
+        if self._subject_hits is None:
+            self._subject_hits = frozenset(self.rules.keywords.find(self.subject_lower))
+        return self._subject_hits
+
+    @property
+    def body_hits(self):
+        if self._body_hits is None:
+            self._body_hits = frozenset(self.rules.keywords.find(self.body_lower))
+        return self._body_hits
+
+    @property
+    def hits(self):
+        """Keywords anywhere in subject or body"""
+        if self._hits is None:
+            self._hits = self.subject_hits | self.body_hits
+        return self._hits
+
+    @property
+    def merchant_hits(self):
+        """Keywords in subject, body or sender — merchants also match on the From header"""
+        if self._merchant_hits is None:
+            self._merchant_hits = self.hits | self.rules.keywords.find(self.sender.lower())
+        return self._merchant_hits
+
+    @property
+    def is_blocked(self):
+        return self.rules.senders.classify(self.sender)[0]
+
+    @property
+    def is_trusted(self):
+        return self.rules.senders.classify(self.sender)[1]
+
+    @property
+    def has_currency(self):
+        """₹/Rs/INR anywhere in subject or body"""
+        if self._has_currency is None:
+            self._has_currency = CURRENCY_RE.search(self.text) is not None
+        return self._has_currency
+
+    @property
+    def scanner(self):
+        """ValueScanner over subject and body"""
+        if self._scanner is None:
+            self._scanner = ValueScanner(self.text, f"{self.subject_lower}\n{self.body_lower}")
+        return self._scanner
+
+
+def has_spam_subject(subject, features=None):
     """Check if subject contains spam/promotional keywords"""
-    subject_lower = subject.lower()
-    spam_count = 0
-    for keyword in SPAM_SUBJECT_KEYWORDS:
-        if keyword in subject_lower:
-            spam_count += 1
+    features = features or EmailFeatures(subject)
+    spam_count = len(features.subject_hits & features.rules.spam_subject_set)
     return spam_count >= 1
 
 
-def has_spam_body(body):
+def has_spam_body(body, features=None):
     """Check if email body contains spam/promotional indicators"""
-    body_lower = body.lower()
-    spam_count = 0
-    for keyword in SPAM_BODY_KEYWORDS:
-        if keyword in body_lower:
-            spam_count += 1
+    features = features or EmailFeatures('', body=body)
+    spam_count = len(features.body_hits & features.rules.spam_body_set)
     # If 3 or more spam body indicators found, it's likely promotional
     return spam_count >= 3
 
 
-def has_transaction_indicators(subject, body):
+def has_transaction_indicators(subject, body, features=None):
     """Check if email has transaction-related keywords"""
-    text_lower = (subject + ' ' + body).lower()
-
-    subject_lower = subject.lower()
-    subject_hits = sum(1 for kw in TRANSACTION_SUBJECT_KEYWORDS if kw in subject_lower)
-
-    body_lower = body.lower()
-    body_hits = sum(1 for kw in TRANSACTION_BODY_KEYWORDS if kw in body_lower)
-
+    features = features or EmailFeatures(subject, body=body)
+    subject_hits = len(features.subject_hits & features.rules.transaction_subject_set)
+    body_hits = len(features.body_hits & features.rules.transaction_body_set)
     return subject_hits, body_hits
 
 
-def calculate_confidence(sender, subject, body, amount, merchant):
+def calculate_confidence(sender, subject, body, amount, merchant, features=None):
     """Calculate confidence score (0-100) for an extracted expense"""
+    features = features or EmailFeatures(subject, sender, body)
     score = 0
 
     # Trusted sender: +30
-    if is_trusted_sender(sender):
+    if features.is_trusted:
         score += 30
 
     # Blocked sender: -50
-    if is_blocked_sender(sender):
+    if features.is_blocked:
         score -= 50
 
     # Transaction subject keywords: up to +25
-    subject_hits, body_hits = has_transaction_indicators(subject, body)
+    subject_hits, body_hits = has_transaction_indicators(subject, body, features)
     score += min(subject_hits * 10, 25)
 
     # Transaction body keywords: up to +25
     score += min(body_hits * 5, 25)
 
     # Spam subject keywords penalty: -15 each (max -30)
-    subject_lower = subject.lower()
-    spam_hits = sum(1 for kw in SPAM_SUBJECT_KEYWORDS if kw in subject_lower)
+    spam_hits = len(features.subject_hits & features.rules.spam_subject_set)
     score -= min(spam_hits * 15, 30)
 
     # Amount found with ₹/Rs/INR pattern: +10
-    text = subject + ' ' + body
-    if re.search(r'[₹]|Rs\.?|INR', text, re.IGNORECASE):
+    if features.has_currency:
         score += 10
 
     # Known merchant detected: +10
@@ -227,24 +847,431 @@ def calculate_confidence(sender, subject, body, amount, merchant):
     return max(0, min(100, score))
 
 
+# ============ SERVER-SIDE SEARCH FILTERS ============
+
+# Gmail categories that never hold receipts worth downloading
+GMAIL_EXCLUDED_CATEGORIES = ['promotions', 'social', 'forums']
+
+# Body words Gmail's full-text index can match cheaply (single words only)
+GMAIL_BODY_TERMS = ['debited', 'invoice', 'receipt', 'upi']
+
+
+def _minimal_terms(terms):
+    """Dedupe substring-search terms, dropping any that contain a shorter one"""
+    unique = sorted(set(t.lower() for t in terms), key=len)
+    kept = []
+    for term in unique:
+        if not any(shorter in term for shorter in kept):
+            kept.append(term)
+    return sorted(kept)
+
+
+def trusted_sender_domains(rules=None):
+    """Domains behind the trusted sender patterns, e.g. 'hdfcbank.net'"""
+    return _minimal_terms(
+        pattern.split('@', 1)[1].replace('\\.', '.')
+        for pattern in (rules or active_rules()).trusted_senders if '@' in pattern
+    )
+
+
+def blocked_sender_literals(rules=None):
+    """Blocked sender patterns that are plain substrings, usable in IMAP FROM"""
+    literals = []
+    for pattern in (rules or active_rules()).blocked_senders:
+        literal = pattern.replace('\\.', '.')
+        if not _REGEX_META.search(literal):
+            literals.append(literal)
+    return _minimal_terms(literals)
+
+
+def _imap_quote(text):
+    """Quote a string argument for an IMAP SEARCH command"""
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def build_or_tree(keys):
+    """Combine IMAP search keys with binary OR, balanced to keep nesting shallow"""
+    if len(keys) == 1:
+        return keys[0]
+    middle = len(keys) // 2
+    left = build_or_tree(keys[:middle])
+    right = build_or_tree(keys[middle:])
+    return f'OR ({left}) ({right})'
+
+
+def build_server_filter(gmail=False, rules=None):
+    """SEARCH criteria matching only candidate transaction mail
+
+    Gmail gets a single X-GM-RAW query (category:purchases, trusted sender
+    domains, subject keywords, promotional categories excluded). Other servers
+    get an OR tree of FROM/SUBJECT keys plus NOT FROM for blocked senders.
+    The client-side filters still run on whatever comes back.
+    """
+    rules = rules or active_rules()
+    domains = trusted_sender_domains(rules)
+    subjects = _minimal_terms(rules.transaction_subject)
+
+    if gmail:
+        quoted = ' OR '.join(f'"{s}"' if ' ' in s else s for s in subjects)
+        excluded = ' '.join(f'-category:{c}' for c in GMAIL_EXCLUDED_CATEGORIES)
+        raw = (
+            f'from:({" OR ".join(domains)}) OR '
+            f'((category:purchases OR subject:({quoted}) OR {" OR ".join(GMAIL_BODY_TERMS)}) {excluded})'
+        )
+        return f'X-GM-RAW {_imap_quote(raw)}'
+
+    keys = [f'FROM {_imap_quote(d)}' for d in domains]
+    keys += [f'SUBJECT {_imap_quote(s)}' for s in subjects]
+    criteria = f'({build_or_tree(keys)})'
+    for literal in blocked_sender_literals(rules):
+        criteria += f' NOT FROM {_imap_quote(literal)}'
+    return criteria
+
+
+# ============ IMAP FETCH HELPERS ============
+
+# Messages requested per FETCH command (1 = one round trip per message)
+DEFAULT_FETCH_CHUNK_SIZE = 40
+
+# Days of mail rescanned on first sync or after a UIDVALIDITY change
+RESCAN_DAYS = 2
+
+# extract_expense_data_batch: smaller batches stay in-process (a worker
+# pool costs more to start than it saves), and emails sent per worker task
+BATCH_EXTRACT_MIN_SIZE = 500
+BATCH_EXTRACT_CHUNK_SIZE = 200
+
+# Servers drop IDLE after 30 minutes of silence (RFC 2177), so re-issue before that
+IDLE_REFRESH_SECONDS = 29 * 60
+
+IDLE_EXISTS_RE = re.compile(rb'^\* \d+ EXISTS')
+
+# Phase-1 fetch: MIME layout plus just what the sender/subject spam filters need
+HEADER_FETCH_PARTS = "(BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE MESSAGE-ID)])"
+
+# Bytes of the chosen text section pulled per message (HTML carries more markup)
+PARTIAL_FETCH_BYTES = 8192
+PARTIAL_FETCH_BYTES_HTML = 32768
+
+FETCH_SEQ_RE = re.compile(rb'^(\d+) \(')
+FETCH_LITERAL_RE = re.compile(rb'\{\d+\}$')
+
+_OPEN, _CLOSE = object(), object()
+
+
+def build_sequence_set(ids):
+    """Compress message ids into an IMAP sequence set, e.g. 1:40,45,47:48"""
+    numbers = sorted({int(i) for i in ids})
+    ranges = []
+    for n in numbers:
+        if ranges and n == ranges[-1][1] + 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return ','.join(f"{lo}:{hi}" if lo != hi else str(lo) for lo, hi in ranges)
+
+
+def _tokenize_imap(text):
+    """Yield IMAP tokens: parens, atoms (str), quoted strings (str), NIL (None)"""
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i:i + 1]
+        if c in (b' ', b'\r', b'\n'):
+            i += 1
+        elif c == b'(':
+            yield _OPEN
+            i += 1
+        elif c == b')':
+            yield _CLOSE
+            i += 1
+        elif c == b'"':
+            j, buf = i + 1, bytearray()
+            while j < n and text[j:j + 1] != b'"':
+                if text[j:j + 1] == b'\\':
+                    j += 1
+                buf += text[j:j + 1]
+                j += 1
+            yield buf.decode('utf-8', errors='ignore')
+            i = j + 1
+        else:
+            # Atoms may carry a bracketed section, e.g. BODY[HEADER.FIELDS (FROM)]<0>
+            j, depth = i, 0
+            while j < n:
+                ch = text[j:j + 1]
+                if ch == b'[':
+                    depth += 1
+                elif ch == b']':
+                    depth -= 1
+                elif depth == 0 and ch in (b' ', b'(', b')'):
+                    break
+                j += 1
+            atom = text[i:j].decode('ascii', errors='ignore')
+            yield None if atom.upper() == 'NIL' else atom
+            i = j
+
+
+def _parse_fetch_message(segments):
+    """Parse one message's FETCH response into {ITEM: value}"""
+    root = []
+    stack = [root]
+    for text, literal in segments:
+        if literal is not None:
+            text = FETCH_LITERAL_RE.sub(b'', text.rstrip())
+        for token in _tokenize_imap(text):
+            if token is _OPEN:
+                stack.append([])
+            elif token is _CLOSE:
+                if len(stack) > 1:
+                    child = stack.pop()
+                    stack[-1].append(child)
+            else:
+                stack[-1].append(token)
+        if literal is not None:
+            stack[-1].append(literal)
+
+    # root = [seq, [NAME, value, NAME, value, ...]]
+    items = {'SEQ': root[0]}
+    if len(root) > 1 and isinstance(root[1], list):
+        pairs = root[1]
+        for k in range(0, len(pairs) - 1, 2):
+            if isinstance(pairs[k], str):
+                items[pairs[k].upper()] = pairs[k + 1]
+    return items
+
+
+def parse_fetch_response(msg_data):
+    """Split imaplib FETCH data into one {ITEM: value} dict per message"""
+    responses = []
+    for item in msg_data:
+        if isinstance(item, tuple):
+            text, literal = item[0], item[1]
+        else:
+            text, literal = item, None
+        if not isinstance(text, bytes):
+            continue
+        # A new message starts with "<seq> ("; anything else continues the
+        # previous one (text that followed a literal, closing paren)
+        if FETCH_SEQ_RE.match(text) or not responses:
+            responses.append([])
+        responses[-1].append((text, literal))
+
+    messages = []
+    for segments in responses:
+        try:
+            messages.append(_parse_fetch_message(segments))
+        except Exception as e:
+            print(f"Error parsing FETCH response: {e}")
+    return messages
+
+
+def find_body_item(items, section, prefix=False):
+    """Get a BODY[section] value from parsed FETCH items, ignoring any <origin> suffix"""
+    for name, value in items.items():
+        if not name.startswith('BODY[') or ']' not in name:
+            continue
+        name_section = name[5:name.rindex(']')]
+        if name_section == section or (prefix and name_section.startswith(section)):
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            return value
+    return None
+
+
+def find_text_part(structure):
+    """Pick the best text section from a BODYSTRUCTURE — text/plain, else text/html
+
+    Returns a dict with section, subtype, encoding and charset, or None when
+    the message has no inline text part at all.
+    """
+    found = {}
+
+    def walk(node, section):
+        if not isinstance(node, list) or not node:
+            return
+        if isinstance(node[0], list):
+            # multipart: child parts first, then the multipart subtype
+            index = 1
+            for child in node:
+                if not isinstance(child, list):
+                    break
+                walk(child, f"{section}.{index}" if section else str(index))
+                index += 1
+            return
+
+        if len(node) < 6 or str(node[0]).lower() != 'text':
+            return
+        subtype = str(node[1]).lower()
+        if subtype not in ('plain', 'html') or subtype in found:
+            return
+
+        params = node[2] if isinstance(node[2], list) else []
+        params = {str(params[k]).lower(): params[k + 1] for k in range(0, len(params) - 1, 2)}
+        disposition = node[9] if len(node) > 9 and isinstance(node[9], list) and node[9] else None
+        if 'name' in params or (disposition and str(disposition[0]).lower() == 'attachment'):
+            return
+
+        found[subtype] = {
+            # A single-part message's body is section 1
+            'section': section or '1',
+            'subtype': subtype,
+            'encoding': str(node[5] or '7bit').lower(),
+            'charset': str(params.get('charset') or 'utf-8'),
+        }
+
+    walk(structure, '')
+    return found.get('plain') or found.get('html')
+
+
+def decode_text_part(data, part, max_chars=3000):
+    """Decode a (possibly truncated) text section fetched with a byte-range partial"""
+    if part['encoding'] == 'base64':
+        data = re.sub(rb'\s+', b'', data)
+        data = base64.b64decode(data[:len(data) - len(data) % 4])
+    elif part['encoding'] == 'quoted-printable':
+        data = quopri.decodestring(data)
+
+    try:
+        text = data.decode(part['charset'], errors='ignore')
+    except LookupError:
+        text = data.decode('utf-8', errors='ignore')
+
+    if part['subtype'] == 'html':
+        return html_to_text(text, max_chars)
+
+    return text[:max_chars]
+
+
+# Tags whose contents are never text, and tags that end a line of text
+HTML_SKIP_TAGS = frozenset(('style', 'script', 'noscript', 'template'))
+HTML_BLOCK_TAGS = frozenset((
+    'br', 'p', 'div', 'tr', 'li', 'ul', 'ol', 'table', 'tbody', 'thead', 'tfoot',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'title', 'center', 'blockquote', 'section',
+))
+HTML_CELL_TAGS = frozenset(('td', 'th'))
+
+_HTML_TAG_NAME = re.compile(r'/?([A-Za-z][A-Za-z0-9]*)')
+_HTML_SKIP_END = {tag: re.compile(rf'</{tag}\s*>', re.IGNORECASE) for tag in HTML_SKIP_TAGS}
+_HTML_SPACES = re.compile(r'[ \t\r\f\v\xa0]+')
+
+
+def html_to_text(html, max_chars=3000):
+    """HTML to plain text in a single forward pass
+
+    Drops style/script contents and comments, puts each block element and
+    table row on its own line and joins table cells with a space, so
+    "Total</td><td>₹250" reads "Total ₹250". Stops once max_chars of text
+    are produced. Every search moves forward from the current position and
+    an unterminated tag or comment ends the scan, so malformed markup costs
+    linear time.
+    """
+    pieces = []
+    size = 0
+    pos = 0
+    length = len(html)
+
+    while pos < length and size < max_chars:
+        lt = html.find('<', pos)
+        chunk = html[pos:] if lt == -1 else html[pos:lt]
+        if chunk:
+            chunk = _HTML_SPACES.sub(' ', unescape(chunk).replace('\n', ' '))
+            pieces.append(chunk)
+            size += len(chunk)
+        if lt == -1:
+            break
+
+        if html.startswith('<!--', lt):
+            end = html.find('-->', lt + 4)
+            if end == -1:
+                break
+            pos = end + 3
+            continue
+
+        match = _HTML_TAG_NAME.match(html, lt + 1)
+        if not match:
+            if html.startswith('<!', lt) or html.startswith('<?', lt):
+                # <!DOCTYPE ...>, <?xml ...?>
+                end = html.find('>', lt + 2)
+                if end == -1:
+                    break
+                pos = end + 1
+                continue
+            # A bare "<" in text, e.g. "a < b"
+            pieces.append('<')
+            size += 1
+            pos = lt + 1
+            continue
+
+        end = html.find('>', match.end())
+        if end == -1:
+            break
+        pos = end + 1
+
+        name = match.group(1).lower()
+        closing = html[lt + 1] == '/'
+        if name in HTML_SKIP_TAGS and not closing:
+            skip = _HTML_SKIP_END[name].search(html, pos)
+            if not skip:
+                break
+            pos = skip.end()
+        elif name in HTML_CELL_TAGS:
+            pieces.append(' ')
+        elif name in HTML_BLOCK_TAGS:
+            pieces.append('\n')
+
+    text = _HTML_SPACES.sub(' ', ''.join(pieces))
+    lines = (line.strip() for line in text.split('\n'))
+    return '\n'.join(line for line in lines if line)[:max_chars]
+
+
 class EmailProcessor:
-    def __init__(self, imap_server, imap_port, username, password):
+    def __init__(self, imap_server, imap_port, username, password,
+                 fetch_chunk_size=DEFAULT_FETCH_CHUNK_SIZE, timeout=None, server_filter=False,
+                 known_message_ids=None):
         self.imap_server = imap_server
         self.imap_port = imap_port
         self.username = username
         self.password = password
+        self.fetch_chunk_size = max(1, int(fetch_chunk_size))
+        self.timeout = timeout
+        self.server_filter = server_filter
+        # known_message_ids(ids) -> the subset already ingested; those bodies are never fetched
+        self.known_message_ids = known_message_ids
+        self._gmail = None
         self.mail = None
         self.connected = False
+        self.sync_state = {'uid_validity': None, 'last_uid': 0}
+        self.last_examined = None
+        self.range_complete = False
+        self.fetch_error = None  # why the last iter_* pass stopped early, if it did
+        self.last_error = None
+        self.auth_failed = False
 
     def connect(self):
-        """Connect to IMAP server"""
+        """Connect to IMAP server
+
+        On failure last_error holds the reason and auth_failed is True when the
+        server rejected the credentials (as opposed to a network problem).
+        """
+        self.last_error = None
+        self.auth_failed = False
+        try:
+            self.mail = imaplib.IMAP4_SSL(self.imap_server, self.imap_port, timeout=self.timeout)
+        except Exception as e:
+            print(f"Connection error: {e}")
+            self.last_error = str(e)
+            return False
+
         try:
-            self.mail = imaplib.IMAP4_SSL(self.imap_server, self.imap_port)
             self.mail.login(self.username, self.password)
             self.connected = True
+            self._gmail = None
             return True
         except Exception as e:
             print(f"Connection error: {e}")
+            reason = e.args[0] if e.args else e
+            self.last_error = reason.decode(errors='replace') if isinstance(reason, bytes) else str(reason)
+            # A NO to LOGIN is imaplib.IMAP4.error; a dropped socket is its abort subclass
+            self.auth_failed = isinstance(e, imaplib.IMAP4.error) and not isinstance(e, imaplib.IMAP4.abort)
             return False
 
     def disconnect(self):
@@ -268,6 +1295,132 @@ class EmailProcessor:
             self.connected = False
             return False
 
+    def has_capability(self, name):
+        """Check whether the logged-in server advertises a CAPABILITY atom"""
+        try:
+            # Re-ask after LOGIN — some servers only list extensions once authenticated
+            status, data = self.mail.capability()
+            if status == "OK" and data and data[0]:
+                return name.encode() in data[0].upper().split()
+        except:
+            pass
+        return name in getattr(self.mail, 'capabilities', ())
+
+    def supports_idle(self):
+        """Check whether the server advertises IMAP IDLE (RFC 2177)"""
+        return self.has_capability('IDLE')
+
+    def search_filter(self):
+        """Server-side candidate filter appended to SEARCH, or '' when disabled"""
+        if not self.server_filter:
+            return ''
+        if self._gmail is None:
+            # X-GM-EXT-1 marks Gmail, which takes its own search syntax
+            self._gmail = self.has_capability('X-GM-EXT-1')
+        # Built once per rule pack, so pooled connections follow rule reloads
+        return active_rules().server_filter(gmail=self._gmail)
+
+    def idle(self, timeout=IDLE_REFRESH_SECONDS, stop_event=None):
+        """Block in IMAP IDLE until the server reports new mail
+
+        Returns True on an EXISTS notification, False when timeout passes or
+        stop_event is set. The mailbox must already be selected. imaplib has no
+        IDLE support, so this talks to the socket directly — after taking
+        whatever imaplib already holds, so mail announced during the previous
+        command (e.g. the catch-up FETCH) returns at once instead of waiting
+        for the next refresh.
+        """
+        if self._exists_announced():
+            return True
+
+        tag = self.mail._new_tag()
+        sock = self.mail.sock
+        previous_timeout = sock.gettimeout()
+        deadline = time.monotonic() + timeout
+        buffer = self._drain_buffered()
+        idling = False
+        got_new = False
+
+        self.mail.send(tag + b' IDLE\r\n')
+        sock.settimeout(1)
+
+        try:
+            while True:
+                while b'\r\n' in buffer:
+                    line, buffer = buffer.split(b'\r\n', 1)
+                    if line.startswith(b'+'):
+                        idling = True
+                    elif line.startswith(tag):
+                        raise imaplib.IMAP4.error(f"IDLE rejected: {line.decode(errors='ignore')}")
+                    elif IDLE_EXISTS_RE.match(line):
+                        got_new = True
+
+                if idling and (got_new or time.monotonic() >= deadline
+                               or (stop_event is not None and stop_event.is_set())):
+                    break
+
+                try:
+                    chunk = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    raise imaplib.IMAP4.abort("connection closed during IDLE")
+                buffer += chunk
+
+            # Leave IDLE and wait for the tagged completion
+            self.mail.send(b'DONE\r\n')
+            done_deadline = time.monotonic() + 30
+            while not any(line.startswith(tag) for line in buffer.split(b'\r\n')[:-1]):
+                if time.monotonic() >= done_deadline:
+                    raise imaplib.IMAP4.abort("no response to IDLE DONE")
+                try:
+                    chunk = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    raise imaplib.IMAP4.abort("connection closed during IDLE")
+                buffer += chunk
+
+            # EXISTS can also arrive while DONE is being answered
+            return got_new or any(IDLE_EXISTS_RE.match(line) for line in buffer.split(b'\r\n'))
+
+        except Exception:
+            self.connected = False
+            raise
+
+        finally:
+            try:
+                sock.settimeout(previous_timeout)
+            except OSError:
+                pass
+
+    def _exists_announced(self):
+        """True if an untagged EXISTS since SELECT grew the mailbox (imaplib files these away)"""
+        counts = self.mail.untagged_responses.pop('EXISTS', None)
+        if not counts:
+            return False
+        try:
+            counts = [int(count) for count in counts]
+        except (TypeError, ValueError):
+            return False
+        # Keep the latest count as the baseline for the next check
+        self.mail.untagged_responses['EXISTS'] = [str(counts[-1]).encode()]
+        return max(counts) > counts[0]
+
+    def _drain_buffered(self):
+        """Bytes imaplib has read ahead into its file buffer but not parsed yet"""
+        sock = self.mail.sock
+        previous_timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            # peek() returns the buffer; with nothing buffered its one socket read can't block
+            pending = self.mail.file.peek()
+        except (BlockingIOError, ssl.SSLWantReadError):
+            pending = b''
+        finally:
+            sock.settimeout(previous_timeout)
+        return self.mail.file.read(len(pending)) if pending else b''
+
     def get_unread_emails_fast(self, limit=10):
         """Get unread emails quickly with spam filtering"""
         try:
@@ -279,7 +1432,8 @@ class EmailProcessor:
 
             date_since = (datetime.now() - timedelta(days=2)).strftime("%d-%b-%Y")
 
-            status, messages = self.mail.search(None, f'(UNSEEN SINCE "{date_since}")')
+            criteria = f'(UNSEEN SINCE "{date_since}") {self.search_filter()}'.strip()
+            status, messages = self.mail.search(None, criteria)
 
             if status != "OK":
                 return []
@@ -291,76 +1445,381 @@ class EmailProcessor:
             if fetch_limit > 0:
                 email_ids = email_ids[:fetch_limit]
 
-            emails = []
+            return list(self._iter_filtered(email_ids, limit))
 
-            for email_id in email_ids:
-                if len(emails) >= limit:
-                    break
+        except Exception as e:
+            print(f"Error fetching emails: {e}")
+            self.connected = False
+            return []
+
+    def get_new_emails(self, last_uid=0, uid_validity=None, limit=20, include_raw=False):
+        """List version of iter_new_emails"""
+        return list(self.iter_new_emails(last_uid, uid_validity, limit, include_raw))
+
+    def iter_new_emails(self, last_uid=0, uid_validity=None, limit=20, include_raw=False):
+        """Yield emails that arrived after the last processed UID, one at a time
+
+        Only one FETCH chunk is held in memory. self.sync_state advances past
+        each email once the caller asks for the next one, and past skipped
+        spam when the iterator is exhausted — persist it after consuming.
+        If the pass stops early (connection, SEARCH or FETCH error)
+        self.fetch_error says why; don't persist sync_state then.
+        The raw message text is only included when include_raw is set.
+        """
+        last_uid = int(last_uid or 0)
+        self.sync_state = {'uid_validity': uid_validity, 'last_uid': last_uid}
+        self.fetch_error = None
+
+        try:
+            if not self.is_connected():
+                if not self.connect():
+                    self.fetch_error = self.last_error or 'Failed to connect to email server'
+                    return
+
+            status, _ = self.mail.select("inbox")
+            if status != "OK":
+                self.fetch_error = 'SELECT inbox failed'
+                return
+
+            current_validity = self._get_select_response('UIDVALIDITY')
+            uid_next = self._get_select_response('UIDNEXT')
 
+            if last_uid and uid_validity is not None and current_validity == int(uid_validity):
+                criteria = f'UID {last_uid + 1}:*'
+            else:
+                # First sync or mailbox rebuilt — old UIDs are meaningless, so
+                # fall back to a bounded rescan of recent mail
+                last_uid = 0
+                date_since = (datetime.now() - timedelta(days=RESCAN_DAYS)).strftime("%d-%b-%Y")
+                criteria = f'SINCE "{date_since}"'
+
+            status, messages = self.mail.uid('SEARCH', f'{criteria} {self.search_filter()}'.strip())
+
+            if status != "OK":
+                self.fetch_error = 'UID SEARCH failed'
+                return
+
+            # "n:*" always matches the newest message, even when its UID < n
+            matched = sorted(
+                (uid for uid in messages[0].split() if int(uid) > last_uid),
+                key=int
+            )
+            email_ids = matched[:limit * 3]
+
+            self.sync_state = {'uid_validity': current_validity, 'last_uid': last_uid}
+
+            for email_data in self._iter_filtered(email_ids, limit, uid=True, include_raw=include_raw):
+                yield email_data
+                self.sync_state['last_uid'] = max(last_uid, int(email_data['id']))
+
+            if self.fetch_error:
+                # Unread mail lies past the last yielded email — leave the mark there
+                return
+
+            if uid_next and (not matched or self.last_examined == matched[-1]):
+                # Every match was examined, so UIDs the search skipped (server
+                # filter non-candidates) never need searching again
+                last_uid = max(last_uid, uid_next - 1)
+            elif self.last_examined is not None:
+                last_uid = max(last_uid, int(self.last_examined))
+
+            self.sync_state['last_uid'] = last_uid
+
+        except Exception as e:
+            print(f"Error fetching emails: {e}")
+            self.fetch_error = str(e)
+            self.connected = False
+
+    def iter_emails_between(self, since, before, include_raw=False):
+        """Yield filtered emails dated since <= date < before (historical backfill)
+
+        Afterwards self.range_complete says whether every message in the range
+        was examined; on a connection or FETCH error it is False so the caller
+        can retry the same range instead of skipping it.
+        """
+        self.range_complete = False
+        self.fetch_error = None
+
+        try:
+            if not self.is_connected():
+                if not self.connect():
+                    return
+
+            status, _ = self.mail.select("inbox")
+            if status != "OK":
+                return
+
+            criteria = f'SINCE "{since.strftime("%d-%b-%Y")}" BEFORE "{before.strftime("%d-%b-%Y")}"'
+            status, messages = self.mail.uid('SEARCH', f'{criteria} {self.search_filter()}'.strip())
+
+            if status != "OK":
+                return
+
+            email_ids = sorted(messages[0].split(), key=int)
+            yield from self._iter_filtered(email_ids, len(email_ids), uid=True, include_raw=include_raw)
+
+            self.range_complete = not email_ids or self.last_examined == email_ids[-1]
+
+        except Exception as e:
+            print(f"Error fetching emails: {e}")
+            self.fetch_error = str(e)
+            self.connected = False
+
+    def _get_select_response(self, code):
+        """Read a numeric SELECT response code such as UIDVALIDITY or UIDNEXT"""
+        try:
+            _, data = self.mail.response(code)
+            if data and data[-1] is not None:
+                return int(data[-1])
+        except:
+            pass
+        return None
+
+    def _iter_filtered(self, email_ids, limit, uid=False, include_raw=False):
+        """Fetch messages in chunks and yield those passing the spam filters, up to limit
+
+        Each chunk is fetched in two phases: headers + BODYSTRUCTURE first, so
+        blocked senders and promotional subjects are dropped before any body is
+        downloaded, then only the chosen text section of the survivors.
+        self.last_examined tracks the last id looked at, for high-water marks;
+        it never passes a candidate whose body wasn't fetched, and
+        self.fetch_error is set when a FETCH fails part way.
+        """
+        self.last_examined = None
+        passed = 0
+
+        # One FETCH per chunk instead of one round trip per message
+        for start in range(0, len(email_ids), self.fetch_chunk_size):
+            if passed >= limit:
+                break
+
+            chunk = email_ids[start:start + self.fetch_chunk_size]
+
+            # Phase 1: headers and MIME structure, for the whole chunk
+            fetched = self._fetch_chunk(chunk, HEADER_FETCH_PARTS, uid=uid)
+            if fetched is None:
+                self.fetch_error = 'Header FETCH failed'
+                return
+
+            candidates = {}
+            for email_id in chunk:
+                items = fetched.get(email_id)
+                raw_headers = find_body_item(items, 'HEADER.FIELDS', prefix=True) if items else None
+                if raw_headers is None:
+                    continue
                 try:
-                    status, msg_data = self.mail.fetch(email_id, "(BODY.PEEK[])")
-
-                    if status != "OK":
-                        continue
-
-                    raw_email = msg_data[0][1]
-                    msg = email.message_from_bytes(raw_email)
-
-                    subject = self._decode_header_fast(msg.get("Subject", ""))
-                    sender = msg.get("From", "")
-                    date_str = msg.get("Date", "")
-                    email_date = self.parse_email_date_fast(date_str)
-
-                    # ========== SPAM FILTERING ==========
-
-                    # 1. Block known spam/promotional senders
-                    if is_blocked_sender(sender):
-                        continue
-
-                    # 2. Check if subject is purely promotional
-                    if has_spam_subject(subject):
-                        # Allow if sender is trusted (e.g., Flipkart order + promo in subject)
-                        if not is_trusted_sender(sender):
-                            continue
-
-                    # 3. Get body for deeper analysis
-                    body = self.get_email_body_fast(msg, max_chars=3000)
-
-                    # 3.5 Check for spam body content (unsubscribe links, promo patterns)
-                    if has_spam_body(body):
-                        if not is_trusted_sender(sender):
-                            continue
-
-                    # 4. Check for transaction indicators
-                    subj_hits, body_hits = has_transaction_indicators(subject, body)
-
-                    # If NO transaction indicators at all, skip
-                    if subj_hits == 0 and body_hits == 0:
-                        # Allow trusted senders even without keywords
-                        if not is_trusted_sender(sender):
-                            continue
-
-                    # Passed all filters — include this email
-                    emails.append({
-                        'id': email_id.decode(),
-                        'message_id': msg.get('Message-ID', ''),
-                        'subject': subject,
-                        'sender': sender,
-                        'date': email_date,
-                        'body': body,
-                        'raw': raw_email.decode('utf-8', errors='ignore')[:5000]
-                    })
+                    header_data = self._parse_headers(email_id, raw_headers)
+                    if self._passes_header_filters(header_data):
+                        candidates[email_id] = (header_data, raw_headers, items.get('BODYSTRUCTURE'))
+                except Exception as e:
+                    print(f"Error processing email {email_id}: {e}")
+
+            if candidates and self.known_message_ids:
+                candidates = self._drop_known(candidates)
+
+            # Phase 2: text bodies, only for messages that survived
+            bodies = {}
+            if candidates:
+                bodies = self._fetch_bodies(candidates, uid=uid)
+                if bodies is None:
+                    self.fetch_error = 'Body FETCH failed'
+                    return
+
+            for email_id in chunk:
+                if passed >= limit:
+                    break
+
+                if email_id in candidates and email_id not in bodies:
+                    # The server left its body out of the response — stop short so it is retried
+                    self.fetch_error = f"No body returned for message {candidates[email_id][0]['id']}"
+                    return
 
+                self.last_examined = email_id
+                if email_id not in candidates or bodies[email_id] is None:
+                    continue
+
+                try:
+                    header_data, raw_headers, _ = candidates[email_id]
+                    body, raw_body = bodies.pop(email_id)
+                    raw_email = raw_headers + raw_body if include_raw else None
+                    email_data = self._filter_body(header_data, body, raw_email)
                 except Exception as e:
                     print(f"Error processing email {email_id}: {e}")
                     continue
 
-            return emails
+                if email_data:
+                    passed += 1
+                    yield email_data
+
+    def _drop_known(self, candidates):
+        """Remove candidates whose Message-ID was already ingested (e.g. via another mailbox)"""
+        message_ids = [header_data['message_id'] for header_data, _, _ in candidates.values()
+                       if header_data['message_id']]
+        if not message_ids:
+            return candidates
 
+        try:
+            known = self.known_message_ids(message_ids)
         except Exception as e:
-            print(f"Error fetching emails: {e}")
-            self.connected = False
-            return []
+            print(f"Message-ID lookup failed, fetching all: {e}")
+            return candidates
+
+        if not known:
+            return candidates
+        return {email_id: candidate for email_id, candidate in candidates.items()
+                if candidate[0]['message_id'] not in known}
+
+    def _fetch_bodies(self, candidates, uid=False):
+        """Fetch only the best text section of each message as a byte-range partial
+
+        Attachments never cross the wire. Messages are grouped by section so
+        each distinct section costs one FETCH; messages whose BODYSTRUCTURE
+        could not be parsed fall back to a full download.
+        Returns {email_id: (body_text, raw_bytes)} or None if a FETCH failed;
+        a message that was fetched but can't be decoded maps to None.
+        """
+        bodies = {}
+        partials = {}
+        full = []
+
+        for email_id, (_, _, structure) in candidates.items():
+            if not isinstance(structure, list):
+                full.append(email_id)
+                continue
+
+            part = find_text_part(structure)
+            if part is None:
+                # No inline text part (e.g. PDF-only invoice) — nothing to fetch
+                bodies[email_id] = ('', b'')
+                continue
+
+            size = PARTIAL_FETCH_BYTES_HTML if part['subtype'] == 'html' else PARTIAL_FETCH_BYTES
+            partials.setdefault((part['section'], size), []).append((email_id, part))
+
+        for (section, size), entries in partials.items():
+            fetched = self._fetch_chunk(
+                [email_id for email_id, _ in entries],
+                f"(BODY.PEEK[{section}]<0.{size}>)",
+                uid=uid
+            )
+            if fetched is None:
+                return None
+
+            for email_id, part in entries:
+                data = find_body_item(fetched.get(email_id, {}), section)
+                if data is None:
+                    continue
+                try:
+                    bodies[email_id] = (decode_text_part(data, part, max_chars=3000), data)
+                except Exception as e:
+                    print(f"Error decoding email {email_id}: {e}")
+                    bodies[email_id] = None
+
+        if full:
+            fetched = self._fetch_chunk(full, "(BODY.PEEK[])", uid=uid)
+            if fetched is None:
+                return None
+
+            for email_id in full:
+                data = find_body_item(fetched.get(email_id, {}), '')
+                if data is not None:
+                    msg = email.message_from_bytes(data)
+                    bodies[email_id] = (self.get_email_body_fast(msg, max_chars=3000), data)
+
+        return bodies
+
+    def _fetch_chunk(self, email_ids, message_parts, uid=False):
+        """Fetch several messages with a single FETCH over a sequence set
+
+        Returns {email_id: {ITEM: value}} keyed like the search results, or
+        None if the server rejected the command.
+        """
+        if uid:
+            status, msg_data = self.mail.uid('FETCH', build_sequence_set(email_ids), message_parts)
+        else:
+            status, msg_data = self.mail.fetch(build_sequence_set(email_ids), message_parts)
+
+        if status != "OK":
+            return None
+
+        messages = {}
+        for items in parse_fetch_response(msg_data):
+            # Unsolicited FLAGS updates carry no UID and are skipped in UID mode
+            key = items.get('UID') if uid else items.get('SEQ')
+            if key:
+                messages.setdefault(key.encode(), {}).update(items)
+
+        return messages
+
+    def _filter_message(self, email_id, raw_email, include_raw=False):
+        """Run spam filters on a full raw message, return email dict or None"""
+        header_data = self._parse_headers(email_id, raw_email)
+
+        if not self._passes_header_filters(header_data):
+            return None
+
+        body = self.get_email_body_fast(email.message_from_bytes(raw_email), max_chars=3000)
+        return self._filter_body(header_data, body, raw_email if include_raw else None)
+
+    def _parse_headers(self, email_id, raw_headers):
+        """Parse From/Subject/Date/Message-ID out of raw header bytes"""
+        msg = email.message_from_bytes(raw_headers)
+        subject = self._decode_header_fast(msg.get("Subject", ""))
+        sender = msg.get("From", "")
+
+        return {
+            'id': email_id.decode() if isinstance(email_id, bytes) else str(email_id),
+            'message_id': msg.get('Message-ID', '').strip(),
+            'subject': subject,
+            'sender': sender,
+            'date': self.parse_email_date_fast(msg.get("Date", "")),
+            'features': EmailFeatures(subject, sender),
+        }
+
+    def _passes_header_filters(self, header_data):
+        """Sender/subject spam checks — only need headers, run before body download"""
+        features = header_data['features']
+
+        # 1. Block known spam/promotional senders
+        if features.is_blocked:
+            return False
+
+        # 2. Check if subject is purely promotional
+        if has_spam_subject(header_data['subject'], features):
+            # Allow if sender is trusted (e.g., Flipkart order + promo in subject)
+            if not features.is_trusted:
+                return False
+
+        return True
+
+    def _filter_body(self, header_data, body, raw_email=None):
+        """Body spam checks on the extracted text, return email dict or None
+
+        'raw' (first 5000 chars of the message) is only set when raw_email is given.
+        """
+        subject = header_data['subject']
+        features = header_data['features']
+        features.body = body
+
+        # 3.5 Check for spam body content (unsubscribe links, promo patterns)
+        if has_spam_body(body, features):
+            if not features.is_trusted:
+                return None
+
+        # 4. Check for transaction indicators
+        subj_hits, body_hits = has_transaction_indicators(subject, body, features)
+
+        # If NO transaction indicators at all, skip
+        if subj_hits == 0 and body_hits == 0:
+            # Allow trusted senders even without keywords
+            if not features.is_trusted:
+                return None
+
+        # Passed all filters — include this email
+        email_data = dict(header_data, body=body)
+        if raw_email is not None:
+            email_data['raw'] = raw_email.decode('utf-8', errors='ignore')[:5000]
+        return email_data
 
     def get_unread_emails(self, days=3):
         """Get unread emails (full version)"""
@@ -386,31 +1845,34 @@ class EmailProcessor:
             return str(header)
 
     def get_email_body_fast(self, msg, max_chars=3000):
-        """Extract email body text (fast version)"""
-        body = ""
-
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition"))
-
-                if content_type == "text/plain" and "attachment" not in content_disposition:
-                    try:
-                        body = part.get_payload(decode=True).decode('utf-8', errors='ignore')[:max_chars]
-                        break
-                    except:
-                        try:
-                            body = str(part.get_payload(decode=True))[:max_chars]
-                            break
-                        except:
-                            pass
-        else:
-            try:
-                body = msg.get_payload(decode=True).decode('utf-8', errors='ignore')[:max_chars]
-            except:
-                body = str(msg.get_payload(decode=True))[:max_chars]
+        """Extract email body text (fast version) — text/plain, else text/html converted"""
+        html_part = None
+
+        for part in (msg.walk() if msg.is_multipart() else [msg]):
+            if part.is_multipart() or "attachment" in str(part.get("Content-Disposition")):
+                continue
 
-        return body
+            content_type = part.get_content_type()
+            if content_type == "text/html":
+                # HTML-only receipts (Swiggy, Zomato, bank alerts) — used if no plain part
+                html_part = html_part or part
+            elif content_type == "text/plain" or not msg.is_multipart():
+                return self._decode_part(part)[:max_chars]
+
+        if html_part is not None:
+            return html_to_text(self._decode_part(html_part), max_chars)
+        return ""
+
+    def _decode_part(self, part):
+        """Decoded text of a single MIME part in its declared charset"""
+        try:
+            payload = part.get_payload(decode=True) or b''
+        except:
+            return ""
+        try:
+            return payload.decode(part.get_content_charset() or 'utf-8', errors='ignore')
+        except LookupError:
+            return payload.decode('utf-8', errors='ignore')
 
     def parse_email_date_fast(self, date_str):
         """Parse email date string quickly — supports Indian DD/MM/YYYY formats"""
@@ -450,30 +1912,34 @@ class EmailProcessor:
         body = email_data['body']
         sender = email_data.get('sender', '')
 
-        text = f"{subject}\n{body}"
+        # Filled in by the spam filters; emails from the cache or an mbox start fresh
+        features = email_data.get('features')
+        if features is None or features.body is not body:
+            features = EmailFeatures(subject, sender, body)
+        text = features.text
 
         # Extract amount in ₹
-        amount = self._extract_amount_fast(text)
+        amount = self._extract_amount_fast(text, features)
         if not amount:
             return None
 
         # Extract merchant (Indian merchants first)
-        merchant = self._extract_merchant_fast(text, sender)
+        merchant = self._extract_merchant_fast(text, sender, features)
 
         # Determine category (Indian context)
-        category = self._determine_category_fast(text)
+        category = self._determine_category_fast(text, features)
 
         # Detect payment method
-        payment_method = self._detect_payment_method(text)
+        payment_method = self._detect_payment_method(text, features)
 
         # Extract GST if present
-        gst_amount = self._extract_gst(text)
+        gst_amount = self._extract_gst(text, features)
 
         # Extract transaction ID
-        transaction_id = self._extract_transaction_id(text)
+        transaction_id = self._extract_transaction_id(text, features)
 
         # Calculate confidence score
-        confidence = calculate_confidence(sender, subject, body, amount, merchant)
+        confidence = calculate_confidence(sender, subject, body, amount, merchant, features)
 
         # Skip low confidence extractions (likely spam that passed filters)
         if confidence < 35:
@@ -502,331 +1968,364 @@ class EmailProcessor:
         """Extract expense information from email"""
         return self.extract_expense_data_fast(email_data)
 
-    def _extract_amount_fast(self, text):
+    def extract_expense_data_batch(self, emails, workers=None, chunk_size=BATCH_EXTRACT_CHUNK_SIZE, pool=None):
+        """extract_expense_data_fast over many parsed emails, spread over worker processes
+
+        Returns one expense dict or None per email, in input order. pool is
+        an ExtractionPool to reuse across calls; without one a pool is
+        started for this call and shut down after it. Workers get only the
+        fields extraction reads, in chunks of chunk_size. Batches under
+        BATCH_EXTRACT_MIN_SIZE, or workers=1, run in this process, as does
+        everything if the pool fails.
+        """
+        emails = list(emails)
+        workers = (pool.workers if pool else workers) or os.cpu_count() or 1
+        if min(workers, -(-len(emails) // max(1, chunk_size))) <= 1 or len(emails) < BATCH_EXTRACT_MIN_SIZE:
+            return _extract_chunk(emails, self)
+
+        # Only what extraction reads is pickled — not 'raw' or the EmailFeatures record
+        slim = [{field: email_data.get(field) for field in BATCH_EXTRACT_FIELDS} for email_data in emails]
+        chunks = [slim[i:i + chunk_size] for i in range(0, len(slim), chunk_size)]
+        own_pool = pool is None
+        if own_pool:
+            pool = ExtractionPool(workers)
+        try:
+            return [expense for results in pool.map(_extract_chunk, chunks) for expense in results]
+        except (OSError, BrokenProcessPool) as e:
+            print(f"   ⚠️ Extraction pool failed, extracting in-process: {e}")
+            pool.shutdown()
+            return _extract_chunk(emails, self)
+        finally:
+            if own_pool:
+                pool.shutdown()
+
+    def _extract_amount_fast(self, text, features=None):
         """Extract amount — prioritizes ₹/Rs/INR patterns, then falls back to generic"""
-        # Indian currency patterns (highest priority)
-        indian_patterns = [
-            r'₹\s*([\d,]+\.?\d*)',                    # ₹1,234.56 or ₹ 1,234
-            r'Rs\.?\s*([\d,]+\.?\d*)',                 # Rs.1234 or Rs 1,234.56
-            r'INR\s*([\d,]+\.?\d*)',                   # INR 1234.56
-            r'Rupees?\s*([\d,]+\.?\d*)',                # Rupee 1234
-            r'(?:amount|total|paid|charged|debited|credited)\s*(?::|is|of|for)?\s*(?:₹|Rs\.?|INR)?\s*([\d,]+\.?\d*)',
-        ]
-
-        text_content = text
-
-        for pattern in indian_patterns:
-            try:
-                matches = re.findall(pattern, text_content, re.IGNORECASE)
-                if matches:
-                    amounts = []
-                    for m in matches:
-                        cleaned = m.replace(',', '')
-                        try:
-                            val = float(cleaned)
-                            if 1 <= val <= 10000000:  # ₹1 to ₹1Cr reasonable range
-                                amounts.append(val)
-                        except:
-                            continue
-                    if amounts:
-                        return max(amounts)
-            except:
-                continue
+        scanner = features.scanner if features else ValueScanner(text)
 
-        # Generic USD fallback patterns
-        fallback_patterns = [
-            r'\$([\d,]+\.?\d*)',
-            r'USD\s*([\d,]+\.?\d*)',
-            r'\b(\d+\.\d{2})\b',
-        ]
-
-        text_lower = text.lower()
-        for pattern in fallback_patterns:
-            try:
-                matches = re.findall(pattern, text_lower)
-                if matches:
+        # Indian currency patterns (highest priority)
+        for kind in AMOUNT_KINDS:
+            amounts = []
+            for m in scanner.values(kind):
+                try:
+                    val = float(m.replace(',', ''))
+                except ValueError:
+                    continue
+                if 1 <= val <= 10000000:  # ₹1 to ₹1Cr reasonable range
+                    amounts.append(val)
+            if amounts:
+                return max(amounts)
+
+        # Generic fallback: $ amounts, then bare decimals like 12.50
+        for kind in FALLBACK_AMOUNT_KINDS:
+            matches = scanner.values(kind)
+            if matches:
+                try:
                     amounts = [float(m.replace(',', '')) for m in matches if float(m.replace(',', '')) >= 1]
-                    return max(amounts) if amounts else None
-            except:
-                continue
+                except ValueError:
+                    continue
+                return max(amounts) if amounts else None
 
         return None
 
-    def _extract_merchant_fast(self, text, sender=""):
+    def _extract_merchant_fast(self, text, sender="", features=None):
         """Extract merchant name — Indian merchants prioritized"""
-        # Indian merchant mapping
-        merchant_map = {
-            # E-commerce
-            'flipkart': 'Flipkart',
-            'myntra': 'Myntra',
-            'ajio': 'AJIO',
-            'meesho': 'Meesho',
-            'snapdeal': 'Snapdeal',
-            'nykaa': 'Nykaa',
-            'tatacliq': 'Tata CLiQ',
-            'jiomart': 'JioMart',
-            'amazon': 'Amazon India',
-
-            # Food delivery
-            'zomato': 'Zomato',
-            'swiggy': 'Swiggy',
-            'eatsure': 'EatSure',
-            'dominos': "Domino's",
-            'dunzo': 'Dunzo',
-
-            # Travel
-            'irctc': 'IRCTC',
-            'makemytrip': 'MakeMyTrip',
-            'goibibo': 'Goibibo',
-            'cleartrip': 'Cleartrip',
-            'yatra': 'Yatra',
-            'ola': 'Ola',
-            'uber': 'Uber India',
-            'rapido': 'Rapido',
-            'redbus': 'RedBus',
-            'ixigo': 'ixigo',
-
-            # Groceries
-            'bigbasket': 'BigBasket',
-            'blinkit': 'Blinkit',
-            'grofers': 'Grofers',
-            'zepto': 'Zepto',
-            'dmart': 'DMart',
-            'instamart': 'Swiggy Instamart',
-
-            # Entertainment
-            'netflix': 'Netflix',
-            'hotstar': 'Disney+ Hotstar',
-            'primevideo': 'Amazon Prime Video',
-            'prime video': 'Amazon Prime Video',
-            'bookmyshow': 'BookMyShow',
-            'spotify': 'Spotify',
-            'jiocinema': 'JioCinema',
-            'sonyliv': 'SonyLIV',
-            'zee5': 'ZEE5',
-
-            # Payments / UPI
-            'paytm': 'Paytm',
-            'phonepe': 'PhonePe',
-            'googlepay': 'Google Pay',
-            'google pay': 'Google Pay',
-            'razorpay': 'Razorpay',
-            'payu': 'PayU',
-            'ccavenue': 'CCAvenue',
-            'bharatpe': 'BharatPe',
-
-            # Banking
-            'hdfc': 'HDFC Bank',
-            'icici': 'ICICI Bank',
-            'sbi': 'SBI',
-            'axis': 'Axis Bank',
-            'kotak': 'Kotak Mahindra',
-            'idfc': 'IDFC First',
-
-            # Utilities / Telecom
-            'jio': 'Jio',
-            'airtel': 'Airtel',
-            'vodafone': 'Vodafone Idea',
-            'bsnl': 'BSNL',
-            'tatapower': 'Tata Power',
-            'adani': 'Adani',
-
-            # Healthcare
-            'practo': 'Practo',
-            '1mg': '1mg',
-            'pharmeasy': 'PharmEasy',
-            'netmeds': 'Netmeds',
-            'apollo': 'Apollo',
-
-            # Education
-            'unacademy': 'Unacademy',
-            'byju': "BYJU'S",
-            'udemy': 'Udemy',
-            'coursera': 'Coursera',
-            'upgrad': 'upGrad',
-
-            # International (kept for compatibility)
-            'walmart': 'Walmart',
-            'starbucks': 'Starbucks',
-            'mcdonalds': "McDonald's",
-        }
+        features = features or EmailFeatures(text, sender)
 
-        text_lower = text.lower()
-        sender_lower = sender.lower()
-
-        # Check text first
-        for keyword, merchant in merchant_map.items():
-            if keyword in text_lower or keyword in sender_lower:
-                return merchant
-
-        # Try to extract from subject/body
-        lines = text.split('\n')
-        for line in lines[:5]:
-            line_lower = line.lower()
-            for keyword, merchant in merchant_map.items():
-                if keyword in line_lower:
-                    return merchant
+        rules = features.rules
+        ranks = [rules.merchant_rank[keyword] for keyword in features.merchant_hits if keyword in rules.merchant_rank]
+        if ranks:
+            return rules.merchant_names[min(ranks)]
 
         return 'Unknown Merchant'
 
-    def _determine_category_fast(self, text):
+    def _determine_category_fast(self, text, features=None):
         """Fast category determination — Indian expense categories"""
-        text_lower = text.lower()
-
-        categories = {
-            'Food Delivery': [
-                'zomato', 'swiggy', 'eatsure', 'dunzo', 'food order',
-                'food delivery', 'dominos', 'pizza hut', 'kfc', 'burger king',
-                'restaurant', 'cafe', 'dining', 'biryani', 'thali'
-            ],
-            'Groceries': [
-                'bigbasket', 'blinkit', 'grofers', 'zepto', 'dmart',
-                'instamart', 'grocery', 'supermarket', 'vegetables',
-                'fruits', 'milk', 'ration', 'kirana'
-            ],
-            'Online Shopping': [
-                'flipkart', 'amazon', 'myntra', 'ajio', 'meesho',
-                'snapdeal', 'nykaa', 'tatacliq', 'jiomart', 'shopping',
-                'order confirmed', 'shipment', 'delivered', 'purchase'
-            ],
-            'Travel & Transport': [
-                'irctc', 'makemytrip', 'goibibo', 'cleartrip', 'yatra',
-                'ola', 'uber', 'rapido', 'redbus', 'ixigo', 'flight',
-                'train', 'bus', 'cab', 'taxi', 'booking', 'ticket',
-                'airline', 'indigo', 'spicejet', 'air india', 'vistara'
-            ],
-            'Entertainment': [
-                'netflix', 'hotstar', 'prime video', 'bookmyshow',
-                'spotify', 'jiocinema', 'sonyliv', 'zee5', 'movie',
-                'cinema', 'concert', 'game', 'streaming', 'subscription'
-            ],
-            'Utilities & Bills': [
-                'electricity', 'water', 'gas', 'internet', 'phone',
-                'bill', 'recharge', 'jio', 'airtel', 'vodafone', 'bsnl',
-                'broadband', 'dth', 'tata power', 'adani', 'piped gas',
-                'mobile recharge', 'postpaid', 'prepaid'
-            ],
-            'Healthcare': [
-                'hospital', 'pharmacy', 'medicine', 'doctor', 'dental',
-                'medical', 'health', 'clinic', 'practo', '1mg',
-                'pharmeasy', 'netmeds', 'apollo', 'diagnostic', 'lab test'
-            ],
-            'Education': [
-                'unacademy', 'byju', 'udemy', 'coursera', 'upgrad',
-                'course', 'tuition', 'school', 'college', 'books',
-                'scholarship', 'coaching', 'exam', 'fee'
-            ],
-            'EMI & Loans': [
-                'emi', 'loan', 'installment', 'equated monthly',
-                'home loan', 'car loan', 'personal loan', 'credit card bill'
-            ],
-            'Investments': [
-                'mutual fund', 'sip', 'stocks', 'shares', 'demat',
-                'zerodha', 'groww', 'upstox', 'investment', 'nps',
-                'ppf', 'fixed deposit', 'fd', 'rd'
-            ],
-        }
+        features = features or EmailFeatures(text)
 
-        for category, keywords in categories.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    return category
+        rules = features.rules
+        ranks = [rules.category_rank[keyword] for keyword in features.hits if keyword in rules.category_rank]
+        if ranks:
+            return rules.category_names[min(ranks)]
 
         return 'Other'
 
-    def _detect_payment_method(self, text):
+    def _detect_payment_method(self, text, features=None):
         """Detect payment method from email text"""
-        text_lower = text.lower()
-
-        # UPI detection
-        upi_keywords = ['upi', 'google pay', 'phonepe', 'paytm', 'bhim',
-                        'bharatpe', 'upi id', 'upi ref', '@ybl', '@paytm',
-                        '@oksbi', '@okaxis', '@okhdfcbank']
-        for kw in upi_keywords:
-            if kw in text_lower:
-                # Try to identify specific UPI app
-                if 'google pay' in text_lower or 'gpay' in text_lower:
-                    return 'UPI - Google Pay'
-                elif 'phonepe' in text_lower:
-                    return 'UPI - PhonePe'
-                elif 'paytm' in text_lower:
-                    return 'UPI - Paytm'
-                elif 'bhim' in text_lower:
-                    return 'UPI - BHIM'
-                return 'UPI'
-
-        # Credit Card
-        if any(kw in text_lower for kw in ['credit card', 'visa', 'mastercard', 'rupay', 'amex']):
-            if 'rupay' in text_lower:
-                return 'Credit Card - RuPay'
-            elif 'visa' in text_lower:
-                return 'Credit Card - Visa'
-            elif 'mastercard' in text_lower:
-                return 'Credit Card - Mastercard'
-            return 'Credit Card'
-
-        # Debit Card
-        if any(kw in text_lower for kw in ['debit card', 'atm card']):
-            return 'Debit Card'
-
-        # Net Banking
-        if any(kw in text_lower for kw in ['net banking', 'netbanking', 'neft', 'rtgs', 'imps']):
-            return 'Net Banking'
-
-        # Wallet
-        if any(kw in text_lower for kw in ['wallet', 'paytm wallet', 'freecharge', 'mobikwik']):
-            return 'Wallet'
-
-        # EMI
-        if any(kw in text_lower for kw in ['emi', 'equated monthly', 'installment']):
-            return 'EMI'
-
-        # Cash on Delivery
-        if any(kw in text_lower for kw in ['cash on delivery', 'cod', 'pay on delivery']):
-            return 'Cash on Delivery'
-
-        return 'Unknown'
-
-    def _extract_gst(self, text):
+        features = features or EmailFeatures(text)
+        hits, rules = features.hits, features.rules
+
+        ranks = [rules.payment_rank[keyword] for keyword in hits if keyword in rules.payment_rank]
+        if not ranks:
+            return 'Unknown'
+
+        method, _, labels = rules.payment_methods[min(ranks)]
+        # Try to identify the specific UPI app / card network
+        for keyword, label in labels:
+            if keyword in hits:
+                return label
+        return method
+
+    def _extract_gst(self, text, features=None):
         """Extract GST amount from email text"""
-        patterns = [
-            r'(?:GST|CGST|SGST|IGST)\s*(?::|@|amount)?\s*(?:₹|Rs\.?|INR)?\s*([\d,]+\.?\d*)',
-            r'(?:tax|gst)\s*(?:amount)?\s*(?::|=)?\s*(?:₹|Rs\.?|INR)?\s*([\d,]+\.?\d*)',
-        ]
+        scanner = features.scanner if features else ValueScanner(text)
 
-        for pattern in patterns:
-            try:
-                matches = re.findall(pattern, text, re.IGNORECASE)
-                if matches:
+        for kind in GST_KINDS:
+            matches = scanner.values(kind)
+            if matches:
+                try:
                     amounts = [float(m.replace(',', '')) for m in matches if float(m.replace(',', '')) > 0]
-                    if amounts:
-                        return sum(amounts)  # Sum CGST + SGST if both present
-            except:
-                continue
+                except ValueError:
+                    continue
+                if amounts:
+                    return sum(amounts)  # Sum CGST + SGST if both present
 
         return 0
 
-    def _extract_transaction_id(self, text):
+    def _extract_transaction_id(self, text, features=None):
         """Extract transaction/order ID"""
-        patterns = [
-            r'(?:order\s*(?:id|#|no\.?|number)?)\s*[:\-]?\s*([A-Z0-9\-]{6,25})',
-            r'(?:transaction\s*(?:id|#|no\.?)?\s*[:\-]?\s*([A-Z0-9\-]{6,25}))',
-            r'(?:upi\s*ref\s*(?:no\.?|#)?)\s*[:\-]?\s*(\d{10,16})',
-            r'(?:ref\s*(?:no\.?|#|id)?)\s*[:\-]?\s*([A-Z0-9\-]{6,25})',
-            r'(?:booking\s*id)\s*[:\-]?\s*([A-Z0-9\-]{6,25})',
-        ]
+        scanner = features.scanner if features else ValueScanner(text)
 
-        for pattern in patterns:
-            try:
-                match = re.search(pattern, text, re.IGNORECASE)
-                if match:
-                    return match.group(1)
-            except:
-                continue
+        for kind in REFERENCE_KINDS:
+            transaction_id = scanner.first(kind)
+            if transaction_id:
+                return transaction_id
 
         return ''
 
 
+# ============ BATCH EXTRACTION ============
+
+# What extract_expense_data_fast reads from an email dict
+BATCH_EXTRACT_FIELDS = ('id', 'message_id', 'subject', 'sender', 'body', 'date')
+
+_extract_worker = None
+
+
+def _init_extract_worker(rules):
+    """Install the parent's rule pack and build one offline EmailProcessor per worker process"""
+    global _extract_worker
+    install_rules(rules)
+    _extract_worker = EmailProcessor(None, None, None, None)
+
+
+class ExtractionPool:
+    """Worker processes for extract_expense_data_batch, started on first use and reused
+
+    Workers are spawned rather than forked: a sync service forks with its
+    sync, pipeline, IDLE and lease threads running, and a child can inherit
+    a lock none of them will ever release. They're restarted with the new
+    rules whenever the active rule pack changes. Spawn re-imports the main
+    script in each worker as __mp_main__, so scripts that create a pool
+    (app.py, sync_worker.py) keep their setup out of that import.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.lock = threading.Lock()
+        self._executor = None
+        self._rules_version = None
+
+    def map(self, fn, chunks):
+        """Results of fn over chunks, in order"""
+        rules = active_rules()
+        with self.lock:
+            if self._executor is not None and self._rules_version != rules.version:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_extract_worker, initargs=(rules,)
+                )
+                self._rules_version = rules.version
+            executor = self._executor
+        return list(executor.map(fn, chunks))
+
+    def shutdown(self):
+        with self.lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_chunk(emails, processor=None):
+    """extract_expense_data_fast per email; a failing email yields None"""
+    processor = processor or _extract_worker or EmailProcessor(None, None, None, None)
+    results = []
+    for email_data in emails:
+        try:
+            results.append(processor.extract_expense_data_fast(email_data))
+        except Exception as e:
+            label = email_data.get('message_id') or email_data.get('id', '?')
+            print(f"   ⚠️ Error extracting email {label}: {e}")
+            results.append(None)
+    return results
+
+
+# ============ CONNECTION POOL ============
+
+class IMAPConnectionPool:
+    """Bounded cache of logged-in EmailProcessor connections
+
+    Keyed by email config id. Connections are checked out by one caller at a
+    time, probed with NOOP before reuse, closed after idle_timeout seconds
+    unused, and the least recently used idle one is evicted past max_size.
+    A connection that is checked out is never closed by anyone but its holder.
+    """
+
+    def __init__(self, max_size=20, idle_timeout=600):
+        self.max_size = max(1, int(max_size))
+        self.idle_timeout = idle_timeout
+        self.connections = OrderedDict()  # key -> {'processor', 'last_used', 'in_use'}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def checkout(self, key, factory):
+        """Return a live connection for key, reusing a pooled one when healthy
+
+        factory() builds a new, unconnected EmailProcessor. If a fresh
+        connection can't be established the unconnected processor is returned
+        (connected is False, last_error/auth_failed explain why) and nothing is
+        pooled. If key is already checked out elsewhere, the caller gets its
+        own connection that is closed on release instead of pooled. Call
+        release(key, processor) when done.
+        """
+        with self.lock:
+            entry = self.connections.get(key)
+            shared = entry is not None and entry['in_use']
+            if entry and not shared:
+                entry['in_use'] = True
+                self.connections.move_to_end(key)
+            else:
+                entry = None
+
+        if entry:
+            fresh = time.monotonic() - entry['last_used'] < self.idle_timeout
+            if fresh and entry['processor'].is_connected():
+                with self.lock:
+                    self.hits += 1
+                return entry['processor']
+            # Ours to close: nobody else can check it out while in_use
+            with self.lock:
+                if self.connections.get(key) is entry:
+                    del self.connections[key]
+            entry['processor'].disconnect()
+
+        processor = factory()
+        connected = processor.connect()
+        with self.lock:
+            self.misses += 1
+            if not connected or shared:
+                return processor
+            stale = self.connections.get(key)
+            if stale and stale['in_use']:
+                # Another caller pooled one meanwhile; leave theirs alone
+                return processor
+            self.connections.pop(key, None)
+            self.connections[key] = {
+                'processor': processor, 'last_used': time.monotonic(), 'in_use': True
+            }
+            evicted = self._evict_lru()
+        if stale:
+            evicted.append(stale['processor'])
+        for old in evicted:
+            old.disconnect()
+
+        return processor
+
+    def release(self, key, processor):
+        """Return a checked-out connection to the pool, or close it if it isn't pooled"""
+        if processor is None:
+            return
+        with self.lock:
+            entry = self.connections.get(key)
+            pooled = entry is not None and entry['processor'] is processor
+            if pooled:
+                entry['in_use'] = False
+                entry['last_used'] = time.monotonic()
+            # Checked-out connections can't be evicted, so catch up on overflow here
+            evicted = self._evict_lru()
+        if not pooled:
+            evicted.append(processor)
+        for old in evicted:
+            old.disconnect()
+
+    def invalidate(self, key, processor=None):
+        """Forget the connection for one config, closing it unless it is checked out
+
+        A checked-out connection is closed by its holder's release(). With
+        processor given, only that connection is dropped.
+        """
+        with self.lock:
+            entry = self.connections.get(key)
+            if not entry or (processor is not None and entry['processor'] is not processor):
+                return
+            del self.connections[key]
+        if not entry['in_use']:
+            entry['processor'].disconnect()
+
+    def prune(self):
+        """Close connections that have sat unused past idle_timeout"""
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                key for key, entry in self.connections.items()
+                if not entry['in_use'] and now - entry['last_used'] >= self.idle_timeout
+            ]
+            stale = [self.connections.pop(key) for key in expired]
+            self.evictions += len(stale)
+        for entry in stale:
+            entry['processor'].disconnect()
+        return len(stale)
+
+    def retain(self, keys):
+        """Close idle connections for any config not in keys"""
+        with self.lock:
+            dropped = [
+                self.connections.pop(key) for key in list(self.connections)
+                if key not in keys and not self.connections[key]['in_use']
+            ]
+        for entry in dropped:
+            entry['processor'].disconnect()
+        return len(dropped)
+
+    def close_all(self):
+        """Disconnect everything — used on shutdown"""
+        with self.lock:
+            entries = list(self.connections.values())
+            self.connections.clear()
+        for entry in entries:
+            entry['processor'].disconnect()
+
+    def stats(self):
+        """Occupancy and hit rate for the health endpoint"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.connections),
+                'max_size': self.max_size,
+                'in_use': sum(1 for entry in self.connections.values() if entry['in_use']),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions
+            }
+
+    def _evict_lru(self):
+        """Drop least recently used idle entries past max_size — caller holds lock"""
+        evicted = []
+        for key in list(self.connections):
+            if len(self.connections) <= self.max_size:
+                break
+            if not self.connections[key]['in_use']:
+                evicted.append(self.connections.pop(key)['processor'])
+        self.evictions += len(evicted)
+        return evicted
+
+
 def test_email_connection(imap_server, imap_port, username, password):
     """Test email connection and return sample data"""
     try:
@@ -0,0 +1,572 @@
+# fake_imap.py
+"""In-process IMAP stand-in for benchmarking the sync pipeline without real mailboxes
+
+Serves synthetic Indian bank / e-commerce receipts and promotional spam over a
+plain-TCP IMAP4rev1 subset (LOGIN, SELECT, SEARCH, FETCH, UID, NOOP, IDLE,
+LOGOUT) and can inject per-command latency and random connection drops.
+
+    server = FakeIMAPServer(latency=0.01).start()
+    server.add_account('me@example.com', 'pw', generate_messages(500))
+    server.patch_imaplib()   # EmailProcessor now talks to the fake
+"""
+import imaplib
+import random
+import re
+import select
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+from email import message_from_bytes
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+
+# ============ SYNTHETIC MAIL ============
+
+RECEIPT_TEMPLATES = [
+    ('HDFC Bank Alerts <alerts@hdfcbank.net>', 'Alert: Rs.{amount} debited from your a/c',
+     'Dear Customer, Rs.{amount} has been debited from account ending 4321 '
+     'via UPI to SWIGGY on {date}. UPI Ref No. {ref}. Available balance: Rs.52,310.00'),
+    ('ICICI Bank <alerts@icicibank.com>', 'Transaction alert for your ICICI Bank Credit Card',
+     'INR {amount} spent on ICICI Bank Credit Card XX1234 at AMAZON on {date}. '
+     'Transaction ID: {ref}. Visa card.'),
+    ('Amazon.in <auto-confirm@amazon.in>', 'Your Amazon.in order #{ref} has been placed',
+     'Hello, thank you for your order. Order ID: {ref}. Grand Total: ₹{amount}. '
+     'Paid via UPI. CGST: ₹12.50 SGST: ₹12.50'),
+    ('IRCTC <ticket@irctc.co.in>', 'Booking Confirmed - e-ticket PNR {ref}',
+     'Your e-ticket is booked. Booking ID: {ref}. Total fare paid: Rs. {amount} via net banking.'),
+    ('Jio <noreply@jio.com>', 'Recharge successful for your Jio number',
+     'Your recharge of Rs {amount} is successful. Transaction ID: {ref}. Paid with debit card.'),
+]
+
+HTML_RECEIPT_TEMPLATES = [
+    ('Swiggy <no-reply@swiggy.in>', 'Your Swiggy order was delivered',
+     '<html><head><style>td {{ color: #333; }} .x {{ font: 12px }}</style></head><body>'
+     '<table><tr><td>Order ID</td><td>{ref}</td></tr>'
+     '<tr><td>Item Total</td><td>&#8377;{amount}</td></tr>'
+     '<tr><td>Grand Total</td><td>&#8377; {amount}</td></tr></table>'
+     '<p>Paid via UPI &amp; Swiggy Money</p><script>track()</script></body></html>'),
+    ('Zomato <noreply@zomato.com>', 'Your Zomato order receipt',
+     '<div><h2>Thanks for ordering!</h2><table><tr><td>Total paid</td>'
+     '<td>Rs. {amount}</td></tr></table><p>Transaction ID: {ref}</p></div>'),
+]
+
+SPAM_TEMPLATES = [
+    ('Myntra <deals@offers.myntra.com>', 'Mega sale! Flat 70% off on top brands',
+     'Shop now. Use code BIG70. Click here to unsubscribe. View in browser.'),
+    ('Flipkart <newsletter@marketing.flipkart.com>', 'Big Billion Days are back',
+     'Grab now! Limited time offer. Download the app. Unsubscribe.'),
+    ('Swiggy <promo@notifications.swiggy.com>', 'Hungry? 60% off on your next order',
+     'Use code TRYNEW. T&C apply. You are receiving this because you subscribed.'),
+    ('Some Brand <hello@campaigns.somebrand.in>', 'Your weekly digest',
+     'Trending products curated for you. Manage your preferences. Unsubscribe.'),
+]
+
+
+def _build_message(index, sender, subject, body, date, html=False, attachment=False, account=None):
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['To'] = 'user@example.com'
+    msg['Subject'] = subject
+    msg['Date'] = format_datetime(date)
+    local = f'synthetic-{index}.' + re.sub(r'[^\w.-]', '-', account) if account else f'synthetic-{index}'
+    msg['Message-ID'] = f'<{local}@fake-imap.local>'
+    if html:
+        msg.set_content(body, subtype='html')
+    else:
+        msg.set_content(body)
+    if attachment:
+        msg.add_attachment(b'%PDF-1.4 ' + bytes(random.getrandbits(8) for _ in range(20000)),
+                           maintype='application', subtype='pdf', filename=f'invoice-{index}.pdf')
+    return msg.as_bytes()
+
+
+def generate_messages(count, spam_ratio=0.6, seed=None, start_index=0, days=30, account=None):
+    """Generate (raw_bytes, internal_date) pairs of synthetic receipts and spam
+
+    Message-IDs are synthetic-<index>@fake-imap.local; pass account (e.g. the
+    username) to make them unique per mailbox, otherwise mailboxes generated
+    with the same indexes look like copies of one message to the
+    cross-account dedupe.
+    """
+    rng = random.Random(seed)
+    now = datetime.now().astimezone()
+    messages = []
+    for i in range(start_index, start_index + count):
+        date = now - timedelta(minutes=rng.randint(0, days * 24 * 60))
+        if rng.random() < spam_ratio:
+            sender, subject, body = rng.choice(SPAM_TEMPLATES)
+            raw = _build_message(i, sender, subject, body, date, html=rng.random() < 0.5,
+                                 account=account)
+        else:
+            values = {
+                'amount': f"{rng.randint(50, 25000):,}.{rng.randint(0, 99):02d}",
+                'ref': f"{rng.randint(10**11, 10**12 - 1)}",
+                'date': date.strftime('%d-%m-%Y'),
+            }
+            if rng.random() < 0.35:
+                sender, subject, body = rng.choice(HTML_RECEIPT_TEMPLATES)
+                raw = _build_message(i, sender, subject.format(**values), body.format(**values), date,
+                                     html=True, account=account)
+            else:
+                sender, subject, body = rng.choice(RECEIPT_TEMPLATES)
+                raw = _build_message(i, sender, subject.format(**values), body.format(**values), date,
+                                     attachment=rng.random() < 0.3, account=account)
+        messages.append((raw, date))
+    return messages
+
+
+# ============ MAILBOX ============
+
+class FakeMailbox:
+    """An INBOX: ordered messages with UIDs, internal dates and \\Seen flags"""
+
+    def __init__(self, uid_validity=None):
+        self.uid_validity = uid_validity or random.randint(1, 2**31 - 1)
+        self.uid_next = 1
+        self.messages = []  # dicts: uid, raw, date, seen, msg
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    def append(self, raw, date=None, seen=False):
+        with self.changed:
+            self.messages.append({
+                'uid': self.uid_next,
+                'raw': raw,
+                'date': date or datetime.now().astimezone(),
+                'seen': seen,
+                'msg': message_from_bytes(raw),
+            })
+            self.uid_next += 1
+            self.changed.notify_all()
+
+    def reset_uid_validity(self):
+        """Simulate a server-side mailbox rebuild: new UIDVALIDITY, renumbered UIDs"""
+        with self.lock:
+            self.uid_validity += 1
+            for i, message in enumerate(self.messages, 1):
+                message['uid'] = i
+            self.uid_next = len(self.messages) + 1
+
+
+# ============ RESPONSE RENDERING ============
+
+def _quote(value):
+    if value is None:
+        return 'NIL'
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _part_payload(part):
+    payload = part.get_payload()
+    if isinstance(payload, str):
+        return payload.encode('ascii', errors='surrogateescape')
+    return b''
+
+
+def bodystructure(part):
+    """Render an IMAP BODYSTRUCTURE for an email.message.Message"""
+    if part.is_multipart():
+        children = ''.join(bodystructure(p) for p in part.get_payload())
+        return f'({children} {_quote(part.get_content_subtype().upper())})'
+
+    maintype = part.get_content_maintype().upper()
+    subtype = part.get_content_subtype().upper()
+    params = part.get_params() or []
+    param_list = ' '.join(f'{_quote(k.upper())} {_quote(v)}' for k, v in params[1:])
+    encoding = (part.get('Content-Transfer-Encoding') or '7BIT').upper()
+    payload = _part_payload(part)
+
+    fields = [_quote(maintype), _quote(subtype), f'({param_list})' if param_list else 'NIL',
+              'NIL', 'NIL', _quote(encoding), str(len(payload))]
+    if maintype == 'TEXT':
+        fields.append(str(payload.count(b'\n')))
+    fields.append('NIL')  # md5
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        dsp_params = f'({_quote("FILENAME")} {_quote(filename)})' if filename else 'NIL'
+        fields.append(f'({_quote(disposition.upper())} {dsp_params})')
+    else:
+        fields.append('NIL')
+    return '(' + ' '.join(fields) + ')'
+
+
+def _section(msg, section):
+    """Return the raw bytes of a BODY[section]"""
+    if section == '':
+        return None
+    if section.startswith('HEADER.FIELDS'):
+        names = re.findall(r'[\w-]+', section[len('HEADER.FIELDS'):])
+        lines = ''.join(f'{name}: {msg[name]}\r\n' for name in names if msg[name] is not None)
+        return lines.encode('utf-8', errors='surrogateescape') + b'\r\n'
+    if section in ('HEADER', 'TEXT'):
+        return None
+    part = msg
+    for index in section.split('.'):
+        index = int(index)
+        if part.is_multipart():
+            part = part.get_payload()[index - 1]
+        elif index != 1:
+            return b''
+    return _part_payload(part)
+
+
+FETCH_ITEM_RE = re.compile(
+    r'(BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?|BODYSTRUCTURE|UID|FLAGS|INTERNALDATE|RFC822\.SIZE)',
+    re.IGNORECASE
+)
+
+
+def _parse_sequence_set(spec, largest):
+    ids = set()
+    for piece in spec.split(','):
+        if ':' in piece:
+            lo, hi = piece.split(':')
+            lo = largest if lo == '*' else int(lo)
+            hi = largest if hi == '*' else int(hi)
+            lo, hi = min(lo, hi), max(lo, hi)
+            ids.update(range(lo, hi + 1))
+        else:
+            ids.add(largest if piece == '*' else int(piece))
+    return ids
+
+
+# ============ SEARCH ============
+
+def _tokenize_search(criteria):
+    return re.findall(r'"(?:[^"\\]|\\.)*"|\(|\)|[^\s()]+', criteria)
+
+
+def _unquote(token):
+    if token.startswith('"') and token.endswith('"'):
+        return token[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    return token
+
+
+def _compile_search(tokens, largest_uid):
+    """Turn IMAP SEARCH tokens into a predicate over mailbox entries"""
+    pos = 0
+
+    def key():
+        nonlocal pos
+        token = tokens[pos]
+        pos += 1
+        upper = token.upper()
+        if token == '(':
+            preds = []
+            while tokens[pos] != ')':
+                preds.append(key())
+            pos += 1
+            return lambda m, preds=preds: all(p(m) for p in preds)
+        if upper == 'ALL':
+            return lambda m: True
+        if upper == 'UNSEEN':
+            return lambda m: not m['seen']
+        if upper == 'SEEN':
+            return lambda m: m['seen']
+        if upper == 'NOT':
+            inner = key()
+            return lambda m: not inner(m)
+        if upper == 'OR':
+            left, right = key(), key()
+            return lambda m: left(m) or right(m)
+        if upper in ('SINCE', 'BEFORE'):
+            day = datetime.strptime(_unquote(tokens[pos]), '%d-%b-%Y').date()
+            pos += 1
+            if upper == 'SINCE':
+                return lambda m: m['date'].date() >= day
+            return lambda m: m['date'].date() < day
+        if upper in ('FROM', 'SUBJECT'):
+            needle = _unquote(tokens[pos]).lower()
+            pos += 1
+            header = 'From' if upper == 'FROM' else 'Subject'
+            return lambda m: needle in str(m['msg'].get(header, '')).lower()
+        if upper == 'UID':
+            uids = _parse_sequence_set(tokens[pos], largest_uid)
+            pos += 1
+            return lambda m: m['uid'] in uids
+        if upper == 'X-GM-RAW':
+            raw = _unquote(tokens[pos]).lower()
+            pos += 1
+            return _gmail_raw_predicate(raw)
+        if re.match(r'^[\d*:,]+$', token):
+            return lambda m: True  # sequence sets are not used by the sync code
+        raise ValueError(f'unsupported search key {token}')
+
+    preds = []
+    while pos < len(tokens):
+        preds.append(key())
+    return lambda m: all(p(m) for p in preds)
+
+
+def _gmail_raw_predicate(raw):
+    """Rough X-GM-RAW: from:(a OR b), subject:(x OR y), -category:... terms"""
+    froms = []
+    for group in re.findall(r'(?<!-)from:\(([^)]*)\)', raw):
+        froms += [t for t in group.split() if t != 'or']
+    subjects = []
+    for group in re.findall(r'subject:\(([^)]*)\)', raw):
+        subjects += [t.strip('"') for t in re.findall(r'"[^"]*"|\S+', group) if t != 'or']
+    blocked = re.findall(r'-from:\(([^)]*)\)', raw)
+    blocked = [t for group in blocked for t in group.split() if t != 'or']
+    purchases = 'category:purchases' in raw
+
+    def predicate(m):
+        sender = str(m['msg'].get('From', '')).lower()
+        subject = str(m['msg'].get('Subject', '')).lower()
+        if any(b in sender for b in blocked):
+            return False
+        if not froms and not subjects and not purchases:
+            return True
+        return (any(f in sender for f in froms) or any(s in subject for s in subjects)
+                or (purchases and any(w in subject for w in ('order', 'receipt', 'invoice'))))
+    return predicate
+
+
+# ============ SERVER ============
+
+class FakeIMAPServer:
+    """Threaded fake IMAP server on 127.0.0.1
+
+    latency:     seconds slept before answering each command
+    drop_rate:   probability that a command kills the connection instead of answering
+    capabilities: advertised CAPABILITY atoms (drop IDLE to test polling fallback)
+    """
+
+    def __init__(self, latency=0.0, drop_rate=0.0, capabilities=('IMAP4rev1', 'IDLE', 'UIDPLUS'),
+                 seed=None):
+        self.accounts = {}
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.capabilities = list(capabilities)
+        self.rng = random.Random(seed)
+        self.stats = {'connections': 0, 'commands': 0, 'fetch_bytes': 0, 'drops': 0}
+        self._stats_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def add_account(self, username, password, messages=(), uid_validity=None):
+        mailbox = FakeMailbox(uid_validity)
+        for raw, date in messages:
+            mailbox.append(raw, date)
+        self.accounts[username] = (password, mailbox)
+        return mailbox
+
+    def deliver(self, username, raw, date=None):
+        """Append a new message and wake any IDLE sessions on that mailbox"""
+        self.accounts[username][1].append(raw, date)
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server._count('connections')
+                _Session(server, self.rfile, self.wfile, self.connection).run()
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def patch_imaplib(self):
+        """Route imaplib.IMAP4_SSL(host, port) to this server over plain TCP"""
+        host, port = self.address
+
+        class FakeIMAP4_SSL(imaplib.IMAP4):
+            def __init__(self, _host='', _port=993, *args, timeout=None, **kwargs):
+                super().__init__(host, port, timeout=timeout)
+
+        original = imaplib.IMAP4_SSL
+        imaplib.IMAP4_SSL = FakeIMAP4_SSL
+        return original
+
+
+class _Session:
+    def __init__(self, server, rfile, wfile, connection):
+        self.server = server
+        self.rfile = rfile
+        self.wfile = wfile
+        self.connection = connection
+        self.mailbox = None
+        self.reported = 0  # message count last announced with EXISTS
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8', errors='surrogateescape')
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def run(self):
+        self.send('* OK [CAPABILITY ' + ' '.join(self.server.capabilities) + '] fake-imap ready\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode('utf-8', errors='surrogateescape').rstrip('\r\n')
+            if not line:
+                continue
+            self.server._count('commands')
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            if self.server.drop_rate and self.server.rng.random() < self.server.drop_rate:
+                self.server._count('drops')
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            tag, _, rest = line.partition(' ')
+            command, _, args = rest.partition(' ')
+            try:
+                if not self.dispatch(tag, command.upper(), args):
+                    return
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                self.send(f'{tag} BAD {e}\r\n')
+
+    def dispatch(self, tag, command, args):
+        if command == 'CAPABILITY':
+            self.send('* CAPABILITY ' + ' '.join(self.server.capabilities) + '\r\n')
+        elif command == 'LOGIN':
+            username, password = [_unquote(t) for t in _tokenize_search(args)[:2]]
+            account = self.server.accounts.get(username)
+            if not account or account[0] != password:
+                self.send(f'{tag} NO [AUTHENTICATIONFAILED] Invalid credentials\r\n')
+                return True
+            self.account = account
+        elif command in ('SELECT', 'EXAMINE'):
+            self.mailbox = self.account[1]
+            with self.mailbox.lock:
+                self.reported = len(self.mailbox.messages)
+                self.send(f'* {self.reported} EXISTS\r\n'
+                          f'* OK [UIDVALIDITY {self.mailbox.uid_validity}] UIDs valid\r\n'
+                          f'* OK [UIDNEXT {self.mailbox.uid_next}] Predicted next UID\r\n')
+        elif command == 'NOOP':
+            pass
+        elif command == 'LOGOUT':
+            self.send('* BYE logging out\r\n')
+            self.send(f'{tag} OK LOGOUT completed\r\n')
+            return False
+        elif command == 'SEARCH':
+            self.search(args, uid=False)
+        elif command == 'FETCH':
+            self.fetch(args, uid=False)
+        elif command == 'UID':
+            sub, _, sub_args = args.partition(' ')
+            if sub.upper() == 'SEARCH':
+                self.search(sub_args, uid=True)
+            elif sub.upper() == 'FETCH':
+                self.fetch(sub_args, uid=True)
+            else:
+                self.send(f'{tag} BAD unsupported UID command\r\n')
+                return True
+        elif command == 'IDLE':
+            return self.idle(tag)
+        else:
+            self.send(f'{tag} BAD unsupported command {command}\r\n')
+            return True
+        self.announce()
+        self.send(f'{tag} OK {command} completed\r\n')
+        return True
+
+    def announce(self):
+        """Untagged EXISTS for mail delivered since the last report, as real servers send"""
+        if self.mailbox is None:
+            return
+        with self.mailbox.lock:
+            count = len(self.mailbox.messages)
+        if count != self.reported:
+            self.reported = count
+            self.send(f'* {count} EXISTS\r\n')
+
+    def search(self, args, uid):
+        tokens = _tokenize_search(args)
+        if tokens and tokens[0].upper() == 'CHARSET':
+            tokens = tokens[2:]
+        with self.mailbox.lock:
+            largest = self.mailbox.messages[-1]['uid'] if self.mailbox.messages else 0
+            predicate = _compile_search(tokens, largest)
+            hits = [(seq, m['uid']) for seq, m in enumerate(self.mailbox.messages, 1) if predicate(m)]
+        numbers = [str(u if uid else seq) for seq, u in hits]
+        self.send('* SEARCH' + ''.join(' ' + n for n in numbers) + '\r\n')
+
+    def fetch(self, args, uid):
+        spec, _, items = args.partition(' ')
+        wanted = FETCH_ITEM_RE.findall(items)
+        with self.mailbox.lock:
+            messages = list(enumerate(self.mailbox.messages, 1))
+        if not messages:
+            return
+        largest = messages[-1][1]['uid'] if uid else len(messages)
+        ids = _parse_sequence_set(spec, largest)
+        for seq, m in messages:
+            if (m['uid'] if uid else seq) not in ids:
+                continue
+            parts = []
+            if uid:
+                parts.append(f'UID {m["uid"]}'.encode())
+            for name, section, origin, length in wanted:
+                upper = name.upper()
+                if upper == 'UID':
+                    if not uid:
+                        parts.append(f'UID {m["uid"]}'.encode())
+                elif upper == 'BODYSTRUCTURE':
+                    parts.append(b'BODYSTRUCTURE ' + bodystructure(m['msg']).encode('utf-8', errors='surrogateescape'))
+                elif upper == 'FLAGS':
+                    parts.append(b'FLAGS (\\Seen)' if m['seen'] else b'FLAGS ()')
+                elif upper.startswith('BODY'):
+                    section = section.upper()
+                    data = m['raw'] if section == '' else _section(m['msg'], section)
+                    if data is None:
+                        data = b''
+                    label = f'BODY[{section}]'
+                    if origin:
+                        data = data[int(origin):int(origin) + int(length)]
+                        label += f'<{origin}>'
+                    self.server._count('fetch_bytes', len(data))
+                    parts.append(label.encode() + f' {{{len(data)}}}\r\n'.encode() + data)
+                    if not upper.startswith('BODY.PEEK'):
+                        m['seen'] = True
+            self.send(f'* {seq} FETCH ('.encode() + b' '.join(parts) + b')\r\n')
+
+    def idle(self, tag):
+        if 'IDLE' not in self.server.capabilities:
+            self.send(f'{tag} BAD IDLE not supported\r\n')
+            return True
+        self.send('+ idling\r\n')
+        mailbox = self.mailbox
+        while True:
+            with mailbox.changed:
+                count = len(mailbox.messages)
+                if count != self.reported:
+                    self.send(f'* {count} EXISTS\r\n')
+                    self.reported = count
+            readable, _, _ = select.select([self.connection], [], [], 0.2)
+            if not readable:
+                continue
+            line = self.rfile.readline()
+            if not line:
+                return False
+            if line.strip().upper() == b'DONE':
+                break
+        self.send(f'{tag} OK IDLE terminated\r\n')
+        return True
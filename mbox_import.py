@@ -0,0 +1,222 @@
+# mbox_import.py
+"""Import expenses from a mailbox export instead of a live IMAP account
+
+    python mbox_import.py --user alice "Takeout/Mail/All mail.mbox"
+    python mbox_import.py --user 3 --workers 8 exported_emails/
+    python mbox_import.py --dry-run big.mbox        # throughput only, no DB
+
+Accepts a Google Takeout .mbox file, a single .eml file or a directory of
+.eml files. Messages go through the same spam filters and
+extract_expense_data_fast as live sync, spread over a process pool, and the
+results are bulk-inserted for the given user.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from email_processor import EmailProcessor
+
+BATCH_SIZE = 64        # messages handed to a worker at a time
+INSERT_BATCH_SIZE = 500
+
+_worker_processor = None
+
+
+def iter_mbox(path):
+    """Yield raw message bytes from an mbox file without indexing it first"""
+    with open(path, 'rb') as f:
+        lines = []
+        for line in f:
+            if line.startswith(b'From '):
+                if lines:
+                    yield b''.join(lines)
+                lines = []
+                continue
+            # mboxrd escapes body lines that start with "From "
+            if line.startswith(b'>') and line.lstrip(b'>').startswith(b'From '):
+                line = line[1:]
+            lines.append(line)
+        if lines:
+            yield b''.join(lines)
+
+
+def iter_eml(path):
+    """Yield raw message bytes for every .eml file under path"""
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            yield f.read()
+        return
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith('.eml'):
+                with open(os.path.join(root, name), 'rb') as f:
+                    yield f.read()
+
+
+def iter_messages(path):
+    """Pick the reader for an .mbox file, .eml file or directory"""
+    if os.path.isfile(path) and not path.lower().endswith('.eml'):
+        return iter_mbox(path)
+    return iter_eml(path)
+
+
+def _init_worker():
+    """Build one offline EmailProcessor per worker process"""
+    global _worker_processor
+    _worker_processor = EmailProcessor(None, None, None, None)
+
+
+def _process_batch(batch):
+    """Filter and extract a batch of (index, raw) messages, return (passed, expenses)"""
+    processor = _worker_processor or EmailProcessor(None, None, None, None)
+    passed = 0
+    expenses = []
+
+    for index, raw in batch:
+        try:
+            email_data = processor._filter_message(str(index).encode(), raw)
+            if not email_data:
+                continue
+            passed += 1
+            expense = processor.extract_expense_data_fast(email_data)
+            if expense:
+                expenses.append(expense)
+        except Exception as e:
+            print(f"   ⚠️ Error processing message {index}: {e}")
+
+    return passed, expenses
+
+
+def _batches(messages, size):
+    """Group (index, raw) pairs into lists of size"""
+    batch = []
+    for index, raw in enumerate(messages):
+        batch.append((index, raw))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_pipeline(messages, workers=None, batch_size=BATCH_SIZE):
+    """Yield (passed, expenses) per batch in input order
+
+    Only a few batches per worker are in flight, so a multi-GB mbox is
+    streamed rather than loaded into memory.
+    """
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        _init_worker()
+        for batch in _batches(messages, batch_size):
+            yield _process_batch(batch)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        in_flight = deque()
+        for batch in _batches(messages, batch_size):
+            in_flight.append(pool.submit(_process_batch, batch))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def resolve_user(conn, user):
+    """Find a user id by numeric id or username"""
+    cursor = conn.cursor()
+    if str(user).isdigit():
+        cursor.execute("SELECT id FROM users WHERE id = ?", (int(user),))
+    else:
+        cursor.execute("SELECT id FROM users WHERE username = ?", (user,))
+    row = cursor.fetchone()
+    return row['id'] if row else None
+
+
+def bulk_insert_expenses(conn, user_id, expenses):
+    """Insert expenses in one transaction through app.insert_email_expense
+
+    The same amount/merchant/date is skipped, as in live sync. Budget alerts
+    are not raised for historical imports. Returns the number of rows inserted.
+    """
+    from app import insert_email_expense
+
+    cursor = conn.cursor()
+    inserted = 0
+    for expense in expenses:
+        if insert_email_expense(cursor, expense, user_id) is not None:
+            inserted += 1
+    conn.commit()
+    return inserted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import expenses from an .mbox file or .eml directory')
+    parser.add_argument('path', help='.mbox file, .eml file or directory of .eml files')
+    parser.add_argument('--user', help='username or user id to import for')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='messages per worker task')
+    parser.add_argument('--dry-run', action='store_true', help='run the pipeline without touching the database')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        print(f"❌ Not found: {args.path}")
+        return 1
+
+    conn = None
+    user_id = None
+    if not args.dry_run:
+        if not args.user:
+            print("❌ --user is required unless --dry-run is given")
+            return 1
+
+        # Deferred so --dry-run works without the web app's dependencies
+        from app import get_db
+        conn = get_db('expenses')
+        user_id = resolve_user(conn, args.user)
+        if user_id is None:
+            print(f"❌ Unknown user: {args.user}")
+            return 1
+
+    print(f"📥 Importing {args.path}")
+    started = time.perf_counter()
+    counts = {'messages': 0}
+    passed = found = inserted = 0
+    pending = []
+
+    def counted(messages):
+        for raw in messages:
+            counts['messages'] += 1
+            yield raw
+
+    results = run_pipeline(counted(iter_messages(args.path)), args.workers, args.batch_size)
+    for batch_passed, expenses in results:
+        passed += batch_passed
+        found += len(expenses)
+        if conn is not None:
+            pending.extend(expenses)
+            if len(pending) >= INSERT_BATCH_SIZE:
+                inserted += bulk_insert_expenses(conn, user_id, pending)
+                pending = []
+
+    if conn is not None:
+        if pending:
+            inserted += bulk_insert_expenses(conn, user_id, pending)
+        conn.close()
+
+    total = counts['messages']
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed else 0
+    print(f"✅ {total} messages, {passed} passed filters, {found} expenses, {inserted} inserted")
+    print(f"⏱️ {elapsed:.2f}s ({rate:.0f} messages/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# message_cache.py
+"""Content-addressed on-disk cache of fetched email text
+
+Emails that pass the spam filters are stored zlib-compressed as
+<dir>/<ab>/<sha256 of Message-ID>.z, so extraction can be rerun over past
+mail (reprocess.py) without going back to IMAP. The same message seen by
+two accounts is stored once. The cache is capped at max_bytes and the
+least recently written entries are evicted first.
+
+Several sync workers may write the same directory, so usage is measured
+from the directory itself: the index of sizes and modification times is
+rescanned every rescan_interval seconds and before any eviction, and
+eviction goes down to EVICT_TO of max_bytes so the next one is a while off.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+CACHE_FORMAT = 1
+CACHED_FIELDS = ('message_id', 'subject', 'sender', 'body')
+EVICT_TO = 0.9  # fraction of max_bytes left after an eviction
+
+
+def message_key(message_id):
+    """Cache key for a Message-ID header value"""
+    return hashlib.sha256(message_id.strip().encode('utf-8', errors='replace')).hexdigest()
+
+
+class MessageCache:
+    """Bounded zlib cache of email dicts keyed by Message-ID hash"""
+
+    def __init__(self, directory, max_bytes, rescan_interval=300):
+        self.directory = directory
+        self.max_bytes = max(0, int(max_bytes))
+        self.rescan_interval = rescan_interval
+        self.lock = threading.Lock()
+        self.entries = None  # key -> compressed size, oldest first; read from disk on first use
+        self.scanned_at = None
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def put(self, email_data):
+        """Store an email dict, returning its key (None if it has no Message-ID)"""
+        message_id = (email_data.get('message_id') or '').strip()
+        if not message_id or not self.enabled:
+            return None
+
+        key = message_key(message_id)
+        path = self._path(key)
+        # Another worker may have written (or evicted) it since our last scan
+        if os.path.exists(path):
+            return key
+
+        record = {field: email_data.get(field, '') for field in CACHED_FIELDS}
+        record['v'] = CACHE_FORMAT
+        date = email_data.get('date')
+        record['date'] = date.isoformat() if hasattr(date, 'isoformat') else date
+        blob = zlib.compress(json.dumps(record).encode('utf-8'))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp, path)
+
+        with self.lock:
+            self._load_index()
+            self.total_bytes += len(blob) - self.entries.pop(key, 0)
+            self.entries[key] = len(blob)
+            evicted = []
+            if self.total_bytes > self.max_bytes:
+                # Other workers' writes only show up on disk — count them before evicting
+                self._load_index(rescan=True)
+                evicted = self._evict()
+        for old in evicted:
+            try:
+                os.remove(self._path(old))
+            except OSError:
+                pass
+        return key
+
+    def get(self, message_id):
+        """Cached email dict for a Message-ID (date parsed back), or None"""
+        if not message_id or not message_id.strip():
+            return None
+
+        try:
+            with open(self._path(message_key(message_id)), 'rb') as f:
+                record = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except (OSError, ValueError, zlib.error):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        if record.get('v') != CACHE_FORMAT:
+            return None
+        try:
+            record['date'] = datetime.fromisoformat(record['date'])
+        except (TypeError, ValueError):
+            record['date'] = datetime.now()
+        return record
+
+    def stats(self):
+        """Size and hit counters for the health endpoint"""
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self.entries) if self.entries is not None else None,
+                'bytes': self.total_bytes if self.entries is not None else None,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.z')
+
+    def _load_index(self, rescan=False):
+        """Scan the cache directory, oldest files first, if due — caller holds lock"""
+        due = self.scanned_at is None or time.monotonic() - self.scanned_at >= self.rescan_interval
+        if not (rescan or due):
+            return
+
+        found = []
+        if os.path.isdir(self.directory):
+            for bucket in os.scandir(self.directory):
+                if not bucket.is_dir():
+                    continue
+                for entry in os.scandir(bucket.path):
+                    if entry.name.endswith('.z'):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue  # evicted by another worker mid-scan
+                        found.append((stat.st_mtime, entry.name[:-2], stat.st_size))
+        found.sort()
+        self.entries = OrderedDict((key, size) for _, key, size in found)
+        self.total_bytes = sum(size for _, _, size in found)
+        self.scanned_at = time.monotonic()
+
+    def _evict(self):
+        """Drop the oldest entries until under EVICT_TO of max_bytes — caller holds lock"""
+        evicted = []
+        while self.total_bytes > self.max_bytes * EVICT_TO and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            evicted.append(key)
+        self.evictions += len(evicted)
+        return evicted
@@ -0,0 +1,149 @@
+# reprocess.py
+"""Rerun expense extraction over cached emails after a rules change
+
+    python reprocess.py --dry-run            # report what would change
+    python reprocess.py                      # update every user's email expenses
+    python reprocess.py --user alice --add-missed
+
+Every processed email with a Message-ID is looked up in the message cache
+(DATA_DIR/message_cache, filled during sync) and run through the current
+extract_expense_data. Email-sourced expenses whose amount, merchant,
+category, payment method, GST, transaction id or confidence changed are
+updated in place; expenses the user has edited are left alone. With
+--add-missed, cached emails that produced no expense before but do now
+get one. Nothing is fetched from IMAP.
+"""
+import argparse
+import sys
+import time
+
+from email_processor import EmailProcessor
+
+COMMIT_EVERY = 500
+EXTRACT_BATCH_SIZE = 5000  # cached emails read and extracted together
+UPDATED_FIELDS = ('amount', 'merchant', 'category', 'payment_method',
+                  'gst_amount', 'transaction_id', 'confidence', 'description')
+
+
+def expense_changes(row, expense_data):
+    """Fields of an expenses row that differ from a fresh extraction"""
+    changes = {}
+    for field in UPDATED_FIELDS:
+        new = expense_data.get(field)
+        if new is not None and row[field] != new:
+            changes[field] = new
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rerun expense extraction over the local message cache')
+    parser.add_argument('--user', help='username or user id (default: everyone)')
+    parser.add_argument('--add-missed', action='store_true',
+                        help='create expenses for cached emails that now yield one')
+    parser.add_argument('--dry-run', action='store_true', help='report changes without writing them')
+    parser.add_argument('--workers', type=int, default=None, help='extraction processes (default: CPU count)')
+    args = parser.parse_args(argv)
+
+    # Deferred like mbox_import: app reads DATA_DIR and creates the tables on import
+    from app import get_db, message_cache, insert_email_expense
+    from mbox_import import resolve_user
+
+    expenses_conn = get_db('expenses')
+    email_conn = get_db('email')
+
+    user_id = None
+    if args.user:
+        user_id = resolve_user(expenses_conn, args.user)
+        if user_id is None:
+            print(f"❌ Unknown user: {args.user}")
+            return 1
+
+    query = '''
+        SELECT pe.id, pe.message_id, pe.expense_id, ec.user_id
+        FROM processed_emails pe JOIN email_configs ec ON ec.id = pe.email_config_id
+        WHERE pe.message_id IS NOT NULL AND pe.message_id != ''
+    '''
+    params = []
+    if not args.add_missed:
+        query += " AND pe.expense_id IS NOT NULL"
+    if user_id is not None:
+        query += " AND ec.user_id = ?"
+        params.append(user_id)
+
+    extractor = EmailProcessor(None, None, None, None)
+    counts = dict.fromkeys(('emails', 'not_cached', 'updated', 'unchanged', 'added',
+                            'no_longer_detected', 'skipped'), 0)
+    started = time.perf_counter()
+    pending = 0
+
+    print(f"🔁 Reprocessing cached emails{' (dry run)' if args.dry_run else ''}...")
+    rows = email_conn.execute(query, params).fetchall()
+    for offset in range(0, len(rows), EXTRACT_BATCH_SIZE):
+        batch = []
+        for processed in rows[offset:offset + EXTRACT_BATCH_SIZE]:
+            counts['emails'] += 1
+            email_data = message_cache.get(processed['message_id'])
+            if email_data is None:
+                counts['not_cached'] += 1
+                continue
+            batch.append((processed, email_data))
+
+        results = extractor.extract_expense_data_batch([email_data for _, email_data in batch], args.workers)
+        for (processed, _), expense_data in zip(batch, results):
+            if processed['expense_id'] is None:
+                if not expense_data or not expense_data.get('amount'):
+                    continue
+                expense_id = insert_email_expense(expenses_conn.cursor(), expense_data, processed['user_id'])
+                if expense_id:
+                    email_conn.execute("UPDATE processed_emails SET expense_id = ? WHERE id = ?",
+                                       (expense_id, processed['id']))
+                    counts['added'] += 1
+                    pending += 1
+            else:
+                row = expenses_conn.execute(
+                    "SELECT * FROM expenses WHERE id = ? AND source = 'email'", (processed['expense_id'],)
+                ).fetchone()
+                if row is None or row['edited_at']:
+                    # Deleted, manual or edited by the user since
+                    counts['skipped'] += 1
+                    continue
+                if not expense_data or not expense_data.get('amount'):
+                    # Kept as is — a rules change shouldn't silently delete history
+                    counts['no_longer_detected'] += 1
+                    continue
+
+                changes = expense_changes(row, expense_data)
+                if not changes:
+                    counts['unchanged'] += 1
+                    continue
+                expenses_conn.execute(
+                    f"UPDATE expenses SET {', '.join(f'{field} = ?' for field in changes)} WHERE id = ?",
+                    list(changes.values()) + [row['id']]
+                )
+                counts['updated'] += 1
+                pending += 1
+
+            if pending >= COMMIT_EVERY and not args.dry_run:
+                expenses_conn.commit()
+                email_conn.commit()
+                pending = 0
+
+    if args.dry_run:
+        expenses_conn.rollback()
+        email_conn.rollback()
+    else:
+        expenses_conn.commit()
+        email_conn.commit()
+    expenses_conn.close()
+    email_conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {counts['emails']} emails: {counts['updated']} updated, {counts['unchanged']} unchanged, "
+          f"{counts['added']} added, {counts['no_longer_detected']} no longer detected, "
+          f"{counts['skipped']} skipped (edited/deleted), {counts['not_cached']} not in cache")
+    print(f"⏱️ {elapsed:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,31 @@
+# sync_worker.py
+"""Dedicated email sync process
+
+    python sync_worker.py
+
+Runs RealEmailSyncService (polling, IMAP IDLE, backfill and the ingest
+pipeline) outside the web server. Any number can run against the same
+DATA_DIR; active accounts are split between them through the sync_leases
+table, and a worker that dies has its accounts taken over once its leases
+expire (EMAIL_LEASE_TTL). Set EMAIL_SYNC_MODE=worker for the web processes
+so they leave IMAP to these workers.
+"""
+import sys
+import time
+
+
+def main():
+    # Importing app creates the databases and installs the shutdown handlers.
+    # Not at module level: spawned extraction workers re-import this module.
+    from app import real_email_sync_service
+    service = real_email_sync_service
+    print(f"📧 Sync worker {service.leases.worker_id} starting")
+    service.start()
+
+    while service.running:
+        time.sleep(1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+# tests/test_circuit_breaker.py
+"""Per-account circuit breaker: exponential backoff with full jitter, needs_reauth after rejected logins"""
+import pytest
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    # app creates its databases on import, under DATA_DIR
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('DATA_DIR', str(tmp_path_factory.mktemp('data')))
+        import app
+    return app
+
+
+@pytest.fixture
+def service(app_module):
+    return app_module.RealEmailSyncService()
+
+
+@pytest.fixture
+def config(app_module):
+    conn = app_module.get_db('email')
+    cursor = conn.execute(
+        "INSERT INTO email_configs (user_id, email_address, provider, imap_server, imap_port, username, app_password) "
+        "VALUES (1, 'breaker@example.com', 'gmail', 'imap.example.com', 993, 'breaker@example.com', 'pw')"
+    )
+    conn.commit()
+    row = conn.execute("SELECT * FROM email_configs WHERE id = ?", (cursor.lastrowid,)).fetchone()
+    conn.close()
+    return dict(row)
+
+
+def breaker(app_module, config):
+    conn = app_module.get_db('email')
+    row = conn.execute(
+        f"SELECT failure_count, auth_failure_count, auth_state, last_error, ({app_module.SYNCABLE_CONFIG_SQL}) AS syncable "
+        "FROM email_configs WHERE id = ?", (config['id'],)
+    ).fetchone()
+    conn.close()
+    return dict(row)
+
+
+def test_backoff_doubles_up_to_the_cap_with_full_jitter(app_module, service, config, monkeypatch):
+    ceilings = []
+    monkeypatch.setattr(app_module, 'EMAIL_BACKOFF_BASE', 60)
+    monkeypatch.setattr(app_module, 'EMAIL_BACKOFF_MAX', 200)
+    monkeypatch.setattr(app_module.random, 'uniform', lambda low, high: ceilings.append((low, high)) or high)
+
+    for _ in range(4):
+        service._record_failure(config, 'timed out')
+
+    assert ceilings == [(0, 60), (0, 120), (0, 200), (0, 200)]
+    assert service._retry_delay(config['id']) == pytest.approx(200, abs=2)
+    state = breaker(app_module, config)
+    assert state['failure_count'] == 4 and state['last_error'] == 'timed out'
+    assert not state['syncable']
+
+
+def test_backing_off_account_refuses_manual_sync(app_module, service, config, monkeypatch):
+    monkeypatch.setattr(app_module.random, 'uniform', lambda low, high: high)
+    service._record_failure(config, 'timed out')
+
+    result = service.sync_now({**config, **breaker(app_module, config)})
+    assert result['success'] is False and 'backing off' in result['error']
+
+
+def test_rejected_logins_in_a_row_need_reauth(app_module, service, config, monkeypatch):
+    monkeypatch.setattr(app_module, 'EMAIL_AUTH_FAILURE_LIMIT', 3)
+    for _ in range(2):
+        service._record_failure(config, 'AUTHENTICATIONFAILED', auth_failed=True)
+    assert breaker(app_module, config)['auth_state'] == 'ok'
+
+    service._record_failure(config, 'AUTHENTICATIONFAILED', auth_failed=True)
+    state = breaker(app_module, config)
+    assert state['auth_state'] == 'needs_reauth' and not state['syncable']
+
+    conn = app_module.get_db('expenses')
+    titles = [row['title'] for row in conn.execute("SELECT title FROM notifications WHERE user_id = 1")]
+    conn.close()
+    assert any(config['email_address'] in title for title in titles)
+
+
+def test_other_failures_break_the_rejected_login_run(app_module, service, config, monkeypatch):
+    monkeypatch.setattr(app_module, 'EMAIL_AUTH_FAILURE_LIMIT', 3)
+    for auth_failed in (True, True, False, True):
+        service._record_failure(config, 'error', auth_failed=auth_failed)
+
+    state = breaker(app_module, config)
+    assert state['failure_count'] == 4
+    assert state['auth_failure_count'] == 1 and state['auth_state'] == 'ok'
+
+
+def test_success_closes_the_breaker(app_module, service, config):
+    for _ in range(3):
+        service._record_failure(config, 'AUTHENTICATIONFAILED', auth_failed=True)
+
+    service._finish_sync(config, {'success': True, 'processed': 0, 'emails_found': 0})
+    assert breaker(app_module, config) == {'failure_count': 0, 'auth_failure_count': 0, 'auth_state': 'ok',
+                                           'last_error': None, 'syncable': 1}
+    assert service._retry_delay(config['id']) is None
+
+
+def test_skipped_sync_is_not_a_failure(app_module, service, config):
+    service._finish_sync(config, {'success': False, 'skipped': True, 'error': 'lease held elsewhere'})
+    assert breaker(app_module, config)['failure_count'] == 0
@@ -0,0 +1,81 @@
+# tests/test_fetch_parsing.py
+"""FETCH response parsing and BODYSTRUCTURE-driven text part selection"""
+import base64
+import quopri
+from email.message import EmailMessage
+
+import fake_imap
+from email_processor import (_CLOSE, _OPEN, _tokenize_imap, build_sequence_set, decode_text_part,
+                             find_body_item, find_text_part, parse_fetch_response)
+
+
+def parsed_structure(msg):
+    """BODYSTRUCTURE as EmailProcessor sees it, rendered by the fake server"""
+    text = b'1 (BODYSTRUCTURE ' + fake_imap.bodystructure(msg).encode() + b')'
+    return parse_fetch_response([text])[0]['BODYSTRUCTURE']
+
+
+def test_build_sequence_set_collapses_runs():
+    assert build_sequence_set([b'5', 1, '2', 3, 8, 7]) == '1:3,5,7:8'
+    assert build_sequence_set([42]) == '42'
+
+
+def test_tokenize_quoted_nil_and_sectioned_atoms():
+    tokens = list(_tokenize_imap(b'(BODY[HEADER.FIELDS (FROM SUBJECT)]<0> "a \\"b\\"" NIL)'))
+    assert tokens == [_OPEN, 'BODY[HEADER.FIELDS (FROM SUBJECT)]<0>', 'a "b"', None, _CLOSE]
+
+
+def test_parse_fetch_response_splits_messages_and_literals():
+    data = [
+        (b'1 (UID 11 BODYSTRUCTURE ("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 5 1 NIL NIL NIL) '
+         b'BODY[HEADER.FIELDS (FROM SUBJECT)] {26}', b'From: a@b\r\nSubject: hi\r\n\r\n'),
+        b')',
+        (b'2 (UID 12 BODY[1]<0> {5}', b'hello'),
+        b')',
+    ]
+    first, second = parse_fetch_response(data)
+
+    assert first['SEQ'] == '1' and first['UID'] == '11'
+    assert first['BODYSTRUCTURE'][:2] == ['TEXT', 'PLAIN']
+    assert find_body_item(first, 'HEADER.FIELDS', prefix=True) == b'From: a@b\r\nSubject: hi\r\n\r\n'
+    assert second['UID'] == '12'
+    assert find_body_item(second, '1') == b'hello'
+    assert find_body_item(second, '2') is None
+
+
+def test_find_text_part_prefers_plain_and_skips_attachments():
+    msg = EmailMessage()
+    msg.set_content('plain body')
+    msg.add_alternative('<p>html body</p>', subtype='html')
+    msg.add_attachment(b'%PDF-1.4', maintype='application', subtype='pdf', filename='invoice.pdf')
+    msg.add_attachment('notes', filename='notes.txt')
+
+    part = find_text_part(parsed_structure(msg))
+
+    assert part['section'] == '1.1'
+    assert part['subtype'] == 'plain'
+
+
+def test_find_text_part_falls_back_to_html_and_single_part():
+    html_only = EmailMessage()
+    html_only.set_content('<p>receipt</p>', subtype='html')
+    assert find_text_part(parsed_structure(html_only)) == {
+        'section': '1', 'subtype': 'html', 'encoding': '7bit', 'charset': 'utf-8'
+    }
+
+    pdf_only = EmailMessage()
+    pdf_only.add_attachment(b'%PDF-1.4', maintype='application', subtype='pdf', filename='invoice.pdf')
+    assert find_text_part(parsed_structure(pdf_only)) is None
+
+
+def test_decode_text_part_handles_truncated_base64():
+    encoded = base64.b64encode('Paid ₹250 to Swiggy'.encode('utf-8'))
+    part = {'encoding': 'base64', 'charset': 'utf-8', 'subtype': 'plain'}
+    # A byte-range partial can end mid-quantum
+    assert decode_text_part(encoded[:-3], part).startswith('Paid ₹250 to')
+
+
+def test_decode_text_part_quoted_printable_html_and_bad_charset():
+    data = quopri.encodestring('<td>Total</td><td>₹99</td>'.encode('utf-8'))
+    part = {'encoding': 'quoted-printable', 'charset': 'no-such-charset', 'subtype': 'html'}
+    assert decode_text_part(data, part) == 'Total ₹99'
@@ -0,0 +1,118 @@
+# tests/test_high_water_mark.py
+"""iter_new_emails sync_state (UIDVALIDITY + last UID) against the fake IMAP server"""
+import imaplib
+from itertools import count
+
+import pytest
+
+import fake_imap
+from email_processor import EmailProcessor
+
+_accounts = count(1)
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = fake_imap.FakeIMAPServer(seed=1).start()
+    original = server.patch_imaplib()
+    yield server
+    imaplib.IMAP4_SSL = original
+    server.stop()
+
+
+@pytest.fixture
+def account(server):
+    """Fresh mailbox of 12 recent messages, roughly half spam; (username, mailbox)"""
+    username = f'user{next(_accounts)}@example.com'
+    messages = fake_imap.generate_messages(12, spam_ratio=0.5, seed=11, days=1, account=username)
+    return username, server.add_account(username, 'pw', messages)
+
+
+def processor_for(server, username, password='pw'):
+    host, port = server.address
+    return EmailProcessor(host, port, username, password, fetch_chunk_size=4)
+
+
+def sync(processor, state=None, limit=50):
+    state = state or {}
+    emails = processor.get_new_emails(state.get('last_uid', 0), state.get('uid_validity'), limit=limit)
+    return emails, dict(processor.sync_state)
+
+
+def uids(emails):
+    return [int(email_data['id']) for email_data in emails]
+
+
+def test_first_sync_examines_everything(server, account):
+    username, mailbox = account
+    processor = processor_for(server, username)
+    emails, state = sync(processor)
+
+    assert emails and processor.fetch_error is None
+    assert state == {'uid_validity': mailbox.uid_validity, 'last_uid': 12}
+
+
+def test_incremental_sync_only_sees_new_mail(server, account):
+    username, _ = account
+    processor = processor_for(server, username)
+    _, state = sync(processor)
+
+    for raw, date in fake_imap.generate_messages(2, spam_ratio=0, seed=2, start_index=100, days=1,
+                                                 account=username):
+        server.deliver(username, raw, date)
+
+    emails, state = sync(processor, state)
+    assert uids(emails) == [13, 14]
+    assert state['last_uid'] == 14
+
+    emails, state = sync(processor, state)
+    assert emails == [] and state['last_uid'] == 14
+
+
+def test_uid_validity_change_rescans(server, account):
+    username, mailbox = account
+    processor = processor_for(server, username)
+    first, state = sync(processor)
+
+    mailbox.reset_uid_validity()
+    emails, new_state = sync(processor, state)
+    assert uids(emails) == uids(first)
+    assert new_state == {'uid_validity': state['uid_validity'] + 1, 'last_uid': 12}
+
+
+def test_limit_stops_the_mark_at_the_last_email_returned(server, account):
+    username, _ = account
+    emails, state = sync(processor_for(server, username), limit=2)
+
+    assert len(emails) == 2
+    assert state['last_uid'] == uids(emails)[-1] < 12
+
+
+def test_missing_body_keeps_the_mark_before_it(server, account):
+    username, _ = account
+    processor = processor_for(server, username)
+    complete, _ = sync(processor_for(server, username))
+    dropped = uids(complete)[1]
+
+    fetch_bodies = processor._fetch_bodies
+
+    def lossy(candidates, uid=False):
+        bodies = fetch_bodies(candidates, uid=uid)
+        return {email_id: body for email_id, body in bodies.items() if int(email_id) != dropped}
+
+    processor._fetch_bodies = lossy
+    emails, state = sync(processor)
+
+    assert uids(emails) == uids(complete)[:1]
+    assert processor.fetch_error == f'No body returned for message {dropped}'
+    assert state['last_uid'] < dropped
+
+
+def test_connect_failure_leaves_the_mark_alone(server, account):
+    username, mailbox = account
+    processor = processor_for(server, username, password='wrong')
+    state = {'uid_validity': mailbox.uid_validity, 'last_uid': 5}
+
+    emails, new_state = sync(processor, state)
+    assert emails == [] and processor.fetch_error
+    assert new_state == state
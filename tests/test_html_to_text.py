@@ -0,0 +1,36 @@
+# tests/test_html_to_text.py
+"""html_to_text: receipt HTML to the plain text the extractors read"""
+import time
+
+from email_processor import html_to_text
+
+
+def test_table_cells_share_a_line_and_rows_split():
+    html = '<table><tr><td>Item Total</td><td>&#8377;250</td></tr><tr><td>Order ID</td><td>123</td></tr></table>'
+    assert html_to_text(html) == 'Item Total ₹250\nOrder ID 123'
+
+
+def test_style_script_and_comments_are_dropped():
+    html = ('<html><head><style>td { color: red }</style></head><body><!-- tracking -->'
+            '<p>Paid via UPI &amp; card</p><script>var x = "<p>no</p>";</script></body></html>')
+    assert html_to_text(html) == 'Paid via UPI & card'
+
+
+def test_doctype_and_bare_less_than():
+    assert html_to_text('<!DOCTYPE html><p>a < b</p>') == 'a < b'
+
+
+def test_output_is_capped():
+    assert len(html_to_text('<p>' + 'x' * 10000 + '</p>', max_chars=100)) == 100
+
+
+def test_unterminated_markup_ends_the_scan():
+    assert html_to_text('<p>Total ₹99</p><!-- never closed <p>hidden') == 'Total ₹99'
+    assert html_to_text('<p>Total ₹99</p><script>never closed') == 'Total ₹99'
+
+
+def test_pathological_markup_stays_linear():
+    html = '<a' * 50000 + '<!' * 50000
+    started = time.perf_counter()
+    html_to_text(html)
+    assert time.perf_counter() - started < 1
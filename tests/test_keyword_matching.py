@@ -0,0 +1,78 @@
+# tests/test_keyword_matching.py
+"""KeywordAutomaton and the keyword checks built on it, against plain `in` loops"""
+import random
+
+import fake_imap
+from email_processor import (CATEGORY_KEYWORDS, MERCHANT_KEYWORDS, PAYMENT_METHOD_RULES, SPAM_BODY_KEYWORDS,
+                             SPAM_SUBJECT_KEYWORDS, TRANSACTION_BODY_KEYWORDS, TRANSACTION_SUBJECT_KEYWORDS,
+                             EmailProcessor, KeywordAutomaton, has_spam_body, has_spam_subject,
+                             has_transaction_indicators)
+
+EXTRA_TEXTS = [
+    '', 'Paid via PhonePe UPI', 'Gpay payment of Rs 20', 'RuPay credit card EMI', 'ola uber rapido',
+    'Your Netflix subscription bill', 'cash on delivery order confirmed', 'SIP in mutual fund',
+    'Flat 50% OFF — mega sale, unsubscribe', 'Payment received, order ID 123, debited',
+]
+
+
+def corpus():
+    templates = fake_imap.RECEIPT_TEMPLATES + fake_imap.HTML_RECEIPT_TEMPLATES + fake_imap.SPAM_TEMPLATES
+    return list(templates) + [('', text, text) for text in EXTRA_TEXTS]
+
+
+def test_automaton_finds_every_substring_keyword():
+    rng = random.Random(5)
+    keywords = {''.join(rng.choice('abc ') for _ in range(rng.randint(1, 4))) for _ in range(40)}
+    automaton = KeywordAutomaton(keywords)
+
+    for _ in range(500):
+        text = ''.join(rng.choice('abcd ') for _ in range(rng.randint(0, 30)))
+        assert automaton.find(text) == {keyword for keyword in keywords if keyword in text}, text
+
+
+def test_overlapping_and_nested_keywords():
+    automaton = KeywordAutomaton(['pay', 'payment', 'payment of', 'men', 'ent', 'of'])
+    assert automaton.find('payment of rs 10') == {'pay', 'payment', 'payment of', 'men', 'ent', 'of'}
+    assert automaton.find('payments') == {'pay', 'payment', 'men', 'ent'}
+    assert KeywordAutomaton([]).find('anything') == set()
+
+
+def test_spam_and_transaction_counts_match_the_keyword_loops():
+    for _, subject, body in corpus():
+        subject_lower, body_lower = subject.lower(), body.lower()
+        assert has_spam_subject(subject) == any(kw in subject_lower for kw in SPAM_SUBJECT_KEYWORDS)
+        assert has_spam_body(body) == (sum(kw in body_lower for kw in SPAM_BODY_KEYWORDS) >= 3)
+        assert has_transaction_indicators(subject, body) == (
+            sum(kw in subject_lower for kw in TRANSACTION_SUBJECT_KEYWORDS),
+            sum(kw in body_lower for kw in TRANSACTION_BODY_KEYWORDS),
+        )
+
+
+def first_merchant(text, sender):
+    for keyword, merchant in MERCHANT_KEYWORDS.items():
+        if keyword in text.lower() or keyword in sender.lower():
+            return merchant
+    return 'Unknown Merchant'
+
+
+def first_category(text):
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if any(keyword in text.lower() for keyword in keywords):
+            return category
+    return 'Other'
+
+
+def first_payment_method(text):
+    for method, keywords, labels in PAYMENT_METHOD_RULES:
+        if any(keyword in text.lower() for keyword in keywords):
+            return next((label for keyword, label in labels if keyword in text.lower()), method)
+    return 'Unknown'
+
+
+def test_first_match_order_is_kept():
+    processor = EmailProcessor(None, None, None, None)
+    for sender, subject, body in corpus():
+        text = f'{subject}\n{body}'
+        assert processor._extract_merchant_fast(text, sender) == first_merchant(text, sender)
+        assert processor._determine_category_fast(text) == first_category(text)
+        assert processor._detect_payment_method(text) == first_payment_method(text)
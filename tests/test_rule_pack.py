@@ -0,0 +1,78 @@
+# tests/test_rule_pack.py
+"""RulePack.with_overrides: detection_rules rows layered on the built-in lists"""
+import pickle
+
+from email_processor import (BLOCKED_SENDER_PATTERNS, MERCHANT_KEYWORDS, EmailFeatures, EmailProcessor, RulePack,
+                             active_rules, install_rules)
+
+
+def test_defaults_are_the_builtin_lists():
+    pack = RulePack.with_overrides(1)
+    assert pack.blocked_senders == BLOCKED_SENDER_PATTERNS
+    assert pack.merchants == MERCHANT_KEYWORDS
+
+
+def test_rows_add_and_remove_sender_patterns():
+    pack = RulePack.with_overrides(2, rules=[
+        ('blocked_sender', r'@spam\.example', None, 1),
+        ('blocked_sender', r'@campaigns\.', None, 0),
+        ('trusted_sender', r'billing@corner\.cafe', None, 1),
+    ])
+    assert pack.senders.classify('x@spam.example.com') == (True, False)
+    assert pack.senders.classify('hello@campaigns.brand.in') == (False, False)
+    assert pack.senders.classify('Cafe <billing@corner.cafe>') == (False, True)
+
+
+def test_invalid_sender_regex_is_skipped():
+    pack = RulePack.with_overrides(3, rules=[('blocked_sender', '@bad(', None, 1)])
+    assert pack.blocked_senders == BLOCKED_SENDER_PATTERNS
+
+
+def test_keyword_rows_are_lowercased_and_counted():
+    pack = RulePack.with_overrides(4, rules=[('spam_subject', 'Clearance', None, 1),
+                                             ('spam_subject', 'sale', None, 0)])
+    assert 'clearance' in pack.spam_subject_set and 'sale' not in pack.spam_subject_set
+    assert EmailFeatures('Winter CLEARANCE', rules=pack).subject_hits & pack.spam_subject_set == {'clearance'}
+
+
+def test_merchant_rows_win_over_builtins_and_can_drop_them():
+    pack = RulePack.with_overrides(5, rules=[('merchant', 'corner cafe', 'Corner Cafe', 1),
+                                             ('merchant', 'swiggy', None, 0)])
+    assert next(iter(pack.merchants)) == 'corner cafe'
+    assert 'swiggy' not in pack.merchants
+
+    processor = EmailProcessor(None, None, None, None)
+    features = EmailFeatures('Paid at Corner Cafe via Amazon Pay', rules=pack)
+    assert processor._extract_merchant_fast(features.text, features=features) == 'Corner Cafe'
+
+
+def test_category_rows_and_keywords():
+    pack = RulePack.with_overrides(
+        6,
+        rules=[('category', 'gym', 'Fitness', 1), ('category', 'swiggy', 'Food Delivery', 0)],
+        category_keywords=[('Pets', 'Vet'), ('Fitness', 'yoga')],
+    )
+    assert pack.categories['Fitness'] == ['yoga', 'gym']
+    assert pack.categories['Pets'] == ['vet']
+    assert 'swiggy' not in pack.categories['Food Delivery']
+
+    processor = EmailProcessor(None, None, None, None)
+    features = EmailFeatures('Monthly gym membership', rules=pack)
+    assert processor._determine_category_fast(features.text, features=features) == 'Fitness'
+
+
+def test_pack_pickles_by_rebuilding_its_matchers():
+    pack = RulePack.with_overrides(7, rules=[('blocked_sender', r'@spam\.example', None, 1)])
+    copy = pickle.loads(pickle.dumps(pack))
+    assert copy.version == 7 and copy.summary() == pack.summary()
+    assert copy.senders.classify('x@spam.example') == (True, False)
+
+
+def test_install_rules_swaps_the_active_pack():
+    previous = active_rules()
+    pack = RulePack(8, blocked_senders=[r'@only\.example'])
+    try:
+        assert install_rules(pack) is active_rules() is pack
+        assert EmailFeatures('hi', sender='a@only.example').is_blocked
+    finally:
+        install_rules(previous)
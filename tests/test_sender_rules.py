@@ -0,0 +1,56 @@
+# tests/test_sender_rules.py
+"""SenderClassifier against the per-pattern re.search loop it replaced"""
+import re
+
+import pytest
+
+import fake_imap
+from email_processor import (BLOCKED_SENDER_PATTERNS, TRUSTED_SENDER_PATTERNS, SenderClassifier,
+                             SenderIndex)
+
+
+def regex_loop(sender, patterns):
+    return any(re.search(pattern, sender.lower()) for pattern in patterns)
+
+
+def sender_corpus():
+    senders = {template[0] for template in fake_imap.SPAM_TEMPLATES}
+    senders |= {template[0] for template in fake_imap.RECEIPT_TEMPLATES + fake_imap.HTML_RECEIPT_TEMPLATES}
+    for pattern in BLOCKED_SENDER_PATTERNS + TRUSTED_SENDER_PATTERNS:
+        literal = pattern.replace('\\.', '.').replace('.*', '-big-')
+        if literal.startswith('@'):
+            literal = 'hello' + literal + ('shop.com' if literal.endswith('.') else '')
+        senders |= {literal, f'Shop <{literal}>', literal.upper(),
+                    'x' + literal, literal + '.evil.com', literal.replace('@', '@mail.')}
+    senders |= {
+        'a@campaigns.', 'a@sub.campaigns.com', 'noreply-sale@x.com', 'Sale <noreply@shop.com>',
+        '"deals@offers.com" <me@bank.com>', 'friend@gmail.com', 'Friend', '',
+    }
+    return sorted(senders)
+
+
+def test_builtin_lists_match_the_regex_loop():
+    classifier = SenderClassifier(BLOCKED_SENDER_PATTERNS, TRUSTED_SENDER_PATTERNS)
+    mismatches = [
+        sender for sender in sender_corpus()
+        if classifier.classify(sender) != (regex_loop(sender, BLOCKED_SENDER_PATTERNS),
+                                           regex_loop(sender, TRUSTED_SENDER_PATTERNS))
+    ]
+    assert mismatches == []
+
+
+@pytest.mark.parametrize('pattern,sender,expected', [
+    ('shop.com', 'a@shopxcom.in', True),            # unescaped '.' is a wildcard
+    (r'shop\.com', 'a@shopxcom.in', False),
+    (r'@Shop\.com', 'a@shop.com', False),           # upper case never matched the lowercased sender
+    (r'^billing@', 'billing@shop.com', True),
+    (r'^billing@', 'Shop <billing@shop.com>', False),
+    (r'@shop\.com$', 'a@shop.com', True),
+])
+def test_regex_semantics_are_kept(pattern, sender, expected):
+    assert SenderIndex([pattern]).matches(sender.lower()) is expected
+    assert regex_loop(sender, [pattern]) is expected
+
+
+def test_empty_list_matches_nothing():
+    assert not SenderIndex([]).matches('anyone@example.com')
@@ -0,0 +1,57 @@
+# tests/test_server_filter.py
+"""Server-side SEARCH pre-filter, evaluated by fake_imap's SEARCH engine"""
+from email import message_from_bytes
+
+import fake_imap
+from email_processor import RulePack, build_or_tree, build_server_filter
+
+
+def mailbox_entries(messages):
+    return [{'uid': uid, 'msg': message_from_bytes(raw), 'date': date, 'seen': False}
+            for uid, (raw, date) in enumerate(messages, 1)]
+
+
+def search(criteria, entries):
+    predicate = fake_imap._compile_search(fake_imap._tokenize_search(criteria), len(entries))
+    return [entry for entry in entries if predicate(entry)]
+
+
+def is_spam(entry):
+    sender = str(entry['msg']['From'])
+    return any(sender == template[0] for template in fake_imap.SPAM_TEMPLATES)
+
+
+def test_or_tree_is_balanced_binary():
+    assert build_or_tree(['A']) == 'A'
+    assert build_or_tree(['A', 'B', 'C', 'D']) == 'OR (OR (A) (B)) (OR (C) (D))'
+
+
+def test_generic_filter_keeps_receipts_and_drops_blocked_senders():
+    entries = mailbox_entries(fake_imap.generate_messages(200, spam_ratio=0.5, seed=7))
+    matched = search(build_server_filter(), entries)
+
+    receipts = [entry for entry in entries if not is_spam(entry)]
+    assert receipts and all(entry in matched for entry in receipts)
+    assert not any(is_spam(entry) for entry in matched)
+
+
+def test_gmail_filter_is_one_raw_query_excluding_promotions():
+    criteria = build_server_filter(gmail=True)
+    assert criteria.startswith('X-GM-RAW "') and criteria.count('"') % 2 == 0
+    assert '-category:promotions' in criteria
+
+    entries = mailbox_entries(fake_imap.generate_messages(100, spam_ratio=0.5, seed=3))
+    matched = search(criteria, entries)
+    assert all(entry in matched for entry in entries if not is_spam(entry))
+
+
+def test_filter_follows_the_rule_pack():
+    rules = RulePack(trusted_senders=[r'@shop\.example'], transaction_subject=['receipt'], blocked_senders=[])
+    assert build_server_filter(rules=rules) == '(OR (FROM "shop.example") (SUBJECT "receipt"))'
+    assert rules.server_filter() is rules.server_filter()
+
+
+def test_filter_misses_unknown_merchants_which_is_why_it_is_opt_in():
+    raw = fake_imap._build_message(1, 'Corner Cafe <billing@cornercafe.example>', 'Thanks for visiting',
+                                   'Amount charged: ₹180.00', fake_imap.datetime.now().astimezone())
+    assert search(build_server_filter(), mailbox_entries([(raw, fake_imap.datetime.now())])) == []